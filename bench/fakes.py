@@ -0,0 +1,196 @@
+# bench/fakes.py
+#
+# Локальные заменители внешних сервисов для офлайн-бенчмарка:
+#   прокси — HTTP-прокси с Basic-авторизацией; session id из имени
+#            пользователя ("<user>-session-<id>") передаёт дальше
+#            заголовком X-Bench-Session;
+#   ip-api — ответ в формате ip-api.com: выходной IP и город
+#            детерминированно зависят от session id;
+#   сайт   — цепочки переходов: 3xx, meta refresh, простой JS (его
+#            разбирает HTTP-уровень) и jsx — JS, которому нужен браузер.
+import time
+import json
+import base64
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SESSION_HEADER = "X-Bench-Session"
+CHAIN_KINDS = ("301", "302", "303", "307", "308", "meta", "js", "jsx")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+
+class _ProxyHandler(_Handler):
+    def _session(self):
+        auth = self.headers.get("Proxy-Authorization", "")
+        if not auth.startswith("Basic "):
+            return None
+        try:
+            user, _, password = base64.b64decode(auth[6:]).decode().partition(":")
+        except ValueError:
+            return None
+        name, sep, session = user.rpartition("-session-")
+        if password != self.server.password or name != self.server.username or not sep:
+            return None
+        return session
+
+    def do_GET(self):
+        session = self._session()
+        if session is None:
+            self._reply(407, headers={"Proxy-Authenticate": 'Basic realm="bench"'})
+            return
+        self.server.requests += 1
+        self._delay()
+
+        target = urlsplit(self.path)
+        headers = {k: v for k, v in self.headers.items() if k.lower() != "proxy-authorization"}
+        headers[SESSION_HEADER] = session
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=10)
+        try:
+            path = target.path + (f"?{target.query}" if target.query else "")
+            conn.request(self.command, path or "/", headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+            passthrough = {
+                k: v for k, v in resp.getheaders()
+                if k.lower() not in ("content-length", "transfer-encoding", "connection")
+            }
+        except OSError:
+            self._reply(502)
+            return
+        finally:
+            conn.close()
+        self._reply(resp.status, body, passthrough)
+
+    do_HEAD = do_GET
+
+    def do_CONNECT(self):
+        # стенды говорят только по http
+        self._reply(501)
+
+
+class _IpApiHandler(_Handler):
+    def do_GET(self):
+        self.server.requests += 1
+        self._delay()
+        session = self.headers.get(SESSION_HEADER, "")
+        digest = hashlib.sha1(session.encode()).digest()
+        moscow = int.from_bytes(digest[:4], "big") / 2**32 < self.server.moscow_ratio
+        body = json.dumps({
+            "status": "success",
+            "query": f"10.{digest[4]}.{digest[5]}.{digest[6]}",
+            "city": "Moscow" if moscow else "Kazan",
+            "isp": "Bench ISP",
+        }).encode()
+        self._reply(200, body, {"Content-Type": "application/json"})
+
+
+class _RedirectHandler(_Handler):
+    """
+    /c/<id>/<step> — шаг step цепочки server.chain; после последнего
+    шага — конечная страница. id нужен только для уникальности ссылок.
+    """
+    def do_GET(self):
+        self.server.requests += 1
+        self._delay()
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "c" or not parts[2].isdigit():
+            self._reply(404)
+            return
+        step = int(parts[2])
+        chain = self.server.chain
+        if step >= len(chain):
+            self._reply(200, b"<html><body>final</body></html>",
+                        {"Content-Type": "text/html; charset=utf-8"})
+            return
+
+        kind = chain[step]
+        next_url = f"/c/{parts[1]}/{step + 1}"
+        html = {
+            "meta": f'<meta http-equiv="refresh" content="0; url={next_url}">',
+            "js": f'<script>location.href = "{next_url}";</script>',
+            # адрес собирается в рантайме — регулярками HTTP-уровня не достать
+            "jsx": "<script>var u = [%s].join('/'); window.location.href = u;</script>"
+                   % ", ".join(f'"{p}"' for p in next_url.split("/")),
+        }.get(kind)
+        if html is None:
+            self._reply(int(kind), headers={"Location": next_url})
+        else:
+            self._reply(200, f"<html><head>{html}</head></html>".encode(),
+                        {"Content-Type": "text/html; charset=utf-8"})
+
+
+def _serve(handler, **attrs) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.latency = 0.0
+    for name, value in attrs.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _address(server) -> str:
+    host, port = server.server_address[:2]
+    return f"{host}:{port}"
+
+
+class Fakes:
+    """Поднимает все три стенда на свободных портах 127.0.0.1."""
+    def __init__(self, chain, moscow_ratio: float = 0.5, proxy_latency: float = 0.0,
+                 ipapi_latency: float = 0.0, site_latency: float = 0.0,
+                 username: str = "bench", password: str = "secret"):
+        unknown = [kind for kind in chain if kind not in CHAIN_KINDS]
+        if unknown:
+            raise ValueError(f"Неизвестные шаги цепочки: {unknown}")
+        self.proxy = _serve(_ProxyHandler, latency=proxy_latency,
+                            username=username, password=password)
+        self.ipapi = _serve(_IpApiHandler, latency=ipapi_latency, moscow_ratio=moscow_ratio)
+        self.site = _serve(_RedirectHandler, latency=site_latency, chain=list(chain))
+
+    def env(self) -> dict:
+        """Переменные окружения, направляющие config.py на стенды."""
+        return {
+            "PROXY_USERNAME": self.proxy.username,
+            "PROXY_PASSWORD": self.proxy.password,
+            "PROXY_DNS": _address(self.proxy),
+            "IP_API_URL": f"http://{_address(self.ipapi)}/json",
+            "GEO_RESOLVER": "ip-api",
+        }
+
+    def link(self, n: int) -> str:
+        return f"http://{_address(self.site)}/c/{n}/0"
+
+    def counters(self) -> dict:
+        return {
+            "proxy_requests": self.proxy.requests,
+            "ipapi_requests": self.ipapi.requests,
+            "site_requests": self.site.requests,
+        }
+
+    def close(self):
+        for server in (self.proxy, self.ipapi, self.site):
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,281 @@
+# bench/pipeline.py
+#
+# Офлайн-бенчмарк конвейера переходов: Dispatcher → process_queue_item →
+# fetch_redirect_async → write_behind на временной SQLite-БД, с локальными
+# прокси, ip-api и сайтом-редиректором из bench.fakes вместо внешних.
+#
+# Для каждого уровня параллельности запускается отдельный процесс
+# (конфиг читается при импорте, а пиковый RSS меряется на процесс);
+# печатаются переходы в минуту, p50/p95/p99 по стадиям и пиковый RSS.
+#
+#   python -m bench.pipeline --items 300 --levels 1,4,16 --chain 302,meta,js
+#   python -m bench.pipeline --chain 302,jsx --engine cdp    # с браузером
+#   python -m bench.pipeline --out bench_results.jsonl       # история прогонов
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import resource
+import functools
+import subprocess
+from datetime import datetime
+
+from bench.fakes import Fakes
+
+# total — от захвата задачи до записи, включая ожидание слота пула
+STAGES = ("total", "fetch", "proxy", "http_tier", "browser", "write")
+
+
+def _pct(values, p: float):
+    """Перцентиль методом ближайшего ранга (values отсортированы)."""
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[k]
+
+
+class StageTimer:
+    """Собирает длительности вызовов по стадиям, в миллисекундах."""
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def wrap(self, stage: str, fn):
+        samples = self.samples[stage]
+
+        @functools.wraps(fn)
+        def sync_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append((time.perf_counter() - started) * 1000)
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                samples.append((time.perf_counter() - started) * 1000)
+
+        return async_wrapper if asyncio.iscoroutinefunction(fn) else sync_wrapper
+
+    def summary(self) -> dict:
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            result[stage] = {
+                "n": len(ordered),
+                "p50": _pct(ordered, 50),
+                "p95": _pct(ordered, 95),
+                "p99": _pct(ordered, 99),
+            }
+        return result
+
+
+async def _run_level(args, fakes: Fakes) -> dict:
+    # импорт только здесь: config.py уже видит переменные окружения стендов
+    from sqlalchemy import select, func, insert
+    import tasks
+    import redirector
+    from cdp_engine import cdp_engine
+    from db import init_db, AsyncSessionLocal
+    from models import Queue, User, Event
+    from writer import write_behind
+
+    timer = StageTimer()
+    tasks.process_queue_item = timer.wrap("total", tasks.process_queue_item)
+    tasks.fetch_redirect_async = timer.wrap("fetch", tasks.fetch_redirect_async)
+    redirector._acquire_moscow_proxy = timer.wrap("proxy", redirector._acquire_moscow_proxy)
+    redirector.resolve_http = timer.wrap("http_tier", redirector.resolve_http)
+    redirector.trace_navigation = timer.wrap("browser", redirector.trace_navigation)
+    cdp_engine.visit = timer.wrap("browser", cdp_engine.visit)
+    write_behind.submit = timer.wrap("write", write_behind.submit)
+
+    await init_db()
+    now = datetime.now()
+    async with AsyncSessionLocal() as session:
+        await session.execute(insert(User), [
+            {
+                "user_id": 1000 + u, "username": f"bench{u}", "role": "user",
+                "status": "activ", "transition_mode": "immediate",
+            }
+            for u in range(args.users)
+        ])
+        await session.execute(insert(Queue), [
+            {
+                "user_id": 1000 + n % args.users,
+                "message_id": n,
+                "url": fakes.link(n),
+                "transition_time": now,
+                "status": "pending",
+            }
+            for n in range(args.items)
+        ])
+        await session.commit()
+
+    write_behind.start()
+    # без jsx-шагов браузер не понадобится — и Chrome на стенде может не быть
+    if "jsx" in args.chain:
+        await redirector.start_browser()
+    await tasks.dispatcher.load()
+
+    started = time.perf_counter()
+    run = asyncio.create_task(tasks.dispatcher.run(None))
+    try:
+        while True:
+            await asyncio.sleep(0.1)
+            async with AsyncSessionLocal() as session:
+                left = await session.scalar(
+                    select(func.count()).select_from(Queue).where(Queue.status != "done")
+                )
+            if not left:
+                break
+            if time.perf_counter() - started > args.deadline:
+                print(f"Не уложились в {args.deadline} с: осталось {left}", file=sys.stderr)
+                break
+        elapsed = time.perf_counter() - started
+    finally:
+        run.cancel()
+        await write_behind.close()
+        if "jsx" in args.chain:
+            await redirector.close_browser()
+
+    async with AsyncSessionLocal() as session:
+        states = dict((await session.execute(
+            select(Event.state, func.count()).group_by(Event.state)
+        )).all())
+        tiers = dict((await session.execute(
+            select(Event.tier, func.count()).where(Event.tier.isnot(None)).group_by(Event.tier)
+        )).all())
+
+    done = sum(states.values())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "concurrency": args.concurrency,
+        "items": args.items,
+        "done": done,
+        "elapsed_s": elapsed,
+        "per_minute": done / elapsed * 60 if elapsed else None,
+        "states": states,
+        "tiers": tiers,
+        # ru_maxrss в Linux — в килобайтах; у детей — максимум по одному процессу
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "peak_child_rss_mb": children.ru_maxrss / 1024,
+        "stages": timer.summary(),
+        **fakes.counters(),
+    }
+
+
+def child(args):
+    fakes = Fakes(
+        args.chain.split(","),
+        moscow_ratio=args.moscow_ratio,
+        proxy_latency=args.proxy_latency / 1000,
+        ipapi_latency=args.ipapi_latency / 1000,
+        site_latency=args.site_latency / 1000,
+    )
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.update(fakes.env())
+    os.environ.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+        "WORKER_CONCURRENCY": str(args.concurrency),
+        "DRIVER_POOL_SIZE": str(args.concurrency),
+        "BROWSER_ENGINE": args.engine,
+        "CHECK_INTERVAL": "0",
+        "PROXY_RESERVOIR_SIZE": "0",
+        "PROXY_RACE_WIDTH": str(args.race_width),
+        "REDIRECT_QUIET_WINDOW": str(args.quiet_window),
+    })
+    try:
+        result = asyncio.run(_run_level(args, fakes))
+    finally:
+        fakes.close()
+    print(json.dumps(result))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value):
+    return "—" if value is None else f"{value:.0f}"
+
+
+def report(results):
+    print(f"\n{'conc':>5} {'done':>6} {'сек':>7} {'в мин':>8} {'RSS, МБ':>8}  состояния")
+    for r in results:
+        print(
+            f"{r['concurrency']:>5} {r['done']:>6} {r['elapsed_s']:>7.1f} "
+            f"{_fmt(r['per_minute']):>8} {r['peak_rss_mb']:>8.0f}  {r['states']}"
+        )
+    print(f"\n{'conc':>5} {'стадия':<10} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8}  (мс)")
+    for r in results:
+        for stage in STAGES:
+            s = r["stages"].get(stage)
+            if s:
+                print(
+                    f"{r['concurrency']:>5} {stage:<10} {s['n']:>6} {_fmt(s['p50']):>8} "
+                    f"{_fmt(s['p95']):>8} {_fmt(s['p99']):>8}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера переходов")
+    parser.add_argument("--items", type=int, default=200, help="задач на уровень")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--levels", default="1,4,16", help="уровни WORKER_CONCURRENCY")
+    parser.add_argument("--chain", default="302,301,meta,js",
+                        help="шаги цепочки: 301..308, meta, js, jsx (jsx — нужен браузер)")
+    parser.add_argument("--engine", default="selenium", choices=("selenium", "cdp"))
+    parser.add_argument("--moscow-ratio", type=float, default=0.5,
+                        help="доля прокси-сессий с московским IP")
+    parser.add_argument("--race-width", type=int, default=1)
+    parser.add_argument("--proxy-latency", type=float, default=20, help="мс на запрос")
+    parser.add_argument("--ipapi-latency", type=float, default=50, help="мс на запрос")
+    parser.add_argument("--site-latency", type=float, default=10, help="мс на запрос")
+    parser.add_argument("--quiet-window", type=float, default=0.5)
+    parser.add_argument("--deadline", type=float, default=600, help="лимит на уровень, с")
+    parser.add_argument("--out", default=None, help="дописать результаты в JSONL-файл")
+    parser.add_argument("--concurrency", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.concurrency is not None:
+        child(args)
+        return
+
+    results = []
+    for level in (int(x) for x in args.levels.split(",")):
+        print(f"Уровень {level}…", flush=True)
+        cmd = [sys.executable, "-m", "bench.pipeline", *sys.argv[1:], "--concurrency", str(level)]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            sys.exit(f"Уровень {level} завершился с кодом {proc.returncode}")
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    report(results)
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps({
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                    "commit": _git_commit(),
+                    "chain": args.chain,
+                    "engine": args.engine,
+                    **r,
+                }) + "\n")
+
+
+if __name__ == "__main__":
+    main()
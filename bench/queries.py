@@ -0,0 +1,142 @@
+# bench/queries.py
+#
+# Бенчмарк горячих запросов к queue/events: планы (EXPLAIN QUERY PLAN)
+# и время выполнения на синтетической SQLite-БД до и после индексов.
+#
+#   python -m bench.queries --events 3000000 --users 200
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from models import Base
+
+STATES = ["success"] * 6 + ["proxy_error", "redirector_error", "no_link", "many_links"]
+CHUNK = 50_000
+
+
+def _ts(dt: datetime) -> str:
+    # так SQLAlchemy хранит DateTime в SQLite
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def fill(conn, n_events: int, n_users: int):
+    now = datetime.now()
+    span = 365 * 24 * 3600
+    conn.executemany(
+        "INSERT INTO users (user_id, username, role, status, transition_mode) "
+        "VALUES (?, ?, 'user', 'activ', 'immediate')",
+        [(u, f"user{u}") for u in range(1, n_users + 1)],
+    )
+    for start in range(0, n_events, CHUNK):
+        rows = [
+            (
+                random.randint(1, n_users),
+                random.choice(STATES),
+                "https://example.com/a",
+                "https://example.org/b",
+                _ts(now - timedelta(seconds=random.randint(0, span))),
+            )
+            for _ in range(min(CHUNK, n_events - start))
+        ]
+        conn.executemany(
+            "INSERT INTO events (user_id, state, initial_url, final_url, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    n_queue = max(n_events // 20, 1)
+    for start in range(0, n_queue, CHUNK):
+        rows = []
+        for _ in range(min(CHUNK, n_queue - start)):
+            # основная масса очереди — уже выполненные задачи
+            status = random.choices(["done", "pending", "in_progress"], [95, 4, 1])[0]
+            t = now + timedelta(seconds=random.randint(-span, 86400))
+            rows.append((random.randint(1, n_users), 1, "https://example.com/a", _ts(t), status))
+        conn.executemany(
+            "INSERT INTO queue (user_id, message_id, url, transition_time, status) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    conn.commit()
+
+
+def queries(n_users: int):
+    now = datetime.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    week_start = (now - timedelta(days=now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    uid = random.randint(1, n_users)
+    return [
+        ("tick", "SELECT id FROM queue WHERE status = 'pending' AND transition_time <= ?",
+         (_ts(now),)),
+        ("on_queue", "SELECT * FROM queue WHERE user_id = ? "
+         "AND status IN ('pending', 'in_progress') ORDER BY transition_time", (uid,)),
+        ("stats_total", "SELECT count(*) FROM events WHERE user_id = ? AND state = 'success'",
+         (uid,)),
+        ("stats_month", "SELECT count(*) FROM events WHERE user_id = ? AND state = 'success' "
+         "AND timestamp >= ?", (uid, _ts(month_start))),
+        ("stats_week", "SELECT count(*) FROM events WHERE user_id = ? AND state = 'success' "
+         "AND timestamp >= ?", (uid, _ts(week_start))),
+        ("history", "SELECT * FROM events WHERE user_id = ? "
+         "AND state IN ('success', 'proxy_error') ORDER BY timestamp DESC LIMIT 20", (uid,)),
+    ]
+
+
+def run(conn, n_users: int, repeat: int, title: str):
+    print(f"\n=== {title} ===")
+    for name, sql, params in queries(n_users):
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{name:12} {statistics.median(timings):9.2f} ms")
+        for row in plan:
+            print(f"{'':12} {row[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих запросов queue/events")
+    parser.add_argument("--events", type=int, default=3_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", default=None, help="путь к файлу БД (по умолчанию временный)")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+
+    hot = [t.indexes for t in (Base.metadata.tables["queue"], Base.metadata.tables["events"])]
+    indexes = [index for group in hot for index in group]
+    for index in indexes:
+        index.drop(engine, checkfirst=True)
+
+    conn = sqlite3.connect(path)
+    print(f"Заполняем {path}: {args.events} events, {args.users} users…")
+    started = time.perf_counter()
+    fill(conn, args.events, args.users)
+    print(f"готово за {time.perf_counter() - started:.1f} с")
+
+    conn.execute("ANALYZE")
+    run(conn, args.users, args.repeat, "без индексов")
+
+    conn.close()
+    for index in indexes:
+        index.create(engine, checkfirst=True)
+    conn = sqlite3.connect(path)
+    conn.execute("ANALYZE")
+    run(conn, args.users, args.repeat, "с индексами")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,563 @@
+# cdp_engine.py
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+from urllib.parse import urlparse, unquote
+
+from wsproto import WSConnection, ConnectionType
+from wsproto.events import (
+    Request,
+    AcceptConnection,
+    RejectConnection,
+    TextMessage,
+    Ping,
+    CloseConnection,
+)
+
+from config import CHROME_BINARY, CDP_MAX_CONTEXTS, BLOCK_RESOURCE_TYPES, BLOCK_DOMAINS
+from driver_pool import STEALTH_SCRIPT, device_script, blocked_host
+from tracer import MAX_HOPS
+from metrics import timed, BROWSER_LAUNCH_SECONDS, REDIRECT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CHROME_CANDIDATES = (
+    "google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome",
+)
+CHROME_ARGS = (
+    "--headless=new",
+    "--remote-debugging-port=0",
+    "--no-first-run",
+    "--no-default-browser-check",
+    "--disable-gpu",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-blink-features=AutomationControlled",
+)
+# Сколько ждать, пока Chrome откроет DevTools-порт, секунды
+LAUNCH_TIMEOUT = 30
+
+# Тип ресурса из BLOCK_RESOURCE_TYPES → resourceType в CDP
+RESOURCE_TYPES = {
+    "image": ("Image",),
+    "font": ("Font",),
+    "media": ("Media", "TextTrack"),
+    "style": ("Stylesheet",),
+    "script": ("Script",),
+    "manifest": ("Manifest",),
+}
+BLOCKED_TYPES = frozenset(
+    t for kind in BLOCK_RESOURCE_TYPES for t in RESOURCE_TYPES.get(kind, (kind.capitalize(),))
+)
+
+
+class CdpError(Exception):
+    """Chrome вернул ошибку на команду DevTools."""
+
+
+class CdpConnection:
+    """
+    Websocket-соединение с DevTools браузера (flat-режим сессий):
+    send() ждёт ответа на команду, события раскладываются по очередям
+    listen(session_id). При разрыве ожидающие команды получают
+    ConnectionError, а очереди — None.
+    """
+    def __init__(self, reader, writer, ws):
+        self._reader = reader
+        self._writer = writer
+        self._ws = ws
+        self._next_id = 0
+        self._pending = {}
+        self._listeners = {}
+        self.closed = False
+        self._task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, ws_url: str):
+        parsed = urlparse(ws_url)
+        reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port)
+        ws = WSConnection(ConnectionType.CLIENT)
+        writer.write(ws.send(Request(host=parsed.netloc, target=parsed.path)))
+        await writer.drain()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                writer.close()
+                raise ConnectionError("DevTools закрыл соединение при рукопожатии")
+            ws.receive_data(data)
+            for event in ws.events():
+                if isinstance(event, AcceptConnection):
+                    return cls(reader, writer, ws)
+                if isinstance(event, RejectConnection):
+                    writer.close()
+                    raise ConnectionError(f"DevTools отклонил соединение: {event.status_code}")
+
+    async def _read_loop(self):
+        parts = []
+        try:
+            while True:
+                data = await self._reader.read(65536)
+                if not data:
+                    return
+                self._ws.receive_data(data)
+                for event in self._ws.events():
+                    if isinstance(event, TextMessage):
+                        parts.append(event.data)
+                        if event.message_finished:
+                            self._dispatch(json.loads("".join(parts)))
+                            parts.clear()
+                    elif isinstance(event, Ping):
+                        self._writer.write(self._ws.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._fail_all()
+
+    def _dispatch(self, msg: dict):
+        if "id" in msg:
+            fut = self._pending.pop(msg["id"], None)
+            if fut is None or fut.done():
+                return
+            if "error" in msg:
+                fut.set_exception(CdpError(msg["error"].get("message")))
+            else:
+                fut.set_result(msg.get("result", {}))
+            return
+        queue = self._listeners.get(msg.get("sessionId"))
+        if queue is not None:
+            queue.put_nowait((msg["method"], msg.get("params", {})))
+
+    def _fail_all(self):
+        self.closed = True
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("DevTools-соединение закрыто"))
+        self._pending.clear()
+        for queue in self._listeners.values():
+            queue.put_nowait(None)
+
+    async def send(self, method: str, params: dict = None, session_id: str = None) -> dict:
+        if self.closed:
+            raise ConnectionError("DevTools-соединение закрыто")
+        self._next_id += 1
+        msg = {"id": self._next_id, "method": method, "params": params or {}}
+        if session_id is not None:
+            msg["sessionId"] = session_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = fut
+        self._writer.write(self._ws.send(TextMessage(data=json.dumps(msg))))
+        await self._writer.drain()
+        return await fut
+
+    def listen(self, session_id: str) -> asyncio.Queue:
+        queue = self._listeners[session_id] = asyncio.Queue()
+        return queue
+
+    def unlisten(self, session_id: str):
+        self._listeners.pop(session_id, None)
+
+    async def close(self):
+        if not self.closed:
+            try:
+                self._writer.write(self._ws.send(CloseConnection(code=1000)))
+            except Exception:
+                pass
+        self._writer.close()
+        try:
+            await self._task
+        except Exception:
+            pass
+
+
+class ChromeBrowser:
+    """Процесс Chrome, запущенный нами без chromedriver, и соединение с ним."""
+    def __init__(self, proc, conn: CdpConnection, profile_dir: str):
+        self.proc = proc
+        self.conn = conn
+        self.profile_dir = profile_dir
+        # сколько контекстов создано / сколько переходов идёт сейчас
+        self.uses = 0
+        self.active = 0
+
+    @classmethod
+    async def launch(cls, binary: str):
+        started = time.monotonic()
+        profile_dir = tempfile.mkdtemp(prefix="cdp-chrome-")
+        proc = await asyncio.create_subprocess_exec(
+            binary, *CHROME_ARGS, f"--user-data-dir={profile_dir}", "about:blank",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            ws_url = await cls._wait_devtools(proc, profile_dir)
+            conn = await CdpConnection.connect(ws_url)
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        BROWSER_LAUNCH_SECONDS.observe(time.monotonic() - started, engine="cdp")
+        return cls(proc, conn, profile_dir)
+
+    @staticmethod
+    async def _wait_devtools(proc, profile_dir: str) -> str:
+        """
+        Chrome с --remote-debugging-port=0 сам выбирает порт и пишет его
+        (и путь websocket-а браузера) в DevToolsActivePort профиля.
+        """
+        port_file = os.path.join(profile_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + LAUNCH_TIMEOUT
+        while time.monotonic() < deadline:
+            if proc.returncode is not None:
+                raise RuntimeError(f"Chrome завершился при запуске: код {proc.returncode}")
+            try:
+                with open(port_file, encoding="utf-8") as f:
+                    lines = f.read().split()
+            except FileNotFoundError:
+                lines = []
+            if len(lines) >= 2:
+                return f"ws://127.0.0.1:{lines[0]}{lines[1]}"
+            await asyncio.sleep(0.1)
+        raise RuntimeError("Chrome не открыл DevTools-порт вовремя")
+
+    async def close(self):
+        try:
+            await asyncio.wait_for(self.conn.send("Browser.close"), timeout=5)
+        except Exception:
+            pass
+        await self.conn.close()
+        if self.proc.returncode is None:
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+                await self.proc.wait()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+def _header(headers: dict, name: str):
+    name = name.lower()
+    return next((v for k, v in (headers or {}).items() if k.lower() == name), None)
+
+
+class _Visit:
+    """
+    Один переход в отдельном browser context: свой прокси (с
+    авторизацией через Fetch.authRequired), эмуляция устройства,
+    блокировка ресурсов и трассировка навигаций основного фрейма.
+    """
+    def __init__(self, conn: CdpConnection, proxy_auth: str, device: dict):
+        self.conn = conn
+        self.device = device
+        proxy = urlparse(proxy_auth)
+        self.proxy_server = f"{proxy.scheme}://{proxy.hostname}:{proxy.port}"
+        self.username = unquote(proxy.username or "")
+        self.password = unquote(proxy.password or "")
+        self.session = None
+        self.authed = set()
+
+    async def _send(self, method: str, params: dict = None) -> dict:
+        return await self.conn.send(method, params, session_id=self.session)
+
+    async def run(self, url: str, quiet_window: float, timeout: float, timings: dict = None):
+        with timed(timings, "browser_start"):
+            res = await self.conn.send(
+                "Target.createBrowserContext",
+                {"proxyServer": self.proxy_server, "disposeOnDetach": True},
+            )
+        context_id = res["browserContextId"]
+        try:
+            with timed(timings, "browser_start"):
+                res = await self.conn.send(
+                    "Target.createTarget",
+                    {"url": "about:blank", "browserContextId": context_id},
+                )
+                target_id = res["targetId"]
+                res = await self.conn.send(
+                    "Target.attachToTarget", {"targetId": target_id, "flatten": True}
+                )
+                self.session = res["sessionId"]
+            events = self.conn.listen(self.session)
+            try:
+                with timed(timings, "browser_start"):
+                    await self._setup()
+                # id основного фрейма вкладки совпадает с id цели
+                with timed(timings, "page", REDIRECT_WAIT_SECONDS, tier="browser"):
+                    return await self._trace(events, target_id, url, quiet_window, timeout)
+            finally:
+                self.conn.unlisten(self.session)
+        finally:
+            # вместе с контекстом уходят его cookies, кэш и storage
+            try:
+                await self.conn.send(
+                    "Target.disposeBrowserContext", {"browserContextId": context_id}
+                )
+            except (CdpError, ConnectionError):
+                pass
+
+    async def _setup(self):
+        device = self.device
+        css_w, css_h = device["css_size"]
+        await asyncio.gather(
+            self._send("Network.enable"),
+            self._send("Page.enable"),
+            # все запросы проходят через requestPaused: там блокировка
+            # ресурсов, а authRequired — авторизация на прокси
+            self._send("Fetch.enable", {
+                "handleAuthRequests": True,
+                "patterns": [{"urlPattern": "*"}],
+            }),
+            self._send("Network.setUserAgentOverride", {
+                "userAgent": device["ua"],
+                "platform": device["platform"],
+                "acceptLanguage": "ru-RU,ru",
+            }),
+            self._send("Emulation.setDeviceMetricsOverride", {
+                "width": css_w,
+                "height": css_h,
+                "deviceScaleFactor": device["dpr"],
+                "mobile": device["mobile"],
+            }),
+            self._send("Page.addScriptToEvaluateOnNewDocument", {
+                "source": STEALTH_SCRIPT + ";" + device_script(device["platform"]),
+            }),
+        )
+
+    async def _on_request_paused(self, params: dict):
+        request_id = params["requestId"]
+        host = urlparse(params["request"]["url"]).hostname or ""
+        try:
+            if params.get("resourceType") in BLOCKED_TYPES or (
+                BLOCK_DOMAINS and blocked_host(host)
+            ):
+                await self._send("Fetch.failRequest", {
+                    "requestId": request_id, "errorReason": "BlockedByClient",
+                })
+            else:
+                await self._send("Fetch.continueRequest", {"requestId": request_id})
+        except CdpError:
+            # запрос успел отмениться (например, новая навигация)
+            pass
+
+    async def _on_auth_required(self, params: dict):
+        request_id = params["requestId"]
+        challenge = params.get("authChallenge", {})
+        # второй запрос авторизации на тот же запрос — креды не подошли
+        if challenge.get("source") == "Proxy" and request_id not in self.authed:
+            self.authed.add(request_id)
+            response = {
+                "response": "ProvideCredentials",
+                "username": self.username,
+                "password": self.password,
+            }
+        else:
+            response = {"response": "CancelAuth"}
+        try:
+            await self._send("Fetch.continueWithAuth", {
+                "requestId": request_id, "authChallengeResponse": response,
+            })
+        except CdpError:
+            pass
+
+    async def _navigate(self, url: str):
+        try:
+            await self._send("Page.navigate", {"url": url})
+        except (CdpError, ConnectionError):
+            # как и в selenium-ветке: ошибка загрузки не отменяет трассировку
+            pass
+
+    async def _trace(self, events, frame_id: str, url: str, quiet_window: float, timeout: float):
+        """
+        То же, что tracer.trace_navigation, но по событиям Network/Page:
+        цепочка завершена, когда у всех навигаций основного фрейма есть
+        ответ и quiet_window секунд не было новых навигаций и смены URL.
+        Возвращает (final_url|None, hops, proxy_bytes).
+        """
+        started = time.monotonic()
+        last_activity = started
+        hops = []
+        current = {}   # requestId -> (хоп, timestamp запроса); при редиректе id тот же
+        pending = set()
+        final_url = None
+        proxy_bytes = 0
+        first_ts = None
+
+        # Page.navigate отвечает только после коммита навигации, а до этого
+        # запросы ждут Fetch.continueRequest — поэтому ответ ждём в фоне
+        navigate = asyncio.create_task(self._navigate(url))
+        try:
+            while True:
+                now = time.monotonic()
+                if hops and not pending and now - last_activity >= quiet_window:
+                    break
+                if now - started >= timeout:
+                    break
+                wait = timeout - (now - started)
+                if hops and not pending:
+                    wait = min(wait, quiet_window - (now - last_activity))
+                try:
+                    item = await asyncio.wait_for(events.get(), timeout=wait)
+                except asyncio.TimeoutError:
+                    continue
+                if item is None:
+                    raise ConnectionError("Chrome закрыл DevTools-соединение")
+                method, params = item
+
+                if method == "Fetch.requestPaused":
+                    await self._on_request_paused(params)
+                elif method == "Fetch.authRequired":
+                    await self._on_auth_required(params)
+                elif method == "Network.requestWillBeSent":
+                    if params.get("type") != "Document" or params.get("frameId") != frame_id:
+                        continue
+                    request_id = params["requestId"]
+                    ts = params["timestamp"]
+                    if first_ts is None:
+                        first_ts = ts
+                    redirect = params.get("redirectResponse")
+                    if redirect is not None:
+                        proxy_bytes += redirect.get("encodedDataLength", 0)
+                        if request_id in current:
+                            hop, hop_ts = current[request_id]
+                            hop["status"] = redirect.get("status")
+                            hop["location"] = _header(redirect.get("headers"), "Location")
+                            hop["dur"] = int((ts - hop_ts) * 1000)
+                    if len(hops) >= MAX_HOPS:
+                        current.pop(request_id, None)
+                        pending.discard(request_id)
+                        continue
+                    hop = {
+                        "url": params["request"]["url"],
+                        "status": None,
+                        "location": None,
+                        "ms": int((ts - first_ts) * 1000),
+                        "dur": None,
+                    }
+                    hops.append(hop)
+                    current[request_id] = (hop, ts)
+                    pending.add(request_id)
+                    last_activity = time.monotonic()
+                elif method == "Network.responseReceived":
+                    request_id = params["requestId"]
+                    if request_id in pending:
+                        hop, hop_ts = current[request_id]
+                        response = params["response"]
+                        hop["status"] = response.get("status")
+                        hop["location"] = _header(response.get("headers"), "Location")
+                        hop["dur"] = int((params["timestamp"] - hop_ts) * 1000)
+                        pending.discard(request_id)
+                        last_activity = time.monotonic()
+                elif method == "Network.loadingFinished":
+                    proxy_bytes += params.get("encodedDataLength", 0)
+                elif method == "Network.loadingFailed":
+                    if params["requestId"] in pending:
+                        pending.discard(params["requestId"])
+                        last_activity = time.monotonic()
+                elif method == "Page.frameNavigated":
+                    frame = params["frame"]
+                    if frame["id"] == frame_id:
+                        final_url = frame["url"]
+                        last_activity = time.monotonic()
+                elif method == "Page.navigatedWithinDocument":
+                    # смена URL через history API — тоже активность
+                    if params.get("frameId") == frame_id:
+                        final_url = params["url"]
+                        last_activity = time.monotonic()
+        finally:
+            navigate.cancel()
+
+        if final_url is None and hops:
+            final_url = hops[-1]["url"]
+        return final_url, hops, proxy_bytes
+
+
+class CdpEngine:
+    """
+    Браузерный движок без chromedriver и потоков: один Chrome, которым
+    управляем по DevTools-websocket прямо из event loop. Каждый переход —
+    отдельный browser context со своим прокси, cookies, кэшем и storage;
+    контекст удаляется по окончании, так что сброс между переходами
+    не нужен, а десятки переходов идут параллельно.
+
+    После max_contexts переходов Chrome перезапускается: новые переходы
+    уходят в свежий процесс, старый закрывается, когда закончатся его
+    текущие переходы. Упавший Chrome перезапускается при следующем visit().
+    """
+    def __init__(self, binary: str, max_contexts: int):
+        self.binary = binary
+        self.max_contexts = max_contexts
+        self._browser = None
+        self._retired = set()
+        self._lock = asyncio.Lock()
+
+    def _find_binary(self) -> str:
+        if self.binary:
+            return self.binary
+        for name in CHROME_CANDIDATES:
+            path = shutil.which(name)
+            if path:
+                return path
+        raise RuntimeError("Chrome не найден: задайте CHROME_BINARY")
+
+    async def _current(self) -> ChromeBrowser:
+        async with self._lock:
+            browser = self._browser
+            if browser is not None and (
+                browser.conn.closed or browser.uses >= self.max_contexts
+            ):
+                self._browser = None
+                if browser.active:
+                    self._retired.add(browser)
+                else:
+                    await browser.close()
+            if self._browser is None:
+                self._browser = await ChromeBrowser.launch(self._find_binary())
+                logger.info("Chrome для CDP-движка запущен (pid %s)", self._browser.proc.pid)
+            return self._browser
+
+    async def start(self):
+        """Запускает Chrome заранее, чтобы первый переход не ждал старта."""
+        await self._current()
+
+    async def visit(self, url: str, proxy_auth: str, device: dict,
+                    quiet_window: float, timeout: float, timings: dict = None):
+        """
+        Открывает url через прокси proxy_auth с эмуляцией device и следит
+        за цепочкой навигаций. Возвращает (final_url|None, hops, proxy_bytes).
+        В timings добавляются стадии browser_start и page, в мс.
+        """
+        with timed(timings, "browser_start"):
+            browser = await self._current()
+        browser.uses += 1
+        browser.active += 1
+        try:
+            return await _Visit(browser.conn, proxy_auth, device).run(
+                url, quiet_window, timeout, timings
+            )
+        finally:
+            browser.active -= 1
+            if not browser.active and browser in self._retired:
+                self._retired.discard(browser)
+                await browser.close()
+
+    async def close(self):
+        async with self._lock:
+            browsers = list(self._retired)
+            if self._browser is not None:
+                browsers.append(self._browser)
+            self._browser = None
+            self._retired.clear()
+        for browser in browsers:
+            await browser.close()
+
+
+# Общий движок процесса (используется при BROWSER_ENGINE=cdp)
+cdp_engine = CdpEngine(CHROME_BINARY, CDP_MAX_CONTEXTS)
@@ -1,6 +1,7 @@
 # config.py
 
 import os
+import socket
 
 # ======================
 # Telegram Bot Settings
@@ -12,6 +13,23 @@ INITIAL_ADMIN  = os.getenv("INITIAL_ADMIN",  "F_Stepanov")
 # Database Settings
 # ======================
 DATABASE_URL   = os.getenv("DATABASE_URL",   "sqlite+aiosqlite:///./app.db")
+# Отложенная запись Event/ProxyLog: размер пачки и макс. задержка, секунды
+WRITE_BATCH_SIZE     = int(os.getenv("WRITE_BATCH_SIZE",       "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.5"))
+# Сколько раз пробовать записать группу без ожидающего (write_behind.add),
+# если она не пишется и отдельной транзакцией
+WRITE_MAX_ATTEMPTS   = int(os.getenv("WRITE_MAX_ATTEMPTS",     "3"))
+# Сколько секунд хэндлеры доверяют кэшу пользователей
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+# ======================
+# Device Catalog
+# ======================
+DEVICES_FILE             = os.getenv("DEVICES_FILE", "devices.json")
+# Как часто проверять, не изменился ли DEVICES_FILE, секунды
+DEVICE_RELOAD_INTERVAL   = int(os.getenv("DEVICE_RELOAD_INTERVAL", "10"))
+# 1 — умножать вес устройства на его долю успешных переходов
+DEVICE_WEIGHT_BY_SUCCESS = os.getenv("DEVICE_WEIGHT_BY_SUCCESS", "0") == "1"
 
 # ======================
 # Proxy / IP-API Settings
@@ -25,10 +43,180 @@ PROXY_DNS      = os.getenv("PROXY_DNS",      "165.154.179.147:2334")
 
 # URL для определения ISP/IP по IP-адресу
 IP_API_URL     = os.getenv("IP_API_URL",     "http://ip-api.com/json")
+# Откуда брать город/ISP выходного IP: "ip-api" (IP_API_URL на каждую
+# попытку) или "local" (IP_ECHO_URL + локальная база GEOIP_DB)
+GEO_RESOLVER     = os.getenv("GEO_RESOLVER",     "ip-api")
+IP_ECHO_URL      = os.getenv("IP_ECHO_URL",      "https://api.ipify.org")
+# .mmdb (нужен пакет maxminddb) или база, собранная `python geoip.py build`
+GEOIP_DB         = os.getenv("GEOIP_DB",         "geoip-sample.bin")
+# Сколько IP держать в LRU-кэше результатов
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "4096"))
 
 # ======================
 # Timing & Retry Limits
 # ======================
 CHECK_INTERVAL     = int(os.getenv("CHECK_INTERVAL",     "1"))
 REDIRECT_TIMEOUT   = int(os.getenv("REDIRECT_TIMEOUT",   "20"))
+# Цепочка редиректов считается завершённой после стольких секунд без навигаций
+REDIRECT_QUIET_WINDOW = float(os.getenv("REDIRECT_QUIET_WINDOW", "2"))
 MAX_PROXY_ATTEMPTS = int(os.getenv("MAX_PROXY_ATTEMPTS", "10"))
+# Сколько прокси-сессий проверять параллельно (1 — по одной, как раньше)
+PROXY_RACE_WIDTH   = int(os.getenv("PROXY_RACE_WIDTH",   "1"))
+
+# Резерв заранее проверенных московских сессий (0 — выключен)
+PROXY_RESERVOIR_SIZE            = int(os.getenv("PROXY_RESERVOIR_SIZE",              "0"))
+# Сколько секунд проверенная сессия считается свежей
+PROXY_RESERVOIR_TTL             = int(os.getenv("PROXY_RESERVOIR_TTL",               "120"))
+# Пауза между пополнениями резерва, секунды
+PROXY_RESERVOIR_REFILL_INTERVAL = float(os.getenv("PROXY_RESERVOIR_REFILL_INTERVAL", "1"))
+
+# ======================
+# Worker Pool
+# ======================
+# Сколько переходов выполняется одновременно (1 — по одному, как раньше)
+WORKER_CONCURRENCY      = int(os.getenv("WORKER_CONCURRENCY",      "1"))
+# Лимит одновременных переходов на один целевой домен (0 — без лимита)
+WORKER_PER_DOMAIN_LIMIT = int(os.getenv("WORKER_PER_DOMAIN_LIMIT", "0"))
+# Лимит одновременных переходов одного пользователя (0 — без лимита)
+WORKER_PER_USER_LIMIT   = int(os.getenv("WORKER_PER_USER_LIMIT",   "0"))
+# 1 — бот сам выполняет переходы; 0 — только принимает ссылки и
+# доставляет результаты, переходы делают отдельные процессы worker.py
+RUN_WORKERS             = os.getenv("RUN_WORKERS", "1") == "1"
+# Как часто worker.py ищет в БД новые задачи от бота, секунды
+WORKER_POLL_INTERVAL    = float(os.getenv("WORKER_POLL_INTERVAL",  "2"))
+# Как часто бот проверяет outbox на результаты от воркеров, секунды
+NOTIFY_INTERVAL         = int(os.getenv("NOTIFY_INTERVAL",         "3"))
+# Период страховочного прохода по очереди, секунды
+# (основной запуск задач — событийный диспетчер)
+TICK_INTERVAL           = int(os.getenv("TICK_INTERVAL",           "300"))
+
+# Идентификатор процесса-воркера для аренды задач очереди
+WORKER_ID       = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# На сколько секунд захватывается задача; продлевается heartbeat-ом
+LEASE_TTL       = int(os.getenv("LEASE_TTL",       "60"))
+LEASE_HEARTBEAT = int(os.getenv("LEASE_HEARTBEAT", "20"))
+
+# ======================
+# Bulk Links
+# ======================
+# Сколько ссылок принимается из одного сообщения или файла
+BULK_MAX_LINKS      = int(os.getenv("BULK_MAX_LINKS",      "1000"))
+# Максимальный размер загружаемого .txt/.csv, байт
+BULK_MAX_FILE_BYTES = int(os.getenv("BULK_MAX_FILE_BYTES", "1048576"))
+
+# ======================
+# Pagination
+# ======================
+# Сколько задач показывать на странице «⏳ Очередь»
+# (у каждой 2–3 ряда кнопок, а лимит Telegram — 100 кнопок на сообщение)
+QUEUE_PAGE_SIZE   = int(os.getenv("QUEUE_PAGE_SIZE",   "10"))
+# Сколько событий на странице «📜 История»
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# По сколько событий читать из БД при выгрузке CSV
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# ======================
+# Daily Slot Scheduler
+# ======================
+# Ширина слота, в который раскладываются daily-переходы, секунды
+SCHEDULE_SLOT_SECONDS       = int(os.getenv("SCHEDULE_SLOT_SECONDS",       "300"))
+# Сколько переходов помещается в слот; 0 — считать из ёмкости воркеров ниже
+SCHEDULE_SLOT_CAPACITY      = int(os.getenv("SCHEDULE_SLOT_CAPACITY",      "0"))
+# Сколько процессов выполняет переходы (бот с RUN_WORKERS=1 и/или worker.py),
+# у каждого WORKER_CONCURRENCY слотов
+SCHEDULE_WORKER_PROCESSES   = int(os.getenv("SCHEDULE_WORKER_PROCESSES",   "1"))
+# Средняя длительность одного перехода, секунды
+SCHEDULE_TRANSITION_SECONDS = float(os.getenv("SCHEDULE_TRANSITION_SECONDS", "30"))
+# Какую долю ёмкости занимать плановыми переходами — остальное
+# под immediate-ссылки и повторы
+SCHEDULE_TARGET_LOAD        = float(os.getenv("SCHEDULE_TARGET_LOAD",      "0.7"))
+
+# ======================
+# Retention
+# ======================
+# Через сколько дней events и proxy_logs уходят в архив; 0 (по умолчанию) —
+# хранить всё, архивирование включается явно
+RETENTION_DAYS         = int(os.getenv("RETENTION_DAYS",         "0"))
+# Через сколько дней в архив уходят события no_link / many_links
+RETENTION_NOISE_DAYS   = int(os.getenv("RETENTION_NOISE_DAYS",   "7"))
+# Куда складывать помесячные архивы <таблица>-YYYY-MM.jsonl.gz
+ARCHIVE_DIR            = os.getenv("ARCHIVE_DIR",                "archive")
+# Сколько строк переносить и удалять за одну транзакцию
+RETENTION_BATCH_SIZE   = int(os.getenv("RETENTION_BATCH_SIZE",   "500"))
+# Пауза между пачками, секунды — чтобы не держать БД занятой подряд
+RETENTION_BATCH_PAUSE  = float(os.getenv("RETENTION_BATCH_PAUSE", "0.2"))
+# Как часто запускать перенос, секунды
+RETENTION_INTERVAL     = int(os.getenv("RETENTION_INTERVAL",     "86400"))
+# Сколько страниц SQLite освобождать за один PRAGMA incremental_vacuum
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+# ======================
+# Chrome Driver Pool
+# ======================
+# Сколько Chrome держим запущенными одновременно; обычно равен
+# WORKER_CONCURRENCY — больше одновременно не нужно
+DRIVER_POOL_SIZE   = int(os.getenv("DRIVER_POOL_SIZE",   "1"))
+# Через сколько секунд простоя драйвер закрывается
+DRIVER_IDLE_TTL    = int(os.getenv("DRIVER_IDLE_TTL",    "600"))
+# После скольких переходов драйвер перезапускается (защита от утечек памяти)
+DRIVER_MAX_USES    = int(os.getenv("DRIVER_MAX_USES",    "50"))
+# Сколько последних запросов selenium-wire держит в памяти
+DRIVER_CAPTURE_MAX = int(os.getenv("DRIVER_CAPTURE_MAX", "100"))
+
+# Движок браузерного уровня: "selenium" (chromedriver + selenium-wire,
+# поток на переход) или "cdp" (свой Chrome по DevTools-websocket из event loop)
+BROWSER_ENGINE     = os.getenv("BROWSER_ENGINE",     "selenium")
+# Путь к Chrome для движка cdp (пусто — искать в PATH)
+CHROME_BINARY      = os.getenv("CHROME_BINARY",      "")
+# После скольких переходов движок cdp перезапускает Chrome
+CDP_MAX_CONTEXTS   = int(os.getenv("CDP_MAX_CONTEXTS", "500"))
+
+# Что не загружать в Chrome: типы ресурсов (image, font, media, style,
+# script, manifest) и домены (вместе с поддоменами), через запятую
+BLOCK_RESOURCE_TYPES = [
+    t.strip() for t in os.getenv("BLOCK_RESOURCE_TYPES", "image,font,media").split(",") if t.strip()
+]
+BLOCK_DOMAINS = [
+    d.strip() for d in os.getenv(
+        "BLOCK_DOMAINS",
+        "google-analytics.com,googletagmanager.com,doubleclick.net,mc.yandex.ru,connect.facebook.net"
+    ).split(",") if d.strip()
+]
+
+# ======================
+# HTTP Tier (переход без браузера)
+# ======================
+HTTP_TIER_ENABLED  = os.getenv("HTTP_TIER_ENABLED", "1") == "1"
+HTTP_TIER_MAX_HOPS = int(os.getenv("HTTP_TIER_MAX_HOPS", "10"))
+HTTP_TIER_TIMEOUT  = int(os.getenv("HTTP_TIER_TIMEOUT",  "10"))
+# Сколько байт HTML читаем в поисках meta refresh / location.href
+HTTP_TIER_MAX_BODY = int(os.getenv("HTTP_TIER_MAX_BODY", "262144"))
+
+# ======================
+# Notification Outbox
+# ======================
+# Общий лимит Telegram, сообщений в секунду
+NOTIFY_GLOBAL_RATE  = float(os.getenv("NOTIFY_GLOBAL_RATE",  "25"))
+# Лимит на один чат: сообщений в секунду и допустимый всплеск
+NOTIFY_CHAT_RATE    = float(os.getenv("NOTIFY_CHAT_RATE",    "1"))
+NOTIFY_CHAT_BURST   = float(os.getenv("NOTIFY_CHAT_BURST",   "1"))
+# Сколько секунд ждать соседние результаты того же чата, чтобы склеить их
+NOTIFY_MERGE_WINDOW = float(os.getenv("NOTIFY_MERGE_WINDOW", "1"))
+# После скольких неудачных попыток отправки сдаваться
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS",   "10"))
+# Пауза перед повтором после сбоя: NOTIFY_BACKOFF_BASE · 2^(попытка−1),
+# но не больше NOTIFY_BACKOFF_MAX секунд (10 попыток ≈ час без связи)
+NOTIFY_BACKOFF_BASE = float(os.getenv("NOTIFY_BACKOFF_BASE", "5"))
+NOTIFY_BACKOFF_MAX  = float(os.getenv("NOTIFY_BACKOFF_MAX",  "600"))
+# Сколько секунд хранить отправленные (или брошенные) строки outbox
+NOTIFY_KEEP_SENT    = int(os.getenv("NOTIFY_KEEP_SENT",      "86400"))
+
+# ======================
+# Metrics
+# ======================
+# Адрес эндпоинта GET /metrics (Prometheus); порт 0 — выключено.
+# Нескольким воркерам на одном хосте нужны разные порты
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Сколько последних событий с таймингами берёт отчёт «⏱ Задержки»
+LATENCY_REPORT_LIMIT = int(os.getenv("LATENCY_REPORT_LIMIT", "5000"))
@@ -1,11 +1,14 @@
 #db.py
 
 import json
+import time
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import select, func
-from config import DATABASE_URL, INITIAL_ADMIN
+from sqlalchemy import select, func, event
+from config import DATABASE_URL, INITIAL_ADMIN, DEVICES_FILE
 from models import Base, User, DeviceOption
+from migrations import run_migrations
+from metrics import DB_QUERY_SECONDS
 
 # Создаём асинхронный движок и сессию
 engine = create_async_engine(DATABASE_URL, echo=False, future=True)
@@ -13,16 +16,44 @@ AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+# Новые SQLite-файлы сразу создаются с auto_vacuum=INCREMENTAL, чтобы
+# retention.py мог возвращать место без полного VACUUM (на готовой БД
+# прагма без VACUUM ничего не меняет — см. python retention.py vacuum)
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_incremental_vacuum(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.close()
+
+# Время каждого SQL-запроса → гистограмма db_query_seconds{op}.
+# Начало хранится в контексте выполнения, а не в conn.info: упавший
+# запрос (after_cursor_execute не вызывается) ничего не оставляет
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    op = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+    DB_QUERY_SECONDS.observe(time.perf_counter() - started, op=op)
+
 async def init_db():
     """
     Инициализация БД:
-    1) Создаёт таблицы по всем моделям.
+    1) Создаёт таблицы по всем моделям и применяет миграции
+       (новые столбцы и индексы для уже существующих БД).
     2) Загружает device_options из devices.json, если таблица пуста.
     3) Добавляет initial admin в users со статусом pending, если нет.
     """
-    # 1) Создать таблицы
+    # 1) Создать таблицы и применить миграции
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
 
     # 2) Наполнить device_options и добавить админа
     async with AsyncSessionLocal() as session:
@@ -31,7 +62,7 @@ async def init_db():
             select(func.count()).select_from(DeviceOption)
         )
         if count == 0:
-            with open("devices.json", encoding="utf-8") as f:
+            with open(DEVICES_FILE, encoding="utf-8") as f:
                 data = json.load(f)
             for id_str, device in data.items():
                 session.add(DeviceOption(
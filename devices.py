@@ -0,0 +1,184 @@
+# devices.py
+
+import os
+import json
+import time
+import random
+import logging
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import DeviceOption
+from config import DEVICES_FILE, DEVICE_RELOAD_INTERVAL, DEVICE_WEIGHT_BY_SUCCESS
+
+logger = logging.getLogger(__name__)
+
+DEVICE_FIELDS = ("ua", "css_size", "platform", "dpr", "mobile", "model")
+
+
+def build_alias(weights):
+    """
+    Таблицы alias-метода (Vose) для выборки за O(1).
+    Возвращает (prob, alias) — списки длины len(weights); для пустого
+    списка — ([], []). Отрицательные веса считаются нулевыми, а если все
+    веса нулевые — выборка равномерная.
+    """
+    n = len(weights)
+    if not n:
+        return [], []
+    weights = [max(float(w), 0.0) for w in weights]
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1.0] * n, float(n)
+    scaled = [w * n / total for w in weights]
+    prob = [0.0] * n
+    alias = [0] * n
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+class DeviceCatalog:
+    """
+    Каталог устройств в памяти: загружается один раз из devices.json
+    (или из device_options, если файла нет) и перечитывается, когда
+    файл меняется — без перезапуска.
+
+    Вес устройства — поле "weight" в devices.json (доля устройства
+    в реальном трафике, по умолчанию 1). При DEVICE_WEIGHT_BY_SUCCESS
+    вес дополнительно умножается на сглаженную долю успешных переходов
+    этого устройства.
+    """
+    # после скольких record() пересчитывать таблицы выборки
+    REBUILD_EVERY = 50
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._checked = 0.0
+        self._ids = []
+        self._devices = {}
+        self._base_weights = {}
+        self._prob = []
+        self._alias = []
+        # device_id -> [успехи, всего]
+        self._outcomes = {}
+        self._pending_records = 0
+
+    # ---------- загрузка ----------
+
+    async def refresh(self, force: bool = False):
+        """
+        Перечитывает каталог, если devices.json изменился.
+        Файл проверяется не чаще раза в DEVICE_RELOAD_INTERVAL секунд.
+        """
+        now = time.monotonic()
+        if not force and self._ids and now - self._checked < DEVICE_RELOAD_INTERVAL:
+            return
+        self._checked = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if not self._ids:
+                await self._load_from_db()
+            return
+
+        if not force and mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # файл могут сохранять прямо сейчас — попробуем в следующий раз
+            logger.exception("Не удалось прочитать %s", self.path)
+            return
+
+        devices = {int(id_str): device for id_str, device in data.items()}
+        await self._sync_db(devices)
+        self._set(devices)
+        self._mtime = mtime
+        logger.info("Каталог устройств загружен: %d шт.", len(devices))
+
+    async def _load_from_db(self):
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(select(DeviceOption))).scalars().all()
+        self._set({
+            row.id: {field: getattr(row, field) for field in DEVICE_FIELDS}
+            for row in rows
+        })
+
+    async def _sync_db(self, devices: dict):
+        """device_options нужен для Event.device_option_id — держим его в синхроне."""
+        async with AsyncSessionLocal() as session:
+            for device_id, device in devices.items():
+                await session.merge(DeviceOption(
+                    id=device_id,
+                    **{field: device.get(field) for field in DEVICE_FIELDS},
+                ))
+            await session.commit()
+
+    def _set(self, devices: dict):
+        self._devices = {
+            device_id: {field: device.get(field) for field in DEVICE_FIELDS}
+            for device_id, device in devices.items()
+        }
+        self._base_weights = {
+            device_id: float(device.get("weight", 1.0))
+            for device_id, device in devices.items()
+        }
+        self._rebuild()
+
+    def _rebuild(self):
+        ids = list(self._devices)
+        weights = []
+        for device_id in ids:
+            weight = self._base_weights[device_id]
+            if DEVICE_WEIGHT_BY_SUCCESS:
+                ok, total = self._outcomes.get(device_id, (0, 0))
+                # сглаживание Лапласа: новые устройства не получают ноль
+                weight *= (ok + 1) / (total + 2)
+            weights.append(weight)
+        self._prob, self._alias = build_alias(weights)
+        self._ids = ids
+        self._pending_records = 0
+
+    # ---------- выборка ----------
+
+    async def sample(self):
+        """
+        Возвращает (device_id, device: dict) — случайное устройство
+        с учётом весов.
+        """
+        await self.refresh()
+        if not self._ids:
+            raise RuntimeError("Каталог устройств пуст")
+        i = random.randrange(len(self._ids))
+        if random.random() >= self._prob[i]:
+            i = self._alias[i]
+        device_id = self._ids[i]
+        return device_id, dict(self._devices[device_id])
+
+    def record(self, device_id: int, success: bool):
+        """Учитывает исход перехода для весов по доле успехов."""
+        if not DEVICE_WEIGHT_BY_SUCCESS:
+            return
+        outcome = self._outcomes.setdefault(device_id, [0, 0])
+        outcome[0] += int(success)
+        outcome[1] += 1
+        self._pending_records += 1
+        if self._pending_records >= self.REBUILD_EVERY:
+            self._rebuild()
+
+
+# Общий каталог процесса
+device_catalog = DeviceCatalog(DEVICES_FILE)
@@ -0,0 +1,478 @@
+# driver_pool.py
+
+import time
+import logging
+import threading
+import posixpath
+from collections import deque
+from urllib.parse import urlparse
+
+from seleniumwire import webdriver
+
+from config import (
+    DRIVER_POOL_SIZE,
+    DRIVER_IDLE_TTL,
+    DRIVER_MAX_USES,
+    DRIVER_CAPTURE_MAX,
+    BLOCK_RESOURCE_TYPES,
+    BLOCK_DOMAINS,
+)
+
+from metrics import BROWSER_LAUNCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+NO_PROXY = "localhost,127.0.0.1"
+
+# Скрипт, прячущий webdriver; ставится один раз при запуске драйвера
+STEALTH_SCRIPT = "Object.defineProperty(navigator,'webdriver',{get:()=>undefined})"
+
+# Тип ресурса → значения Sec-Fetch-Dest, которые Chrome ставит таким запросам
+RESOURCE_DESTS = {
+    "image": ("image",),
+    "font": ("font",),
+    "media": ("audio", "video", "track"),
+    "style": ("style",),
+    "script": ("script",),
+    "manifest": ("manifest",),
+}
+BLOCKED_DESTS = frozenset(
+    dest for kind in BLOCK_RESOURCE_TYPES for dest in RESOURCE_DESTS.get(kind, (kind,))
+)
+
+# Sec-Fetch-* Chrome шлёт только на защищённые адреса (https, localhost);
+# для обычного http назначение угадывается по Accept и расширению
+EXTENSION_DESTS = {
+    **dict.fromkeys((".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".svg", ".ico", ".bmp"), "image"),
+    **dict.fromkeys((".woff", ".woff2", ".ttf", ".otf", ".eot"), "font"),
+    **dict.fromkeys((".mp4", ".webm", ".ogv", ".mov", ".m3u8", ".ts"), "video"),
+    **dict.fromkeys((".mp3", ".ogg", ".wav", ".m4a", ".aac"), "audio"),
+    ".vtt": "track",
+    ".css": "style",
+    ".js": "script",
+    ".mjs": "script",
+    ".webmanifest": "manifest",
+}
+
+
+def request_dest(request) -> str:
+    """
+    Назначение запроса в терминах Sec-Fetch-Dest. Без заголовка (http)
+    навигацией считается запрос с Accept: text/html и
+    Upgrade-Insecure-Requests — основной фрейм от iframe тогда не отличить,
+    оба дают "document"; иначе тип берётся по Accept картинок и стилей
+    или по расширению пути. Неизвестное — "" (не блокируется).
+    """
+    dest = request.headers.get("Sec-Fetch-Dest")
+    if dest:
+        return dest
+    accept = request.headers.get("Accept", "")
+    if accept.startswith("text/html") and request.headers.get("Upgrade-Insecure-Requests") == "1":
+        return "document"
+    if accept.startswith("image/"):
+        return "image"
+    if accept.startswith("text/css"):
+        return "style"
+    ext = posixpath.splitext(urlparse(request.url).path)[1].lower()
+    return EXTENSION_DESTS.get(ext, "")
+
+
+def is_navigation(request, frames: bool = False) -> bool:
+    """Запрос основного фрейма (а при frames=True — и iframe)."""
+    dest = request_dest(request)
+    return dest == "document" or (frames and dest == "iframe")
+
+
+def blocked_host(host: str) -> bool:
+    return any(host == d or host.endswith("." + d) for d in BLOCK_DOMAINS)
+
+
+def _headers_size(headers) -> int:
+    return sum(len(k) + len(v) + 4 for k, v in headers.items())
+
+
+def device_script(platform: str) -> str:
+    """JS-подмена navigator.* под конкретное устройство."""
+    return f"""
+        Object.defineProperty(navigator, 'platform', {{ get: () => '{platform}' }});
+        Object.defineProperty(navigator, 'languages', {{ get: () => ['ru-RU','ru'] }});
+        Object.defineProperty(navigator, 'language', {{ get: () => 'ru-RU' }});
+        Object.defineProperty(navigator, 'plugins', {{ get: () => [1,2,3,4,5] }});
+        Object.defineProperty(navigator, 'deviceMemory', {{ get: () => 8 }});
+        Object.defineProperty(navigator, 'hardwareConcurrency', {{ get: () => 8 }});
+        Object.defineProperty(navigator, 'connection', {{
+            get: () => {{ rtt:50, downlink:10, effectiveType:'4g' }}
+        }});
+    """
+
+
+class PooledDriver:
+    """
+    Обёртка над запущенным Chrome: сам драйвер + служебное состояние,
+    нужное для сброса между переходами.
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+        # identifier скриптов устройства, добавленных через CDP
+        self.script_ids = []
+        # байт через прокси за текущий переход (считает response_interceptor)
+        self.proxy_bytes = 0
+        self._bytes_lock = threading.Lock()
+        # document-запросы (основной фрейм и iframe) текущего перехода в порядке
+        # отправки; ответ привязывает response_interceptor. Хранилище
+        # selenium-wire — FIFO на DRIVER_CAPTURE_MAX запросов любого типа,
+        # и на тяжёлой странице первые хопы цепочки из него вытесняются
+        self.navigations = []
+        # origin-ы всех запросов перехода — их storage чистит _reset
+        self.origins = set()
+        self._nav_lock = threading.Lock()
+
+    def count_bytes(self, n: int):
+        # интерсепторы selenium-wire вызываются из потоков его прокси
+        with self._bytes_lock:
+            self.proxy_bytes += n
+
+    def snapshot_navigations(self) -> list:
+        with self._nav_lock:
+            return list(self.navigations)
+
+    def snapshot_origins(self) -> set:
+        with self._nav_lock:
+            return set(self.origins)
+
+    def clear_navigations(self):
+        with self._nav_lock:
+            self.navigations.clear()
+            self.origins.clear()
+
+    def request_interceptor(self, request):
+        """
+        Отбрасывает ненужные для редиректа ресурсы, не пуская их в прокси,
+        и запоминает навигации.
+        """
+        dest = request_dest(request)
+        if dest in BLOCKED_DESTS:
+            request.abort()
+            return
+        parsed = urlparse(request.url)
+        if BLOCK_DOMAINS and blocked_host(parsed.hostname or ""):
+            request.abort()
+            return
+        with self._nav_lock:
+            if parsed.scheme in ("http", "https"):
+                self.origins.add(f"{parsed.scheme}://{parsed.netloc}")
+            if dest in ("document", "iframe"):
+                self.navigations.append(request)
+
+    def response_interceptor(self, request, response):
+        self.count_bytes(
+            len(request.url) + _headers_size(request.headers) + len(request.body or b"")
+            + _headers_size(response.headers) + len(response.body or b"")
+        )
+        if is_navigation(request, frames=True):
+            # сюда приходит копия запроса без id — ответ достаётся
+            # первой навигации с тем же адресом, ещё не получившей ответа
+            with self._nav_lock:
+                for nav in self.navigations:
+                    if nav.response is None and nav.url == request.url:
+                        nav.response = response
+                        break
+
+
+class DriverPool:
+    """
+    Пул заранее запущенных headless Chrome (selenium-wire).
+
+    acquire() отдаёт свободный драйвер (или запускает новый, пока
+    не достигнут size), release() возвращает его в пул. Драйверы,
+    простаивающие дольше idle_ttl секунд или отработавшие max_uses
+    переходов, закрываются: простаивающие — фоновым потоком-сборщиком
+    (start_reaper, запускается из warm) и при каждом release().
+    Потокобезопасен: fetch_redirect вызывается через asyncio.to_thread.
+    """
+    def __init__(self, size: int, idle_ttl: int, max_uses: int):
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.max_uses = max_uses
+        self._idle = deque()
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._reaper_stop = threading.Event()
+
+    # ---------- жизненный цикл драйверов ----------
+
+    def _launch(self) -> PooledDriver:
+        started = time.monotonic()
+        chrome_opts = webdriver.ChromeOptions()
+        chrome_opts.add_argument("--headless=new")
+        chrome_opts.add_argument("--disable-gpu")
+        chrome_opts.add_argument("--no-sandbox")
+        chrome_opts.add_argument("--disable-dev-shm-usage")
+        chrome_opts.add_argument("--disable-blink-features=AutomationControlled")
+        chrome_opts.add_experimental_option("excludeSwitches", ["enable-automation"])
+        chrome_opts.add_experimental_option("useAutomationExtension", False)
+        chrome_opts.set_capability("pageLoadStrategy", "none")
+
+        # Апстрим-прокси подставляется перед каждым переходом через driver.proxy.
+        # Хранилище запросов ограничено последними DRIVER_CAPTURE_MAX:
+        # selenium-wire не умеет сохранять выборочно, а навигации для
+        # трассировки и сброса запоминают интерсепторы (PooledDriver.navigations)
+        seleniumwire_opts = {
+            "request_storage": "memory",
+            "request_storage_max_size": DRIVER_CAPTURE_MAX,
+            "connection_timeout": 10,
+            "request_timeout": 30,
+        }
+
+        driver = webdriver.Chrome(
+            seleniumwire_options=seleniumwire_opts,
+            options=chrome_opts,
+        )
+        driver.execute_cdp_cmd("Network.enable", {})
+        if BLOCK_DOMAINS:
+            # домены из блок-листа (и их поддомены) Chrome не запрашивает
+            # вовсе; шаблон "*://*ads.com/*" задел бы и uploads.com, поэтому
+            # на домен — два точных шаблона, как в blocked_host
+            driver.execute_cdp_cmd(
+                "Network.setBlockedURLs",
+                {"urls": [p for d in BLOCK_DOMAINS for p in (f"*://{d}/*", f"*://*.{d}/*")]}
+            )
+        driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument",
+            {"source": STEALTH_SCRIPT}
+        )
+        pd = PooledDriver(driver)
+        driver.request_interceptor = pd.request_interceptor
+        driver.response_interceptor = pd.response_interceptor
+        BROWSER_LAUNCH_SECONDS.observe(time.monotonic() - started, engine="selenium")
+        return pd
+
+    @staticmethod
+    def _quit(pd: PooledDriver):
+        try:
+            pd.driver.quit()
+        except Exception:
+            logger.exception("Не удалось закрыть драйвер")
+
+    def _expired(self, pd: PooledDriver, now: float) -> bool:
+        return now - pd.last_used > self.idle_ttl
+
+    def reap(self) -> int:
+        """
+        Закрывает все простаивающие дольше idle_ttl драйверы — по всей
+        очереди, а не только с конца, откуда их берёт acquire().
+        Возвращает, сколько закрыто.
+        """
+        now = time.monotonic()
+        with self._cond:
+            stale = [pd for pd in self._idle if self._expired(pd, now)]
+            if stale:
+                self._idle = deque(pd for pd in self._idle if pd not in stale)
+                self._total -= len(stale)
+                self._cond.notify_all()
+        for pd in stale:
+            self._quit(pd)
+        return len(stale)
+
+    def start_reaper(self):
+        """Фоновый поток, раз в полпериода idle_ttl (от 1 до 60 с) вызывающий reap()."""
+        if self._reaper is not None:
+            return
+        interval = max(1.0, min(self.idle_ttl / 2, 60.0))
+
+        def run():
+            while not self._reaper_stop.wait(interval):
+                try:
+                    closed = self.reap()
+                except Exception:
+                    logger.exception("Сборщик простаивающих драйверов упал на проходе")
+                    continue
+                if closed:
+                    logger.info("Закрыто простаивающих драйверов: %d", closed)
+
+        self._reaper = threading.Thread(target=run, name="driver-reaper", daemon=True)
+        self._reaper.start()
+
+    def acquire(self) -> PooledDriver:
+        """
+        Возвращает свободный драйвер. Если все заняты и лимит size
+        исчерпан — ждёт, пока какой-нибудь не освободится.
+        """
+        stale = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    pd = self._idle.pop()
+                    if self._expired(pd, now):
+                        stale.append(pd)
+                        self._total -= 1
+                        continue
+                    break
+                else:
+                    pd = None
+                if pd is not None:
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                self._cond.wait()
+
+        for old in stale:
+            self._quit(old)
+
+        if pd is None:
+            try:
+                pd = self._launch()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise
+        pd.uses += 1
+        return pd
+
+    def release(self, pd: PooledDriver, broken: bool = False):
+        """
+        Возвращает драйвер в пул. Сломанные и «износившиеся» драйверы
+        закрываются, освобождая место под новый.
+        """
+        pd.last_used = time.monotonic()
+        retire = broken or self._closed or pd.uses >= self.max_uses
+        if not retire:
+            try:
+                self._reset(pd)
+            except Exception:
+                logger.exception("Не удалось сбросить драйвер, закрываем")
+                retire = True
+
+        if retire:
+            self._quit(pd)
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append(pd)
+            self._cond.notify()
+        self.reap()
+
+    def warm(self):
+        """
+        Запускает драйверы заранее, чтобы первые переходы не ждали старта
+        Chrome, и сборщик простаивающих.
+        """
+        self.start_reaper()
+        launched = []
+        with self._cond:
+            need = self.size - self._total
+            self._total += need
+        for _ in range(need):
+            try:
+                launched.append(self._launch())
+            except Exception:
+                logger.exception("Не удалось запустить драйвер при прогреве")
+                with self._cond:
+                    self._total -= 1
+        with self._cond:
+            self._idle.extend(launched)
+            self._cond.notify_all()
+        logger.info("Пул драйверов прогрет: %d шт.", len(launched))
+
+    def close(self):
+        """Закрывает все простаивающие драйверы; занятые закроются при release()."""
+        self._reaper_stop.set()
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+        for pd in idle:
+            self._quit(pd)
+
+    # ---------- подготовка и сброс между переходами ----------
+
+    def prepare(self, pd: PooledDriver, proxy_auth: str, device: dict):
+        """
+        Настраивает драйвер под конкретный переход: апстрим-прокси
+        и эмуляция устройства (UA, метрики экрана, navigator.*).
+        """
+        driver = pd.driver
+        pd.proxy_bytes = 0
+        pd.clear_navigations()
+        driver.proxy = {
+            "http": proxy_auth,
+            "https": proxy_auth,
+            "no_proxy": NO_PROXY,
+        }
+
+        css_w, css_h = device["css_size"]
+        driver.set_window_size(css_w, css_h)
+        driver.execute_cdp_cmd(
+            "Network.setUserAgentOverride",
+            {
+                "userAgent": device["ua"],
+                "platform": device["platform"],
+                "acceptLanguage": "ru-RU,ru",
+            }
+        )
+        driver.execute_cdp_cmd(
+            "Emulation.setDeviceMetricsOverride",
+            {
+                "width": css_w,
+                "height": css_h,
+                "deviceScaleFactor": device["dpr"],
+                "mobile": device["mobile"],
+            }
+        )
+        res = driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument",
+            {"source": device_script(device["platform"])}
+        )
+        pd.script_ids.append(res["identifier"])
+
+    def _reset(self, pd: PooledDriver):
+        """
+        Очищает следы предыдущего перехода: останавливает загрузку,
+        чистит cookies, кэш и storage посещённых origin-ов, снимает
+        скрипты устройства и перехваченные запросы.
+        """
+        driver = pd.driver
+        # все origin-ы перехода, не только навигаций: storage пишут и
+        # сторонние скрипты; плюс то, что осталось в хранилище selenium-wire
+        origins = pd.snapshot_origins()
+        for req in driver.requests:
+            parsed = urlparse(req.url)
+            if parsed.scheme in ("http", "https"):
+                origins.add(f"{parsed.scheme}://{parsed.netloc}")
+
+        driver.execute_script("window.stop();")
+        driver.get("about:blank")
+
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        for origin in origins:
+            driver.execute_cdp_cmd(
+                "Storage.clearDataForOrigin",
+                {"origin": origin, "storageTypes": "all"}
+            )
+
+        for script_id in pd.script_ids:
+            driver.execute_cdp_cmd(
+                "Page.removeScriptToEvaluateOnNewDocument",
+                {"identifier": script_id}
+            )
+        pd.script_ids.clear()
+        driver.execute_cdp_cmd("Emulation.clearDeviceMetricsOverride", {})
+        del driver.requests
+        pd.clear_navigations()
+
+
+# Общий пул процесса
+driver_pool = DriverPool(DRIVER_POOL_SIZE, DRIVER_IDLE_TTL, DRIVER_MAX_USES)
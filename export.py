@@ -0,0 +1,89 @@
+# export.py
+#
+# Выгрузка events в CSV вместе с попытками подбора прокси (proxy_logs).
+# Строки читаются пачками по ключу events.id — в памяти одна пачка,
+# каждая пачка — отдельный короткий запрос, без долгой транзакции.
+#
+# Выгрузить в файл без бота:
+#   python export.py [user_id] > events.csv
+import csv
+import sys
+import asyncio
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import Event, ProxyLog
+from config import EXPORT_CHUNK_SIZE
+
+COLUMNS = [
+    "id", "timestamp", "user_id", "state", "tier", "initial_url", "final_url",
+    "ip", "isp", "proxy_bytes", "proxy_id", "proxy_attempts", "proxy_ip", "proxy_city",
+    "hops",
+]
+
+
+def _fmt_time(value):
+    return value.isoformat(sep=" ", timespec="seconds") if value else ""
+
+
+async def _proxy_summary(session, proxy_ids) -> dict:
+    """proxy_id -> (число попыток, ip и город последней попытки)."""
+    if not proxy_ids:
+        return {}
+    rows = await session.execute(
+        select(ProxyLog.id, ProxyLog.attempt, ProxyLog.ip, ProxyLog.city)
+        .where(ProxyLog.id.in_(proxy_ids))
+        .order_by(ProxyLog.id, ProxyLog.attempt)
+    )
+    summary = {}
+    for proxy_id, attempt, ip, city in rows:
+        count = summary.get(proxy_id, (0,))[0]
+        summary[proxy_id] = (count + 1, ip, city)
+    return summary
+
+
+async def iter_event_chunks(user_id: int = None, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Пачки строк CSV (списки) по возрастанию events.id."""
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            stmt = select(Event).where(Event.id > last_id)
+            if user_id is not None:
+                stmt = stmt.where(Event.user_id == user_id)
+            events = (await session.execute(
+                stmt.order_by(Event.id).limit(chunk_size)
+            )).scalars().all()
+            if not events:
+                return
+            proxies = await _proxy_summary(session, {e.proxy_id for e in events if e.proxy_id})
+
+        chunk = []
+        for e in events:
+            attempts, proxy_ip, proxy_city = proxies.get(e.proxy_id, ("", "", ""))
+            hops = " → ".join(f"{h.get('status', '')} {h.get('url', '')}" for h in e.hops or [])
+            chunk.append([
+                e.id, _fmt_time(e.timestamp), e.user_id, e.state, e.tier or "",
+                e.initial_url or "", e.final_url or "", e.ip or "", e.isp or "",
+                e.proxy_bytes if e.proxy_bytes is not None else "", e.proxy_id or "",
+                attempts, proxy_ip or "", proxy_city or "", hops,
+            ])
+        yield chunk
+        last_id = events[-1].id
+
+
+async def write_events_csv(out, user_id: int = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """Пишет CSV в текстовый поток out; возвращает число строк."""
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    total = 0
+    async for chunk in iter_event_chunks(user_id, chunk_size):
+        writer.writerows(chunk)
+        total += len(chunk)
+    return total
+
+
+if __name__ == "__main__":
+    uid = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    count = asyncio.run(write_events_csv(sys.stdout, uid))
+    print(f"Выгружено строк: {count}", file=sys.stderr)
@@ -0,0 +1,253 @@
+# geoip.py
+
+import csv
+import sys
+import mmap
+import json
+import struct
+import logging
+import ipaddress
+from functools import lru_cache
+
+import requests
+
+from config import GEO_RESOLVER, IP_API_URL, IP_ECHO_URL, GEOIP_DB, GEOIP_CACHE_SIZE
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+logger = logging.getLogger(__name__)
+
+# Формат собственной базы (geoip.py build):
+#   заголовок  MAGIC, число диапазонов, смещение таблицы строк
+#   диапазоны  (start, end, city_idx, isp_idx), отсортированы по start
+#   строки     число строк, затем (длина, utf-8) для каждой
+MAGIC = b"GEO1"
+HEADER = struct.Struct("<4sII")
+RANGE = struct.Struct("<IIHH")
+STR_LEN = struct.Struct("<H")
+
+
+def build(csv_path: str, out_path: str) -> int:
+    """
+    Собирает базу из CSV с колонками start,end,city,isp (IPv4,
+    границы включительно). Возвращает число диапазонов.
+    """
+    strings = {"": 0}
+    ranges = []
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            start = int(ipaddress.IPv4Address(row["start"].strip()))
+            end = int(ipaddress.IPv4Address(row["end"].strip()))
+            if end < start:
+                raise ValueError(f"Пустой диапазон {row['start']}–{row['end']}")
+            city = strings.setdefault(row["city"].strip(), len(strings))
+            isp = strings.setdefault(row["isp"].strip(), len(strings))
+            ranges.append((start, end, city, isp))
+
+    ranges.sort()
+    for prev, cur in zip(ranges, ranges[1:]):
+        if cur[0] <= prev[1]:
+            raise ValueError(
+                f"Диапазоны пересекаются: {ipaddress.IPv4Address(cur[0])}"
+            )
+
+    strings_offset = HEADER.size + RANGE.size * len(ranges)
+    with open(out_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(ranges), strings_offset))
+        for r in ranges:
+            f.write(RANGE.pack(*r))
+        f.write(STR_LEN.pack(len(strings)))
+        for s in strings:  # dict хранит порядок вставки = индексы
+            data = s.encode("utf-8")
+            f.write(STR_LEN.pack(len(data)))
+            f.write(data)
+    return len(ranges)
+
+
+class RangeDatabase:
+    """
+    База, собранная build(): файл отображается в память (mmap),
+    поиск — бинарный по отсортированным диапазонам, без загрузки
+    самих диапазонов в Python-объекты. Только IPv4.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, strings_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не база geoip.py")
+
+        # таблица строк небольшая — читаем целиком
+        (n,) = STR_LEN.unpack_from(self._mm, strings_offset)
+        pos = strings_offset + STR_LEN.size
+        self._strings = []
+        for _ in range(n):
+            (size,) = STR_LEN.unpack_from(self._mm, pos)
+            pos += STR_LEN.size
+            self._strings.append(self._mm[pos:pos + size].decode("utf-8"))
+            pos += size
+
+    def _range(self, i: int):
+        return RANGE.unpack_from(self._mm, HEADER.size + i * RANGE.size)
+
+    def get(self, ip: str):
+        """Возвращает (city, isp) или None, если IP не покрыт базой."""
+        addr = ipaddress.ip_address(ip)
+        if addr.version != 4:
+            return None
+        key = int(addr)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end, city, isp = self._range(mid)
+            if key < start:
+                hi = mid
+            elif key > end:
+                lo = mid + 1
+            else:
+                return self._strings[city] or None, self._strings[isp] or None
+        return None
+
+    def close(self):
+        self._mm.close()
+
+
+class MaxMindDatabase:
+    """
+    База MaxMind (.mmdb, City или ISP/ASN) через пакет maxminddb
+    в режиме mmap.
+    """
+    def __init__(self, path: str):
+        if maxminddb is None:
+            raise RuntimeError("Для .mmdb нужен пакет maxminddb")
+        self._reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+    def get(self, ip: str):
+        record = self._reader.get(ip)
+        if not record:
+            return None
+        city = (record.get("city") or {}).get("names", {}).get("en")
+        isp = (
+            record.get("isp")
+            or record.get("autonomous_system_organization")
+            or (record.get("traits") or {}).get("isp")
+        )
+        return city, isp
+
+    def close(self):
+        self._reader.close()
+
+
+def open_database(path: str):
+    if path.endswith(".mmdb"):
+        return MaxMindDatabase(path)
+    return RangeDatabase(path)
+
+
+def _proxies(proxy_auth: str) -> dict:
+    return {"http": proxy_auth, "https": proxy_auth}
+
+
+class IpApiResolver:
+    """Прежний способ: один запрос к IP_API_URL через прокси на каждую попытку."""
+    def check(self, proxy_auth: str):
+        """Возвращает (info: dict, ip: str|None, city: str|None)."""
+        ip = city = None
+        info = {}
+        try:
+            resp = requests.get(IP_API_URL, proxies=_proxies(proxy_auth), timeout=5)
+            info = resp.json()
+            ip = info.get("query")
+            city = info.get("city")
+        except Exception:
+            # в случае ошибки оставляем ip, city = None
+            pass
+        return info, ip, city
+
+    def stats(self) -> dict:
+        return {}
+
+
+class LocalGeoResolver:
+    """
+    Выходной IP узнаём у дешёвого эхо-эндпоинта (IP_ECHO_URL), а город
+    и ISP — из локальной базы, без лимитов ip-api.com. Результаты
+    поиска кэшируются по IP (LRU на cache_size адресов), так что
+    повторные выходные IP ничего не стоят.
+
+    info возвращается в формате ip-api ({"query", "city", "isp"}),
+    чтобы остальной код не зависел от выбранного резолвера.
+    """
+    def __init__(self, db, echo_url: str, cache_size: int):
+        self.db = db
+        self.echo_url = echo_url
+        # lru_cache потокобезопасен — check() зовут из потоков гонки
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, ip: str):
+        try:
+            return self.db.get(ip)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def parse_echo(text: str):
+        """IP из ответа эхо-сервиса: голый текст или JSON (ip/query/origin)."""
+        text = text.strip()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = text
+        if isinstance(data, dict):
+            data = data.get("ip") or data.get("query") or data.get("origin") or ""
+        # httpbin за цепочкой прокси отдаёт "a, b" — нужен первый
+        candidate = str(data).split(",")[0].strip()
+        try:
+            return str(ipaddress.ip_address(candidate))
+        except ValueError:
+            return None
+
+    def check(self, proxy_auth: str):
+        """Возвращает (info: dict, ip: str|None, city: str|None)."""
+        try:
+            resp = requests.get(self.echo_url, proxies=_proxies(proxy_auth), timeout=5)
+            ip = self.parse_echo(resp.text)
+        except Exception:
+            ip = None
+        if ip is None:
+            return {}, None, None
+
+        found = self.lookup(ip)
+        city, isp = found if found else (None, None)
+        return {"query": ip, "city": city, "isp": isp}, ip, city
+
+    def stats(self) -> dict:
+        info = self.lookup.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+
+def make_resolver():
+    if GEO_RESOLVER == "local":
+        return LocalGeoResolver(open_database(GEOIP_DB), IP_ECHO_URL, GEOIP_CACHE_SIZE)
+    if GEO_RESOLVER != "ip-api":
+        logger.warning("Неизвестный GEO_RESOLVER=%r, используем ip-api", GEO_RESOLVER)
+    return IpApiResolver()
+
+
+# Резолвер процесса, выбирается по GEO_RESOLVER
+geo_resolver = make_resolver()
+
+
+if __name__ == "__main__":
+    # python geoip.py build geoip-sample.csv geoip-sample.bin
+    # python geoip.py lookup 203.0.113.7 [база]
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        print(f"Диапазонов: {build(sys.argv[2], sys.argv[3])}")
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "lookup":
+        db = open_database(sys.argv[3] if len(sys.argv) == 4 else GEOIP_DB)
+        print(db.get(sys.argv[2]))
+    else:
+        sys.exit("usage: geoip.py build CSV OUT | lookup IP [DB]")
@@ -1,7 +1,8 @@
 # handlers.py
 
+import io
 import re
-import random
+import tempfile
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
@@ -12,6 +13,7 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     ContextTypes,
     CommandHandler,
@@ -19,12 +21,21 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters,
 )
-from sqlalchemy import select, func
+from sqlalchemy import select, insert, func, case, tuple_
 
 from db import AsyncSessionLocal
-from models import User, Queue, Event
+from models import User, Queue, Event, UserDailyStat, db_now
+from tasks import dispatcher
+from scheduler import slot_scheduler
+from links import LinkCollector
+from export import write_events_csv
+from writer import write_behind
+from user_cache import user_cache, CachedUser, MISS
+from metrics import EVENTS_TOTAL
+from config import LATENCY_REPORT_LIMIT, BULK_MAX_LINKS, BULK_MAX_FILE_BYTES, QUEUE_PAGE_SIZE, HISTORY_PAGE_SIZE
 from keyboards import (
     main_menu,
+    latency_menu,
     transition_mode_menu,
     users_menu,
     add_user_menu,
@@ -57,44 +68,49 @@ async def fetch_db_user(session, telegram_id: int):
     )
     return result.scalar_one_or_none()
 
-# /start
-async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def get_user(telegram_id: int, username: str = None):
+    """
+    Возвращает CachedUser по Telegram ID (из кэша процесса или из БД) или None.
+    Если передан username, заодно активирует пользователя, приглашённого
+    по нику (status pending, user_id ещё не известен).
+    """
+    cached = user_cache.get(telegram_id)
+    if cached is not MISS:
+        return cached
+
     async with AsyncSessionLocal() as session:
-        pending = (await session.execute(
-            select(User).filter_by(
-                username=update.effective_user.username,
-                status="pending"
-            )
-        )).scalar_one_or_none()
-        db_user = pending or await fetch_db_user(session, update.effective_user.id)
-        if not db_user:
-            return
+        pending = None
+        if username:
+            pending = (await session.execute(
+                select(User).filter_by(username=username, status="pending")
+            )).scalar_one_or_none()
+        db_user = pending or await fetch_db_user(session, telegram_id)
         if pending and pending.user_id is None:
-            pending.user_id = update.effective_user.id
+            pending.user_id = telegram_id
             pending.status = "activ"
             pending.activated_date = datetime.now()
             await session.commit()
-        await update.message.reply_text("Меню", reply_markup=RED_KEYBOARD)
+
+    user = CachedUser.from_model(db_user) if db_user else None
+    # «Нет такого пользователя» кэшируем, только если проверили и приглашение по нику
+    if user is not None or username:
+        user_cache.put(telegram_id, user)
+    return user
+
+# /start
+async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db_user = await get_user(update.effective_user.id, update.effective_user.username)
+    if not db_user:
+        return
+    await update.message.reply_text("Меню", reply_markup=RED_KEYBOARD)
 
 # Текстовая «☰ Меню» → inline-меню
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    async with AsyncSessionLocal() as session:
-        pending = (await session.execute(
-            select(User).filter_by(
-                username=update.effective_user.username,
-                status="pending"
-            )
-        )).scalar_one_or_none()
-        db_user = pending or await fetch_db_user(session, update.effective_user.id)
-        if not db_user:
-            return
-        if pending and pending.user_id is None:
-            pending.user_id = update.effective_user.id
-            pending.status = "activ"
-            pending.activated_date = datetime.now()
-            await session.commit()
-        role = db_user.role
-        await update.message.reply_text("Меню", reply_markup=main_menu(role))
+    db_user = await get_user(update.effective_user.id, update.effective_user.username)
+    if not db_user:
+        return
+    role = db_user.role
+    await update.message.reply_text("Меню", reply_markup=main_menu(role))
 
 # Скрыть текущее inline-меню
 async def hide_inline_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -106,12 +122,11 @@ async def hide_inline_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    async with AsyncSessionLocal() as session:
-        db_user = await fetch_db_user(session, query.from_user.id)
-        if not db_user:
-            return
-        role = db_user.role
-        await query.message.edit_text("Меню", reply_markup=main_menu(role))
+    db_user = await get_user(query.from_user.id)
+    if not db_user:
+        return
+    role = db_user.role
+    await query.message.edit_text("Меню", reply_markup=main_menu(role))
 
 # noop
 async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -121,12 +136,11 @@ async def noop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_transition_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    async with AsyncSessionLocal() as session:
-        db_user = await fetch_db_user(session, query.from_user.id)
-        if not db_user:
-            return
-        mode = db_user.transition_mode
-        await query.message.edit_text("Переходы", reply_markup=transition_mode_menu(mode))
+    db_user = await get_user(query.from_user.id)
+    if not db_user:
+        return
+    mode = db_user.transition_mode
+    await query.message.edit_text("Переходы", reply_markup=transition_mode_menu(mode))
 
 async def set_transition_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -138,99 +152,165 @@ async def set_transition_mode(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         db_user.transition_mode = mode
         await session.commit()
+        user_cache.invalidate(telegram_id=query.from_user.id)
         await query.message.edit_text("Переходы", reply_markup=transition_mode_menu(mode))
 
 # Обновлённое меню «Очередь»
 async def on_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Очередь пользователя постранично. Страницы — по ключу (transition_time, id),
+    без OFFSET: callback_data «queue:f:<курсор>» — страница с этого элемента
+    включительно, «queue:b:<курсор>» — страница перед ним.
+    """
     if update.callback_query:
         query = update.callback_query
         await query.answer()
         send = query.message.edit_text
         user_id = query.from_user.id
+        data = query.data
     else:
         send = update.effective_message.reply_text
         user_id = update.effective_user.id
+        data = ""
+
+    direction, cursor = "f", None
+    if data.startswith("queue:"):
+        _, direction, raw = data.split(":", 2)
+        cursor = parse_cursor(raw)
+    await render_queue(send, user_id, direction, cursor)
+
+
+def format_cursor(transition_time: datetime, queue_id: int) -> str:
+    """Ключ страницы для callback_data (лимит Telegram — 64 байта)."""
+    return f"{transition_time.strftime('%Y%m%d%H%M%S%f')}.{queue_id}"
+
 
+def parse_cursor(raw: str):
+    stamp, _, qid = raw.partition(".")
+    return datetime.strptime(stamp, "%Y%m%d%H%M%S%f"), int(qid)
+
+
+async def render_queue(send, user_id: int, direction: str = "f", cursor=None):
+    key = tuple_(Queue.transition_time, Queue.id)
+    pending = (Queue.user_id == user_id, Queue.status == "pending")
     async with AsyncSessionLocal() as session:
-        items = (await session.execute(
-            select(Queue)
-            .where(
-                Queue.user_id == user_id,
-                Queue.status.in_(["pending", "in_progress"])
+        # pending идут по индексу (user_id, status, transition_time) —
+        # и выборка страницы, и подсчёты не трогают остальные строки
+        stmt = select(Queue).where(*pending)
+        if direction == "b" and cursor:
+            stmt = stmt.where(key < cursor).order_by(Queue.transition_time.desc(), Queue.id.desc())
+        else:
+            if cursor:
+                stmt = stmt.where(key >= cursor)
+            stmt = stmt.order_by(Queue.transition_time, Queue.id)
+        items = (await session.execute(stmt.limit(QUEUE_PAGE_SIZE + 1))).scalars().all()
+
+        next_cursor = None
+        if direction == "b" and cursor:
+            items = items[:QUEUE_PAGE_SIZE][::-1]
+            # следующая страница — та, с которой пришли
+            next_cursor = cursor
+        else:
+            if len(items) > QUEUE_PAGE_SIZE:
+                # лишний элемент — первый на следующей странице
+                next_cursor = (items[-1].transition_time, items[-1].id)
+            items = items[:QUEUE_PAGE_SIZE]
+        if not items and cursor:
+            # удалили последний элемент последней страницы — показать предыдущую
+            if direction == "f":
+                return await render_queue(send, user_id, "b", cursor)
+            return await render_queue(send, user_id)
+
+        total = await session.scalar(select(func.count()).select_from(Queue).where(*pending))
+        before = 0
+        if items:
+            before = await session.scalar(
+                select(func.count()).select_from(Queue)
+                .where(*pending, key < (items[0].transition_time, items[0].id))
             )
-            .order_by(Queue.transition_time)
-        )).scalars().all()
+        # выполняемые сейчас — только числом в заголовке: кнопки для них
+        # не ограничены страницей и переполнили бы клавиатуру (лимит
+        # Telegram — 100 кнопок)
+        running = await session.scalar(
+            select(func.count()).select_from(Queue)
+            .where(Queue.user_id == user_id, Queue.status == "in_progress")
+        )
 
+    anchor = format_cursor(items[0].transition_time, items[0].id) if items else ""
     buttons = []
     for idx, item in enumerate(items):
         # Ссылка (сокращённый текст, полная URL по нажатию)
         short = shorten_url(item.url)
         buttons.append([InlineKeyboardButton(short, url=item.url)])
 
-        if item.status == "pending":
-            t = item.transition_time.strftime("%H:%M %d.%m")
-            buttons.append([
-                InlineKeyboardButton(t, callback_data="noop"),
-                InlineKeyboardButton("удалить", callback_data=f"del_queue:{item.id}")
-            ])
-        elif item.status == "in_progress":
-            buttons.append([InlineKeyboardButton("в процессе перехода", callback_data="noop")])
+        t = item.transition_time.strftime("%H:%M %d.%m")
+        buttons.append([
+            InlineKeyboardButton(t, callback_data="noop"),
+            InlineKeyboardButton("удалить", callback_data=f"del_queue:{item.id}:{anchor}")
+        ])
 
         # разделитель между блоками (кроме последнего)
         if idx < len(items) - 1:
             buttons.append([InlineKeyboardButton("──────────────────", callback_data="noop")])
 
+    nav = []
+    if before:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"queue:b:{anchor}"))
+    if next_cursor:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"queue:f:{format_cursor(*next_cursor)}"))
+    if nav:
+        buttons.append(nav)
     # кнопка «Назад»
     buttons.append([InlineKeyboardButton("↩️ Назад", callback_data="back_to_menu")])
 
-    await send("Ваша очередь:", reply_markup=InlineKeyboardMarkup(buttons))
+    if items:
+        header = f"Ваша очередь: {before + 1}–{before + len(items)} из {total}"
+        if running:
+            header += f", выполняется: {running}"
+    elif running:
+        header = f"Ваша очередь: выполняется {running}, в ожидании нет"
+    else:
+        header = "Ваша очередь пуста"
+    await send(header, reply_markup=InlineKeyboardMarkup(buttons))
 
 # Удалить из очереди
 async def on_delete_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    _, sid = query.data.split(":", 1)
+    # del_queue:<id>:<курсор страницы>; у старых кнопок курсора нет
+    _, sid, *page = query.data.split(":", 2)
     async with AsyncSessionLocal() as session:
         item = await session.get(Queue, int(sid))
-        if item and item.status != "in_progress":
+        if item and item.user_id == query.from_user.id and item.status != "in_progress":
             await session.delete(item)
             await session.commit()
-    # Перерисовать очередь
-    await on_queue(update, context)
+    # Перерисовать текущую страницу
+    cursor = parse_cursor(page[0]) if page and page[0] else None
+    await render_queue(query.message.edit_text, query.from_user.id, "f", cursor)
 
 # Статистика
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    now = datetime.now()
+    # та же шкала (UTC), в которой bump_daily_success ведёт дни
+    now = db_now()
     user_id = query.from_user.id
+    month_start = now.replace(day=1).date()
+    week_start = (now - timedelta(days=now.weekday())).date()
+    # Считаем по дневным агрегатам user_daily_stats — по строке на день
     async with AsyncSessionLocal() as session:
-        total = (await session.execute(
-            select(func.count()).select_from(Event)
-            .filter_by(user_id=user_id, state="success")
-        )).scalar() or 0
-
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        month = (await session.execute(
-            select(func.count()).select_from(Event)
-            .filter(
-                Event.user_id == user_id,
-                Event.state == "success",
-                Event.timestamp >= month_start
-            )
-        )).scalar() or 0
-
-        week_start = (now - timedelta(days=now.weekday())).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
-        week = (await session.execute(
-            select(func.count()).select_from(Event)
-            .filter(
-                Event.user_id == user_id,
-                Event.state == "success",
-                Event.timestamp >= week_start
-            )
-        )).scalar() or 0
+        total, month, week = (await session.execute(
+            select(
+                func.sum(UserDailyStat.success),
+                func.sum(case(
+                    (UserDailyStat.day >= month_start, UserDailyStat.success), else_=0
+                )),
+                func.sum(case(
+                    (UserDailyStat.day >= week_start, UserDailyStat.success), else_=0
+                )),
+            ).where(UserDailyStat.user_id == user_id)
+        )).one()
+    total, month, week = total or 0, month or 0, week or 0
 
     text = (
         f"Статистика:\n"
@@ -243,19 +323,35 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # История запросов
 async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    История постранично, от новых к старым, по ключу events.id:
+    «history:o:<id>» — страница старее id, «history:n:<id>» — новее.
+    """
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
+    direction, cursor = "o", None
+    if query.data.startswith("history:"):
+        _, direction, raw = query.data.split(":", 2)
+        cursor = int(raw)
+
+    shown = (Event.user_id == user_id, Event.state.in_(["success", "proxy_error"]))
     async with AsyncSessionLocal() as session:
-        events = (await session.execute(
-            select(Event)
-            .filter(
-                Event.user_id == user_id,
-                Event.state.in_(["success", "proxy_error"])
-            )
-            .order_by(Event.timestamp.desc())
-            .limit(20)
-        )).scalars().all()
+        stmt = select(Event).filter(*shown)
+        if direction == "n" and cursor:
+            stmt = stmt.filter(Event.id > cursor).order_by(Event.id)
+        else:
+            if cursor:
+                stmt = stmt.filter(Event.id < cursor)
+            stmt = stmt.order_by(Event.id.desc())
+        events = (await session.execute(stmt.limit(HISTORY_PAGE_SIZE + 1))).scalars().all()
+        more = len(events) > HISTORY_PAGE_SIZE
+        events = events[:HISTORY_PAGE_SIZE]
+        if direction == "n" and cursor:
+            events.reverse()
+            has_newer, has_older = more, True
+        else:
+            has_newer, has_older = cursor is not None, more
 
     if not events:
         text = "История запросов пуста"
@@ -273,14 +369,142 @@ async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 lines.append(f"{ts}: {init_link} ({e.state})")
         text = "История запросов:\n" + "\n".join(lines)
 
-    back_kb = InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад", callback_data="back_to_menu")]])
+    buttons = []
+    nav = []
+    if events and has_newer:
+        nav.append(InlineKeyboardButton("◀️ Новее", callback_data=f"history:n:{events[0].id}"))
+    if events and has_older:
+        nav.append(InlineKeyboardButton("Старее ▶️", callback_data=f"history:o:{events[-1].id}"))
+    if nav:
+        buttons.append(nav)
+    if events:
+        buttons.append([InlineKeyboardButton("📤 Выгрузить CSV", callback_data="export_history")])
+    buttons.append([InlineKeyboardButton("↩️ Назад", callback_data="back_to_menu")])
     await query.message.edit_text(
         text,
-        reply_markup=back_kb,
+        reply_markup=InlineKeyboardMarkup(buttons),
         disable_web_page_preview=True,
         parse_mode="HTML"
     )
 
+# Выгрузка событий в CSV: /export — свои, /export all — все (только админ)
+async def export_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        await update.callback_query.answer("Готовлю файл…")
+    db_user = await get_user(update.effective_user.id)
+    if not db_user:
+        return
+
+    export_all = bool(context.args) and context.args[0] == "all"
+    if export_all and db_user.role != "admin":
+        await update.effective_message.reply_text("Выгрузка всех событий доступна только администратору")
+        return
+    user_id = None if export_all else update.effective_user.id
+
+    # CSV копится на диске, а не в памяти; из БД — пачками по EXPORT_CHUNK_SIZE
+    with tempfile.TemporaryFile() as raw:
+        out = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        count = await write_events_csv(out, user_id)
+        out.flush()
+        out.detach()
+        raw.seek(0)
+        if not count:
+            await update.effective_message.reply_text("История запросов пуста")
+            return
+        name = "events-all" if export_all else f"events-{update.effective_user.id}"
+        await context.bot.send_document(
+            chat_id=update.effective_chat.id,
+            document=raw,
+            filename=f"{name}-{datetime.now():%Y%m%d-%H%M}.csv",
+            caption=f"Событий: {count}",
+        )
+
+# Стадии Event.timings в порядке прохождения
+LATENCY_STAGES = [
+    ("slot_wait", "Ожидание слота"),
+    ("proxy", "Подбор прокси"),
+    ("http_tier", "HTTP-уровень"),
+    ("browser_start", "Запуск браузера"),
+    ("page", "Загрузка страницы"),
+    ("total", "Всего"),
+]
+LATENCY_PERIODS = {
+    "day": ("сутки", timedelta(days=1)),
+    "week": ("неделю", timedelta(days=7)),
+}
+# Сколько самых медленных доменов показывать и с какого числа переходов
+SLOW_DOMAINS_TOP = 5
+SLOW_DOMAINS_MIN_EVENTS = 3
+
+def percentile(values, p: float):
+    """Перцентиль методом ближайшего ранга; values отсортированы."""
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[k]
+
+def format_ms(ms: int) -> str:
+    return f"{ms / 1000:.1f} с" if ms >= 1000 else f"{ms} мс"
+
+# Отчёт о задержках (модераторы и админы)
+async def show_latency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    db_user = await get_user(query.from_user.id)
+    if not db_user or db_user.role not in ("moderator", "admin"):
+        return
+
+    period = query.data.split(":", 1)[1]
+    title, span = LATENCY_PERIODS.get(period, LATENCY_PERIODS["day"])
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(
+            select(Event.initial_url, Event.timings)
+            .where(Event.timestamp >= db_now() - span, Event.timings.isnot(None))
+            .order_by(Event.timestamp.desc())
+            .limit(LATENCY_REPORT_LIMIT)
+        )).all()
+
+    if not rows:
+        text = f"Переходов с таймингами за {title} нет"
+    else:
+        by_stage = {stage: [] for stage, _ in LATENCY_STAGES}
+        by_domain = {}
+        for initial_url, timings in rows:
+            for stage, values in by_stage.items():
+                if stage in timings:
+                    values.append(timings[stage])
+            if initial_url and "total" in timings:
+                domain = urlparse(initial_url).netloc
+                by_domain.setdefault(domain, []).append(timings["total"])
+
+        lines = [f"Задержки за {title} ({len(rows)} переходов), p50 / p95:"]
+        for stage, label in LATENCY_STAGES:
+            values = sorted(by_stage[stage])
+            if values:
+                lines.append(
+                    f"{label}: {format_ms(percentile(values, 50))} / "
+                    f"{format_ms(percentile(values, 95))}"
+                )
+
+        slow = sorted(
+            (
+                (percentile(sorted(values), 50), domain, len(values))
+                for domain, values in by_domain.items()
+                if len(values) >= SLOW_DOMAINS_MIN_EVENTS
+            ),
+            reverse=True,
+        )[:SLOW_DOMAINS_TOP]
+        if slow:
+            lines.append("\nСамые медленные домены (p50 «Всего»):")
+            for p50, domain, count in slow:
+                lines.append(f"{domain}: {format_ms(p50)} ({count})")
+        text = "\n".join(lines)
+
+    try:
+        await query.message.edit_text(text, reply_markup=latency_menu(period))
+    except BadRequest as e:
+        # повторное нажатие уже выбранного периода без новых данных
+        if "message is not modified" not in str(e).lower():
+            raise
+
 # Пользователи
 async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -301,6 +525,7 @@ async def delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if order[db_actor.role] > order[db_target.role]:
                 await session.delete(db_target)
                 await session.commit()
+                user_cache.invalidate(telegram_id=int(sid), username=db_target.username)
                 users = (await session.execute(select(User).order_by(User.role))).scalars().all()
                 await query.message.edit_text("Пользователи", reply_markup=users_menu(users))
 
@@ -348,6 +573,9 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 session.add(new_user)
                 await session.commit()
+                # приглашённый мог уже писать боту и попасть в кэш как «неизвестный»
+                user_cache.forget_missing()
+                user_cache.invalidate(username=normalized)
                 role_name = "Модератор" if role_to_add == "moderator" else "Пользователь"
                 await update.message.reply_text(f"{role_name} @{normalized} успешно добавлен")
             else:
@@ -356,60 +584,128 @@ async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop("inviter_id", None)
         return
 
-    async with AsyncSessionLocal() as session:
-        db_user = await fetch_db_user(session, user.id)
-        if not db_user:
-            pending = (await session.execute(
-                select(User).filter_by(username=user.username, status="pending")
-            )).scalar_one_or_none()
-            if pending:
-                pending.user_id = user.id
-                pending.status = "activ"
-                pending.activated_date = datetime.now()
-                await session.commit()
-                db_user = pending
-            else:
-                return
+    db_user = await get_user(user.id, user.username)
+    if not db_user:
+        return
 
-        links = re.findall(r"https?://\S+|t\.me/\S+|@\w+", text)
-        if not links:
-            session.add(Event(user_id=user.id, state="no_link"))
-            await session.commit()
-            await update.message.reply_text("В сообщение нет ссылок")
-            return
-        if len(links) > 1:
-            session.add(Event(user_id=user.id, state="many_links"))
-            await session.commit()
-            await update.message.reply_text("Пришлите одну ссылку за раз")
-            return
+    collector = LinkCollector(BULK_MAX_LINKS)
+    collector.add_text(text)
+    if not collector.links:
+        # событие запишется пачкой с остальными (write_behind)
+        write_behind.add(Event(user_id=user.id, state="no_link"))
+        EVENTS_TOTAL.inc(state="no_link")
+        await update.message.reply_text("В сообщение нет ссылок")
+        return
+    if len(collector.links) == 1 and not collector.duplicates:
+        await enqueue_links(user.id, db_user.transition_mode, update.message.message_id, collector.links)
+        await update.message.reply_text(
+            "Ссылка добавлена в очередь ⏳",
+            reply_to_message_id=update.message.message_id
+        )
+        return
+    await enqueue_bulk(update, db_user, collector)
 
-        url = links[0]
-        if db_user.transition_mode == "immediate":
-            transition_time = datetime.now()
-        else:
-            now = datetime.now()
-            end_of_day = now.replace(hour=23, minute=59, second=59)
-            if (end_of_day - now) < timedelta(hours=2):
-                tomorrow = now + timedelta(days=1)
-                start = tomorrow.replace(hour=0, minute=0, second=0)
-                end = tomorrow.replace(hour=23, minute=59, second=59)
-            else:
-                start = now
-                end = end_of_day
-            transition_time = start + (end - start) * random.random()
-
-        session.add(Queue(
-            user_id=user.id,
-            message_id=update.message.message_id,
-            url=url,
-            transition_time=transition_time
-        ))
-        await session.commit()
+# Загрузка ссылок файлом .txt / .csv
+async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    db_user = await get_user(user.id, user.username)
+    if not db_user:
+        return
 
+    document = update.message.document
+    if document.file_size and document.file_size > BULK_MAX_FILE_BYTES:
         await update.message.reply_text(
-            "Ссылка добавлена в очередь ⏳",
+            f"Файл больше {BULK_MAX_FILE_BYTES // 1024} КБ — разбейте его на части",
+            reply_to_message_id=update.message.message_id
+        )
+        return
+
+    buffer = io.BytesIO()
+    await (await document.get_file()).download_to_memory(buffer)
+    buffer.seek(0)
+    collector = LinkCollector(BULK_MAX_LINKS)
+    collector.add_file(buffer, csv_format=(document.file_name or "").lower().endswith(".csv"))
+    if not collector.links:
+        write_behind.add(Event(user_id=user.id, state="no_link"))
+        EVENTS_TOTAL.inc(state="no_link")
+        await update.message.reply_text(
+            "В файле нет ссылок",
             reply_to_message_id=update.message.message_id
         )
+        return
+    await enqueue_bulk(update, db_user, collector)
+
+
+async def enqueue_links(user_id: int, mode: str, message_id: int, urls: list, skip_pending: bool = False):
+    """
+    Ставит ссылки в очередь одним INSERT и будит диспетчер.
+    skip_pending — пропустить ссылки, которые у пользователя уже ждут перехода.
+    Возвращает (список transition_time добавленных, сколько пропущено).
+    """
+    async with AsyncSessionLocal() as session:
+        skipped = 0
+        if skip_pending:
+            pending = set()
+            for i in range(0, len(urls), 500):
+                pending.update((await session.scalars(
+                    select(Queue.url).where(
+                        Queue.user_id == user_id,
+                        Queue.status != "done",
+                        Queue.url.in_(urls[i:i + 500]),
+                    )
+                )).all())
+            skipped = sum(1 for url in urls if url in pending)
+            urls = [url for url in urls if url not in pending]
+        if not urls:
+            return [], skipped
+
+        stmt = insert(Queue).returning(Queue.id, Queue.transition_time)
+        if mode == "immediate":
+            now = datetime.now()
+            rows = (await session.execute(stmt, [
+                {"user_id": user_id, "message_id": message_id, "url": url, "transition_time": now}
+                for url in urls
+            ])).all()
+            await session.commit()
+        else:
+            # выбор слотов и вставка под одной блокировкой — иначе параллельные
+            # сообщения увидят одну и ту же занятость слотов
+            async with slot_scheduler.lock:
+                times = await slot_scheduler.pick(session, user_id, count=len(urls))
+                rows = (await session.execute(stmt, [
+                    {"user_id": user_id, "message_id": message_id, "url": url, "transition_time": t}
+                    for url, t in zip(urls, times)
+                ])).all()
+                await session.commit()
+
+    # Будим диспетчер: немедленные задачи стартуют сразу, daily — в свой срок
+    for queue_id, transition_time in rows:
+        dispatcher.schedule(queue_id, transition_time)
+    return [t for _, t in rows], skipped
+
+
+async def enqueue_bulk(update: Update, db_user, collector: LinkCollector):
+    """Ставит в очередь пачку ссылок и отвечает одной сводкой."""
+    times, skipped = await enqueue_links(
+        update.effective_user.id, db_user.transition_mode,
+        update.message.message_id, collector.links, skip_pending=True,
+    )
+    lines = [f"Добавлено в очередь: {len(times)} ⏳"]
+    if times and db_user.transition_mode == "daily":
+        lines.append(
+            f"Переходы запланированы с {min(times).strftime('%H:%M %d.%m')} "
+            f"по {max(times).strftime('%H:%M %d.%m')}"
+        )
+    if collector.duplicates:
+        lines.append(f"Повторы отброшены: {collector.duplicates}")
+    if skipped:
+        lines.append(f"Уже были в очереди: {skipped}")
+    if collector.truncated:
+        lines.append(f"Принято не больше {BULK_MAX_LINKS} ссылок за раз, остальные отброшены")
+    await update.message.reply_text(
+        "\n".join(lines),
+        reply_to_message_id=update.message.message_id
+    )
 
 # Отмена
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -417,12 +713,11 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     context.user_data.pop("adding_role", None)
     context.user_data.pop("inviter_id", None)
-    async with AsyncSessionLocal() as session:
-        db_user = await fetch_db_user(session, query.from_user.id)
-        if not db_user:
-            return
-        role = db_user.role
-        await query.message.edit_text("Отменено", reply_markup=main_menu(role))
+    db_user = await get_user(query.from_user.id)
+    if not db_user:
+        return
+    role = db_user.role
+    await query.message.edit_text("Отменено", reply_markup=main_menu(role))
 
 def register_handlers(app):
     app.add_handler(CommandHandler("start", start_cmd))
@@ -430,13 +725,15 @@ def register_handlers(app):
     app.add_handler(MessageHandler(filters.Regex("^☰ Меню$") & ~filters.COMMAND, show_main_menu))
 
     app.add_handler(CallbackQueryHandler(back_to_menu, pattern=r"^back_to_menu$"))
-    app.add_handler(CallbackQueryHandler(on_queue, pattern=r"^show_queue$"))
+    app.add_handler(CallbackQueryHandler(on_queue, pattern=r"^(show_queue|queue:[fb]:.+)$"))
     app.add_handler(CallbackQueryHandler(on_delete_queue, pattern=r"^del_queue:"))
     app.add_handler(CallbackQueryHandler(show_stats, pattern=r"^show_stats$"))
-    app.add_handler(CallbackQueryHandler(show_history, pattern=r"^show_history$"))
+    app.add_handler(CallbackQueryHandler(show_history, pattern=r"^(show_history|history:[on]:\d+)$"))
+    app.add_handler(CallbackQueryHandler(export_history, pattern=r"^export_history$"))
     app.add_handler(CallbackQueryHandler(show_transition_mode, pattern=r"^show_transition_mode$"))
     app.add_handler(CallbackQueryHandler(set_transition_mode, pattern=r"^mode_"))
     app.add_handler(CallbackQueryHandler(show_users, pattern=r"^show_users$"))
+    app.add_handler(CallbackQueryHandler(show_latency, pattern=r"^show_latency:"))
     app.add_handler(CallbackQueryHandler(add_user_prompt, pattern=r"^add_user$"))
     app.add_handler(CallbackQueryHandler(add_moderator_prompt, pattern=r"^add_moderator$"))
     app.add_handler(CallbackQueryHandler(delete_user, pattern=r"^del_user:"))
@@ -444,4 +741,8 @@ def register_handlers(app):
     app.add_handler(CallbackQueryHandler(noop_callback, pattern=r"^noop$"))
 
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_message))
+    app.add_handler(MessageHandler(
+        filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv"), on_document
+    ))
     app.add_handler(CommandHandler("queue", on_queue))
+    app.add_handler(CommandHandler("export", export_history))
@@ -0,0 +1,259 @@
+# http_resolver.py
+
+import re
+import html
+import time
+import requests
+from urllib.parse import urljoin
+
+from config import HTTP_TIER_MAX_HOPS, HTTP_TIER_TIMEOUT, HTTP_TIER_MAX_BODY, REDIRECT_TIMEOUT
+
+# <meta http-equiv="refresh" content="0; url=...">
+META_REFRESH_RE = re.compile(
+    r"""<meta[^>]+http-equiv\s*=\s*["']?refresh["']?[^>]*>""", re.I
+)
+# группы: задержка (секунды), адрес
+META_CONTENT_RE = re.compile(
+    r"""content\s*=\s*["']\s*(\d*)(?:\.\d*)?\s*[;,]?\s*(?:url\s*=\s*)?['"]?([^"'>]*)""", re.I
+)
+# Тривиальные JS-переходы: location.href = "...", location.replace("...") и т.п.
+JS_NAV_RE = re.compile(
+    r"""(?:window\.|document\.|top\.|self\.)?location"""
+    r"""(?:\.href)?\s*(?:=\s*|\.(?:replace|assign)\(\s*)(["'])([^"']+)\1""",
+    re.I
+)
+SCRIPT_RE = re.compile(r"<script\b([^>]*)>(.*?)</script>", re.I | re.S)
+SCRIPT_TYPE_RE = re.compile(r"""\btype\s*=\s*["']?([^"'\s>]+)""", re.I)
+# Код вне <script>: обработчики событий (onload=...) и javascript:-адреса
+HANDLER_ATTR_RE = re.compile(
+    r"""<[a-z][^>]*?\son[a-z]+\s*=|\s(?:href|src|action|formaction)\s*=\s*["']?\s*javascript:""",
+    re.I
+)
+# Комментарии JS — не считаются кодом перед оператором перехода
+JS_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+
+CHROME_VERSION_RE = re.compile(r"Chrome/(\d+)")
+
+# platform устройства → Sec-CH-UA-Platform
+CH_PLATFORMS = {
+    "Win32": "Windows",
+    "MacIntel": "macOS",
+    "Linux aarch64": "Android",
+    "Linux x86_64": "Linux",
+}
+
+
+def device_headers(device: dict) -> dict:
+    """
+    Заголовки запроса под устройство: UA, язык и, для Chromium,
+    client hints (Sec-CH-UA*), как их отправил бы реальный браузер.
+    """
+    ua = device["ua"]
+    headers = {
+        "User-Agent": ua,
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Accept-Language": "ru-RU,ru;q=0.9",
+        "Upgrade-Insecure-Requests": "1",
+    }
+    m = CHROME_VERSION_RE.search(ua)
+    if m:
+        major = m.group(1)
+        platform = CH_PLATFORMS.get(device["platform"], "Unknown")
+        if "Android" in ua:
+            platform = "Android"
+        headers.update({
+            "Sec-CH-UA": (
+                f'"Chromium";v="{major}", "Google Chrome";v="{major}", '
+                f'"Not-A.Brand";v="99"'
+            ),
+            "Sec-CH-UA-Mobile": "?1" if device["mobile"] else "?0",
+            "Sec-CH-UA-Platform": f'"{platform}"',
+        })
+    return headers
+
+
+def _read_body(resp):
+    """
+    Читает не больше HTTP_TIER_MAX_BODY байт тела ответа.
+    Возвращает (текст, сколько байт прочитано).
+    """
+    chunks = []
+    size = 0
+    for chunk in resp.iter_content(chunk_size=16384):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= HTTP_TIER_MAX_BODY:
+            break
+    encoding = resp.encoding or "utf-8"
+    text = b"".join(chunks)[:HTTP_TIER_MAX_BODY].decode(encoding, errors="replace")
+    return text, size
+
+
+def _headers_size(headers) -> int:
+    return sum(len(k) + len(v) + 4 for k, v in headers.items())
+
+
+def _is_top_level(script: str, pos: int) -> bool:
+    """
+    True, если оператор, начинающийся в pos, выполняется безусловно при
+    загрузке: он не внутри функции, блока или скобок, и перед ним в том
+    же операторе ничего нет (if (...), &&, ?:, else и т.п.). Строки и
+    комментарии пропускаются; сомнительные случаи — False.
+    """
+    depth = 0
+    statement_start = 0
+    i = 0
+    while i < pos:
+        ch = script[i]
+        if ch in "\"'`":
+            end = i + 1
+            while end < pos and script[end] != ch:
+                end += 2 if script[end] == "\\" else 1
+            i = end + 1
+            continue
+        if script.startswith("//", i):
+            end = script.find("\n", i)
+            i = pos if end == -1 or end > pos else end
+            continue
+        if script.startswith("/*", i):
+            end = script.find("*/", i + 2)
+            i = pos if end == -1 or end > pos else end + 2
+            continue
+        if ch in "({[":
+            depth += 1
+        elif ch in ")}]":
+            depth -= 1
+            if ch == "}" and depth == 0:
+                statement_start = i + 1
+        elif ch == ";" and depth == 0:
+            statement_start = i + 1
+        i += 1
+    if depth != 0:
+        return False
+    prefix = JS_COMMENT_RE.sub("", script[statement_start:pos])
+    return not prefix.strip()
+
+
+def _next_from_html(body: str):
+    """
+    Ищет в HTML следующий адрес перехода.
+    Возвращает кортеж (next_url: str|None, ambiguous: bool):
+      ambiguous=True — на странице есть JS (встроенный, внешний
+      <script src>, обработчик on*= или javascript:-адрес), который может
+      куда-то перейти, но разобрать его без браузера нельзя. Конечной
+      считается только страница совсем без скриптов.
+    Meta refresh с задержкой больше REDIRECT_TIMEOUT не считается переходом
+    (браузер его тоже не дождался бы), JS — только безусловный переход
+    верхнего уровня скрипта; переходы в функциях, обработчиках и под
+    условиями оставляются браузеру.
+    """
+    for tag in META_REFRESH_RE.findall(body):
+        m = META_CONTENT_RE.search(tag)
+        if not m or not m.group(2).strip():
+            continue
+        if m.group(1) and int(m.group(1)) > REDIRECT_TIMEOUT:
+            continue
+        return html.unescape(m.group(2).strip()), False
+
+    scripts = []
+    for attrs, script in SCRIPT_RE.findall(body):
+        kind = SCRIPT_TYPE_RE.search(attrs)
+        if kind and "javascript" not in kind.group(1).lower() and kind.group(1).lower() != "module":
+            # application/ld+json, text/template и т.п. не исполняются
+            continue
+        scripts.append(script)
+
+    for script in scripts:
+        for m in JS_NAV_RE.finditer(script):
+            if m.group(2).startswith(("#", "javascript:")):
+                continue
+            if _is_top_level(script, m.start()):
+                return m.group(2), False
+
+    # любой скрипт, даже без явного location (внешний файл, обфускация),
+    # может увести со страницы — решает браузер
+    ambiguous = bool(scripts) or bool(HANDLER_ATTR_RE.search(body))
+    return None, ambiguous
+
+
+def resolve_http(url: str, proxy_auth: str, device: dict, stats: dict = None):
+    """
+    Первый, дешёвый уровень: проходит цепочку редиректов обычными
+    HTTP-запросами через тот же прокси с заголовками устройства.
+
+    Понимает 3xx Location, <meta http-equiv=refresh> (с задержкой не
+    больше REDIRECT_TIMEOUT) и безусловные location.href = "..." /
+    location.replace("...") верхнего уровня скрипта.
+
+    Возвращает финальный URL или None, если без браузера конечную
+    точку не определить (JS, ошибки, антибот, слишком длинная цепочка).
+    Если передан stats, в stats["proxy_bytes"] добавляется примерный
+    объём трафика через прокси (заголовки + прочитанные тела), а в
+    stats["hops"] — пройденные хопы в формате tracer.trace_navigation
+    (для meta/JS-переходов location — найденный в HTML адрес).
+    """
+    proxies = {"http": proxy_auth, "https": proxy_auth}
+    seen = set()
+    if stats is None:
+        stats = {}
+    stats.setdefault("proxy_bytes", 0)
+    hops = stats.setdefault("hops", [])
+    started = time.monotonic()
+
+    with requests.Session() as session:
+        session.headers.update(device_headers(device))
+        for _ in range(HTTP_TIER_MAX_HOPS):
+            if url in seen:
+                # зацикливание — пусть разбирается браузер
+                return None
+            seen.add(url)
+
+            hop_started = time.monotonic()
+            try:
+                resp = session.get(
+                    url,
+                    proxies=proxies,
+                    timeout=HTTP_TIER_TIMEOUT,
+                    allow_redirects=False,
+                    stream=True,
+                )
+            except requests.RequestException:
+                return None
+
+            with resp:
+                stats["proxy_bytes"] += (
+                    len(url) + _headers_size(session.headers) + _headers_size(resp.headers)
+                )
+                hop = {
+                    "url": url,
+                    "status": resp.status_code,
+                    "location": resp.headers.get("Location"),
+                    "ms": int((hop_started - started) * 1000),
+                    "dur": int((time.monotonic() - hop_started) * 1000),
+                }
+                hops.append(hop)
+                if resp.is_redirect:
+                    url = urljoin(url, resp.headers["Location"])
+                    continue
+
+                if resp.status_code >= 400:
+                    return None
+
+                ctype = resp.headers.get("Content-Type", "")
+                if "html" not in ctype.lower():
+                    # не HTML — дальше браузер никуда не уйдёт
+                    return url
+
+                body, size = _read_body(resp)
+                stats["proxy_bytes"] += size
+                next_url, ambiguous = _next_from_html(body)
+
+            if next_url:
+                url = urljoin(url, next_url)
+                hop["location"] = url
+                continue
+            if ambiguous:
+                return None
+            return url
+
+    return None
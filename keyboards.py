@@ -6,7 +6,7 @@ def main_menu(role: str) -> InlineKeyboardMarkup:
     """
     Главное inline-меню:
       - Все пользователи: ⏳ Очередь, 📈 Статистика, 📜 История, ⚙️ Режим перехода, ⏏️ Скрыть меню
-      - Модераторы и админы: + 👥 Пользователи
+      - Модераторы и админы: + 👥 Пользователи, ⏱ Задержки
     """
     buttons = [
         [
@@ -21,7 +21,8 @@ def main_menu(role: str) -> InlineKeyboardMarkup:
 
     if role in ("moderator", "admin"):
         buttons.append([
-            InlineKeyboardButton("👥 Пользователи", callback_data="show_users")
+            InlineKeyboardButton("👥 Пользователи", callback_data="show_users"),
+            InlineKeyboardButton("⏱ Задержки", callback_data="show_latency:day"),
         ])
 
     buttons.append([
@@ -62,6 +63,22 @@ def transition_mode_menu(current_mode: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(buttons)
 
 
+def latency_menu(period: str) -> InlineKeyboardMarkup:
+    """
+    Подменю «⏱ Задержки»: период отчёта (сутки / неделя) + «↩️ Назад».
+    Выбранный период отмечается ✅.
+    """
+    periods = [("Сутки", "day"), ("Неделя", "week")]
+    row = []
+    for label, value in periods:
+        prefix = "✅ " if period == value else ""
+        row.append(InlineKeyboardButton(prefix + label, callback_data=f"show_latency:{value}"))
+    return InlineKeyboardMarkup([
+        row,
+        [InlineKeyboardButton("↩️ Назад", callback_data="back_to_menu")],
+    ])
+
+
 def users_menu(users) -> InlineKeyboardMarkup:
     """
     Меню «Пользователи»: список @username + кнопка «🗑️ Удалить»,
@@ -0,0 +1,55 @@
+# links.py
+#
+# Разбор ссылок из сообщений и загруженных .txt/.csv: один проход по
+# строкам, дубликаты отбрасываются сразу, после лимита разбор прекращается.
+import io
+import re
+import csv
+
+LINK_RE = re.compile(r"https?://\S+|t\.me/\S+|@\w+")
+
+
+class LinkCollector:
+    """Уникальные ссылки в порядке появления, не больше limit."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.links = []
+        self.duplicates = 0
+        # найдены ссылки сверх лимита — разбор остановлен
+        self.truncated = False
+        self._seen = set()
+
+    def add_text(self, text: str) -> bool:
+        """Добавляет ссылки из строки; False — лимит исчерпан, дальше читать незачем."""
+        for link in LINK_RE.findall(text):
+            if link in self._seen:
+                self.duplicates += 1
+                continue
+            if len(self.links) >= self.limit:
+                self.truncated = True
+                return False
+            self._seen.add(link)
+            self.links.append(link)
+        return True
+
+    def add_lines(self, lines):
+        for line in lines:
+            if not self.add_text(line):
+                break
+
+    def add_file(self, fileobj, csv_format: bool):
+        """
+        Читает бинарный файл построчно. В CSV ссылки ищутся по ячейкам —
+        чтобы разделитель не прилипал к концу ссылки.
+        """
+        lines = io.TextIOWrapper(fileobj, encoding="utf-8-sig", errors="replace", newline="")
+        if csv_format:
+            sample = lines.read(4096)
+            lines.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            self.add_lines(" ".join(row) for row in csv.reader(lines, dialect))
+        else:
+            self.add_lines(lines)
@@ -1,10 +1,15 @@
 # main.py
+import asyncio
 import logging
 from telegram.ext import ApplicationBuilder
-from config import TELEGRAM_TOKEN
+from config import TELEGRAM_TOKEN, RUN_WORKERS, METRICS_HOST, METRICS_PORT
 from db import init_db
 from handlers import register_handlers
-from tasks import setup_scheduler
+from tasks import setup_scheduler, dispatcher, reclaim_expired_leases
+from redirector import proxy_reservoir, start_browser, close_browser
+from writer import write_behind
+from notifier import notification_sender
+from metrics import start_metrics_server
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -14,13 +19,41 @@ logging.basicConfig(
 # Этот колбэк будет вызван внутри event loop ДО polling
 async def on_startup(app):
     await init_db()
+    # GET /metrics для Prometheus (если задан METRICS_PORT)
+    await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    # Отложенная запись Event/ProxyLog пачками
+    write_behind.start()
+    # Отправка результатов из outbox с учётом лимитов Telegram
+    notification_sender.start(app.bot)
+    if not RUN_WORKERS:
+        # Переходы выполняют отдельные процессы worker.py
+        return
+    # Возвращаем в очередь задачи, брошенные упавшими воркерами,
+    # восстанавливаем heap отложенных задач и запускаем диспетчер очереди
+    await reclaim_expired_leases()
+    await dispatcher.load()
+    asyncio.create_task(dispatcher.run(app.bot))
+    # Прогреваем Chrome в фоне, чтобы не задерживать старт polling
+    asyncio.create_task(start_browser())
+    # Запускаем фоновое пополнение резерва прокси
+    proxy_reservoir.start()
+
+# Вызывается после остановки polling
+async def on_shutdown(app):
+    # Досбрасываем накопленные записи до закрытия процесса
+    await write_behind.close()
+    if not RUN_WORKERS:
+        return
+    proxy_reservoir.stop()
+    await close_browser()
 
 def main():
-    # 1) Создаём приложение, региструем on_startup
+    # 1) Создаём приложение, региструем on_startup / on_shutdown
     app = (
         ApplicationBuilder()
         .token(TELEGRAM_TOKEN)
         .post_init(on_startup)
+        .post_shutdown(on_shutdown)
         .build()
     )
 
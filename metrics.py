@@ -0,0 +1,245 @@
+# metrics.py
+
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов по умолчанию, секунды
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, doc: str, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        # observe()/inc() зовутся и из потоков fetch_redirect
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: tuple, extra=()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # счётчики по бакетам (не накопительные), сумма, количество
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{self._labels(key, [('le', f'{bound:g}')])} {cumulative}"
+            yield f"{self.name}_bucket{self._labels(key, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{self._labels(key)} {total}"
+            yield f"{self.name}_count{self._labels(key)} {count}"
+
+
+class Registry:
+    """
+    Метрики процесса в текстовом формате Prometheus. Коллекторы —
+    корутины, которые обновляют «снимочные» gauge (глубина очереди,
+    загрузка пула) непосредственно перед отдачей.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames=()) -> Counter:
+        return self._add(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labelnames, buckets))
+
+    def collector(self, fn):
+        """Декоратор: async fn() вызывается перед каждой отдачей метрик."""
+        self._collectors.append(fn)
+        return fn
+
+    async def render(self) -> str:
+        for collect in self._collectors:
+            try:
+                await collect()
+            except Exception:
+                logger.exception("Коллектор метрик %s упал", collect.__name__)
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+
+registry = Registry()
+
+PROXY_ACQUIRE_SECONDS = registry.histogram(
+    "redirector_proxy_acquire_seconds",
+    "Время получения московской прокси-сессии",
+    ["source"],  # reservoir | live
+)
+PROXY_ATTEMPTS = registry.histogram(
+    "redirector_proxy_attempts",
+    "Сколько сессий проверено до московской (или до отказа)",
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
+BROWSER_LAUNCH_SECONDS = registry.histogram(
+    "browser_launch_seconds",
+    "Запуск Chrome",
+    ["engine"],  # selenium | cdp
+)
+REDIRECT_WAIT_SECONDS = registry.histogram(
+    "redirector_redirect_wait_seconds",
+    "Прохождение цепочки редиректов",
+    ["tier"],  # http | browser
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "db_query_seconds",
+    "Время SQL-запросов",
+    ["op"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+QUEUE_LAG_SECONDS = registry.histogram(
+    "queue_lag_seconds",
+    "От transition_time задачи до записи результата",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+)
+NOTIFY_DELAY_SECONDS = registry.histogram(
+    "notify_delay_seconds",
+    "От записи результата в outbox до отправки в Telegram",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+QUEUE_DEPTH = registry.gauge("queue_depth", "Задачи в очереди по статусу", ["status"])
+WORKER_POOL_ACTIVE = registry.gauge("worker_pool_active", "Переходы, выполняемые сейчас")
+WORKER_POOL_CAPACITY = registry.gauge("worker_pool_capacity", "Размер пула переходов")
+WORKER_POOL_WAITING = registry.gauge("worker_pool_waiting", "Задачи, ждущие слот пула")
+WORKER_POOL_UTILIZATION = registry.gauge("worker_pool_utilization", "Доля занятых слотов пула")
+EVENTS_TOTAL = registry.counter("events_total", "Записанные события по состоянию", ["state"])
+RETENTION_ARCHIVED_ROWS = registry.counter(
+    "retention_archived_rows_total", "Строки, перенесённые в архив и удалённые", ["table"]
+)
+
+
+@contextmanager
+def timed(timings: dict, stage: str, histogram: Histogram = None, **labels):
+    """
+    Засекает блок: добавляет миллисекунды в timings[stage] (для Event.timings)
+    и, если передана гистограмма, наблюдает секунды в ней.
+    Время пишется и при исключении — медленные отказы тоже интересны.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + int(elapsed * 1000)
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+        # заголовки запроса нам не нужны, но их надо дочитать
+        while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = (await registry.render()).encode()
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int):
+    """Поднимает GET /metrics на host:port (port 0 — выключено)."""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("Метрики: http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,138 @@
+# migrations.py
+
+import logging
+from sqlalchemy import (
+    Table, Column, Integer, String, DateTime, MetaData, inspect, select, text
+)
+from sqlalchemy.sql import func
+
+from models import Base
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Отдельные метаданные: служебная таблица не относится к моделям приложения
+_meta = MetaData()
+schema_version = Table(
+    "schema_version", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# ---------- помощники (все идемпотентны: на свежей БД create_all уже всё создал) ----------
+
+def _add_column(conn, table: str, name: str, ddl_type: str):
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if name not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+
+
+def _create_indexes(conn, table: str):
+    for index in Base.metadata.tables[table].indexes:
+        index.create(conn, checkfirst=True)
+
+
+# ---------- миграции ----------
+
+def _m1_event_tier(conn):
+    _add_column(conn, "events", "tier", "VARCHAR")
+
+
+def _m2_queue_lease(conn):
+    _add_column(conn, "queue", "worker_id", "VARCHAR")
+    _add_column(conn, "queue", "lease_until", "DATETIME")
+
+
+def _m3_hot_path_indexes(conn):
+    _create_indexes(conn, "queue")
+    _create_indexes(conn, "events")
+    _create_indexes(conn, "notifications")
+
+
+def _m4_daily_stats_backfill(conn):
+    # таблицу создал create_all; на существующей БД наполняем её из events
+    rollups.rebuild(conn)
+
+
+def _m5_notification_attempts(conn):
+    _add_column(conn, "notifications", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _m6_event_proxy_bytes(conn):
+    _add_column(conn, "events", "proxy_bytes", "INTEGER")
+
+
+def _m7_event_hops(conn):
+    _add_column(conn, "events", "hops", "JSON")
+
+
+def _m8_event_timings(conn):
+    _add_column(conn, "events", "timings", "JSON")
+    _create_indexes(conn, "events")
+
+
+def _m9_event_user_id_index(conn):
+    _create_indexes(conn, "events")
+
+
+def _m10_proxy_logs_timestamp_index(conn):
+    _create_indexes(conn, "proxy_logs")
+
+
+def _m11_notification_backoff(conn):
+    _add_column(conn, "notifications", "next_attempt_at", "DATETIME")
+
+
+# (версия, описание, функция) — только добавлять в конец, не менять старые
+MIGRATIONS = [
+    (1, "events.tier", _m1_event_tier),
+    (2, "queue.worker_id, queue.lease_until", _m2_queue_lease),
+    (3, "indexes for queue/events/notifications hot paths", _m3_hot_path_indexes),
+    (4, "backfill user_daily_stats from events", _m4_daily_stats_backfill),
+    (5, "notifications.attempts", _m5_notification_attempts),
+    (6, "events.proxy_bytes", _m6_event_proxy_bytes),
+    (7, "events.hops", _m7_event_hops),
+    (8, "events.timings, events timestamp index", _m8_event_timings),
+    (9, "events (user_id, id) index", _m9_event_user_id_index),
+    (10, "proxy_logs timestamp index", _m10_proxy_logs_timestamp_index),
+    (11, "notifications.next_attempt_at", _m11_notification_backoff),
+]
+
+
+def run_migrations(conn):
+    """
+    Применяет ещё не применённые миграции по порядку; каждая
+    применённая версия записывается в schema_version.
+    Вызывается через conn.run_sync из db.init_db после create_all.
+    """
+    _meta.create_all(conn)
+    applied = set(conn.execute(select(schema_version.c.version)).scalars())
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info("Миграция %d: %s", version, description)
+        migrate(conn)
+        conn.execute(
+            schema_version.insert().values(version=version, description=description)
+        )
+    _check_columns(conn)
+
+
+def _check_columns(conn):
+    """
+    Сверяет столбцы моделей с БД после миграций. Столбец, добавленный в
+    models.py без миграции, иначе всплывёт только на первой вставке
+    («no such column») — здесь процесс падает сразу при старте.
+    """
+    inspector = inspect(conn)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{c.name}" for c in table.columns if c.name not in existing)
+    if missing:
+        raise RuntimeError(
+            "В БД нет столбцов " + ", ".join(missing)
+            + " — добавьте миграцию в MIGRATIONS (migrations.py)"
+        )
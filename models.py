@@ -1,7 +1,9 @@
 # models.py
 
+from datetime import datetime, timezone
+
 from sqlalchemy import (
-    Column, Integer, String, DateTime, Enum as SQLEnum, Boolean, ForeignKey, JSON
+    Column, Integer, String, Date, DateTime, Enum as SQLEnum, Boolean, ForeignKey, JSON, Index
 )
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -9,6 +11,16 @@ from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+
+def db_now() -> datetime:
+    """
+    Текущий момент в шкале server_default=func.now() (events.timestamp,
+    proxy_logs.timestamp и т.д.): SQLite пишет CURRENT_TIMESTAMP в UTC.
+    Сравнения с этими столбцами и дни user_daily_stats считаются от него.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -49,6 +61,11 @@ class ProxyLog(Base):
     city      = Column(String, nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # retention.py: группы попыток старше срока хранения
+        Index("ix_proxy_logs_timestamp", "timestamp"),
+    )
+
 class Event(Base):
     __tablename__ = "events"
     id               = Column(Integer, primary_key=True, autoincrement=True)
@@ -67,8 +84,35 @@ class Event(Base):
     final_url        = Column(String, nullable=True)
     ip               = Column(String, nullable=True)
     isp              = Column(String, nullable=True)
+    # Каким уровнем получен результат: http | browser
+    tier             = Column(String, nullable=True)
+    # Примерный объём трафика через прокси за переход, байт
+    proxy_bytes      = Column(Integer, nullable=True)
+    # Цепочка хопов: [{"url", "status", "location", "ms", "dur"}, ...]
+    hops             = Column(JSON, nullable=True)
+    # Длительности стадий в мс: {"slot_wait", "proxy", "http_tier",
+    # "browser_start", "page", "total"} — только у переходов из очереди
+    timings          = Column(JSON, nullable=True)
     timestamp        = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # show_stats / show_history: user_id + state, диапазон/сортировка по времени
+        Index("ix_events_user_state_ts", "user_id", "state", "timestamp"),
+        # отчёт «⏱ Задержки»: последние события всех пользователей за период
+        Index("ix_events_timestamp", "timestamp"),
+        # «📜 История» и выгрузка CSV: события пользователя постранично по id
+        Index("ix_events_user_id", "user_id", "id"),
+    )
+
+class UserDailyStat(Base):
+    """Счётчик успешных переходов пользователя за день (для show_stats)."""
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(Integer, primary_key=True)
+    # дата в той же шкале, что и events.timestamp
+    day     = Column(Date, primary_key=True)
+    success = Column(Integer, nullable=False, default=0)
+
 class Queue(Base):
     __tablename__ = "queue"
 
@@ -80,3 +124,32 @@ class Queue(Base):
     transition_time = Column(DateTime(timezone=True), nullable=True)
     # Новый статус обработки: pending, in_progress, done
     status          = Column(SQLEnum("pending", "in_progress", "done", name="queue_statuses"), nullable=False, server_default="pending")
+    # Аренда: какой воркер взял задачу и до какого момента она за ним
+    worker_id       = Column(String, nullable=True)
+    lease_until     = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # tick / dispatcher: status='pending' AND transition_time <= now
+        Index("ix_queue_status_time", "status", "transition_time"),
+        # on_queue: user_id + status, ORDER BY transition_time
+        Index("ix_queue_user_status_time", "user_id", "status", "transition_time"),
+    )
+
+class Notification(Base):
+    """Outbox: результат перехода, ожидающий отправки ботом (notifier.py)."""
+    __tablename__ = "notifications"
+
+    id                  = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id             = Column(Integer, nullable=False)
+    reply_to_message_id = Column(Integer, nullable=True)
+    text                = Column(String, nullable=False)
+    created             = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at             = Column(DateTime(timezone=True), nullable=True)
+    attempts            = Column(Integer, nullable=False, default=0, server_default="0")
+    # после сбоя отправки — не раньше этого момента (экспоненциальная пауза)
+    next_attempt_at     = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # NotificationSender: sent_at IS NULL ORDER BY id
+        Index("ix_notifications_sent_at", "sent_at", "id"),
+    )
@@ -0,0 +1,318 @@
+# notifier.py
+
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, or_
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from db import AsyncSessionLocal
+from models import Notification
+from metrics import NOTIFY_DELAY_SECONDS
+from config import (
+    NOTIFY_INTERVAL,
+    NOTIFY_GLOBAL_RATE,
+    NOTIFY_CHAT_RATE,
+    NOTIFY_CHAT_BURST,
+    NOTIFY_MERGE_WINDOW,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_BACKOFF_BASE,
+    NOTIFY_BACKOFF_MAX,
+    NOTIFY_KEEP_SENT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram
+MAX_MESSAGE_LEN = 4096
+# Сколько неотправленных строк outbox читаем за один проход
+FETCH_LIMIT = 500
+# Чистка отправленных строк: не чаще раза в столько секунд, пачками по PRUNE_BATCH
+PRUNE_INTERVAL = 600
+PRUNE_BATCH = 1000
+
+
+class TokenBucket:
+    """Классическое «ведро токенов»: rate токенов в секунду, не больше capacity."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def delay(self) -> float:
+        """Через сколько секунд появится токен."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def take(self):
+        while not self.try_take():
+            await asyncio.sleep(self.delay())
+
+
+class NotificationSender:
+    """
+    Отправитель результатов из outbox (таблица notifications).
+
+    Соблюдает лимиты Telegram: общий (NOTIFY_GLOBAL_RATE сообщений в
+    секунду) и на чат (NOTIFY_CHAT_RATE, всплеск до NOTIFY_CHAT_BURST).
+    На RetryAfter ставит на паузу всю отправку на указанное время.
+    Результаты одного чата, накопившиеся за NOTIFY_MERGE_WINDOW секунд
+    (или ждущие из-за лимита чата), уходят одним сообщением.
+
+    wake() — разбудить после записи новых строк в этом же процессе;
+    строки от отдельных воркеров подхватываются раз в NOTIFY_INTERVAL.
+    Отправленные строки удаляются через NOTIFY_KEEP_SENT секунд (prune()).
+    """
+    def __init__(self):
+        self._global = TokenBucket(NOTIFY_GLOBAL_RATE, NOTIFY_GLOBAL_RATE)
+        self._chats = {}
+        # chat_id -> когда впервые увидели его неотправленные строки
+        self._first_seen = {}
+        self._paused_until = 0.0
+        self._wake = asyncio.Event()
+        self._task = None
+        self._pruned_at = 0.0
+
+        self.sent = 0
+        self.merged = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self, bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(NOTIFY_CHAT_RATE, NOTIFY_CHAT_BURST)
+        return bucket
+
+    async def _run(self, bot):
+        while True:
+            try:
+                delay = await self._send_round(bot)
+                if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    await self.prune()
+            except Exception:
+                logger.exception("Ошибка при отправке уведомлений")
+                delay = NOTIFY_INTERVAL
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_round(self, bot) -> float:
+        """
+        Один проход по outbox. Возвращает, через сколько секунд имеет
+        смысл прийти снова.
+        """
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Notification)
+                .where(
+                    Notification.sent_at.is_(None),
+                    or_(
+                        Notification.next_attempt_at.is_(None),
+                        Notification.next_attempt_at <= datetime.now(),
+                    ),
+                )
+                .order_by(Notification.id)
+                .limit(FETCH_LIMIT)
+            )).scalars().all()
+
+        by_chat = {}
+        for row in rows:
+            by_chat.setdefault(row.chat_id, []).append(row)
+        # чаты, чьи строки уже ушли (или удалены), больше не ждём
+        self._first_seen = {
+            chat_id: seen for chat_id, seen in self._first_seen.items() if chat_id in by_chat
+        }
+
+        next_delay = NOTIFY_INTERVAL
+        for chat_id, chat_rows in by_chat.items():
+            now = time.monotonic()
+            seen = self._first_seen.setdefault(chat_id, now)
+            # даём соседним результатам этого чата успеть накопиться
+            wait_merge = seen + NOTIFY_MERGE_WINDOW - now
+            if wait_merge > 0:
+                next_delay = min(next_delay, wait_merge)
+                continue
+
+            bucket = self._chat_bucket(chat_id)
+            if not bucket.try_take():
+                next_delay = min(next_delay, bucket.delay())
+                continue
+
+            await self._global.take()
+            batch = self._take_batch(chat_rows)
+            if not await self._deliver(bot, chat_id, batch):
+                # RetryAfter — прекращаем проход до конца паузы
+                return max(self._paused_until - time.monotonic(), 0.0)
+            if len(batch) < len(chat_rows):
+                # остаток чата отправим, когда появится токен
+                next_delay = min(next_delay, bucket.delay())
+            else:
+                self._first_seen.pop(chat_id, None)
+
+        # ведра «тихих» чатов давно полны — держать их незачем
+        self._chats = {
+            chat_id: bucket for chat_id, bucket in self._chats.items()
+            if chat_id in by_chat or not bucket.full()
+        }
+        return next_delay
+
+    @staticmethod
+    def _take_batch(chat_rows):
+        """Первые строки чата, которые помещаются в одно сообщение."""
+        batch = [chat_rows[0]]
+        size = len(chat_rows[0].text)
+        for row in chat_rows[1:]:
+            size += len(row.text) + 2
+            if size > MAX_MESSAGE_LEN:
+                break
+            batch.append(row)
+        return batch
+
+    async def _deliver(self, bot, chat_id: int, batch) -> bool:
+        """
+        Отправляет пачку строк одним сообщением и помечает их.
+        Возвращает False, если Telegram попросил подождать (RetryAfter).
+        """
+        ids = [row.id for row in batch]
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="\n\n".join(row.text for row in batch),
+                parse_mode="HTML",
+                disable_web_page_preview=True,
+                # ответом на исходное сообщение — только если результат один
+                reply_to_message_id=(batch[0].reply_to_message_id if len(batch) == 1 else None),
+                # исходное сообщение со ссылкой пользователь мог удалить
+                allow_sending_without_reply=True,
+            )
+        except RetryAfter as e:
+            retry = e.retry_after
+            seconds = retry.total_seconds() if hasattr(retry, "total_seconds") else float(retry)
+            self._paused_until = time.monotonic() + seconds
+            self.retry_after += 1
+            logger.warning("Telegram RetryAfter: пауза %.1f с", seconds)
+            return False
+        except Forbidden:
+            # бот заблокирован — повторять бессмысленно
+            logger.warning("Уведомления для чата %s не доставлены", chat_id, exc_info=True)
+            await self._mark(batch, sent=True, failed=True)
+            return True
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                logger.warning("Чат %s не найден, уведомления %s отброшены", chat_id, ids)
+                await self._mark(batch, sent=True, failed=True)
+                return True
+            # прочие BadRequest — повторяем с паузой, как обычный сбой
+            logger.warning("Telegram отклонил уведомления %s: %s", ids, e)
+            await self._mark(batch, sent=False, failed=True)
+            return True
+        except Exception:
+            logger.exception("Не удалось отправить уведомления %s", ids)
+            await self._mark(batch, sent=False, failed=True)
+            return True
+
+        self.sent += 1
+        self.merged += len(batch) - 1
+        await self._mark(batch, sent=True)
+        for row in batch:
+            if row.created is not None:
+                delay = (datetime.now(row.created.tzinfo) - row.created).total_seconds()
+                NOTIFY_DELAY_SECONDS.observe(max(delay, 0.0))
+        return True
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        """Пауза в секундах перед следующей попыткой после attempts неудач."""
+        return min(NOTIFY_BACKOFF_BASE * 2 ** max(attempts - 1, 0), NOTIFY_BACKOFF_MAX)
+
+    async def _mark(self, batch, sent: bool, failed: bool = False):
+        ids = [row.id for row in batch]
+        async with AsyncSessionLocal() as session:
+            if failed:
+                now = datetime.now()
+                for row in batch:
+                    attempts = row.attempts + 1
+                    await session.execute(
+                        update(Notification)
+                        .where(Notification.id == row.id)
+                        .values(
+                            attempts=attempts,
+                            next_attempt_at=now + timedelta(seconds=self.backoff(attempts)),
+                            # после NOTIFY_MAX_ATTEMPTS неудач сдаёмся, чтобы не зациклиться
+                            sent_at=(now if attempts >= NOTIFY_MAX_ATTEMPTS else None),
+                        )
+                    )
+                self.failed += len(ids)
+            if sent:
+                await session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(ids))
+                    .values(sent_at=datetime.now())
+                )
+            await session.commit()
+
+    async def prune(self) -> int:
+        """Удаляет строки, отправленные раньше NOTIFY_KEEP_SENT секунд назад."""
+        border = datetime.now() - timedelta(seconds=NOTIFY_KEEP_SENT)
+        total = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                ids = (await session.execute(
+                    select(Notification.id)
+                    .where(Notification.sent_at.isnot(None), Notification.sent_at < border)
+                    .limit(PRUNE_BATCH)
+                )).scalars().all()
+                if not ids:
+                    return total
+                await session.execute(delete(Notification).where(Notification.id.in_(ids)))
+                await session.commit()
+            total += len(ids)
+            # короткие транзакции: между пачками отдаём БД остальным
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+            "chats_tracked": len(self._chats),
+        }
+
+
+# Общий отправитель процесса бота
+notification_sender = NotificationSender()
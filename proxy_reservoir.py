@@ -0,0 +1,129 @@
+# proxy_reservoir.py
+
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyReservoir:
+    """
+    Ограниченный резерв заранее проверенных «московских» прокси-сессий.
+
+    Фоновый поток-производитель держит резерв заполненным, вызывая
+    acquire_fn (тот же _acquire_moscow_proxy, что и при живом подборе).
+    Каждая запись живёт не дольше ttl секунд — после этого выходной IP
+    сессии мог смениться, и запись выбрасывается.
+
+    pop() отдаёт готовую сессию мгновенно или None, если резерв пуст.
+    stats() — текущая глубина, темп пополнения и счётчики hit/miss.
+    """
+    def __init__(self, acquire_fn, size: int, ttl: int, refill_interval: float,
+                 stats_interval: int = 60):
+        self.acquire_fn = acquire_fn
+        self.size = size
+        self.ttl = ttl
+        self.refill_interval = refill_interval
+        self.stats_interval = stats_interval
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.produced = 0
+        self.failed = 0
+        # моменты пополнений за последнюю минуту — для темпа пополнения
+        self._produced_at = deque()
+
+    # ---------- потребитель ----------
+
+    def pop(self):
+        """
+        Возвращает (proxy_auth, info, attempts) свежей сессии или None.
+        """
+        with self._cond:
+            self._drop_expired(time.monotonic())
+            if not self._items:
+                self.misses += 1
+                return None
+            _, proxy_auth, info, attempts = self._items.popleft()
+            self.hits += 1
+            # освободилось место — будим производителя
+            self._cond.notify()
+        return proxy_auth, info, attempts
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            self._drop_expired(now)
+            while self._produced_at and now - self._produced_at[0] > 60:
+                self._produced_at.popleft()
+            return {
+                "depth": len(self._items),
+                "capacity": self.size,
+                "refill_per_min": len(self._produced_at),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "produced": self.produced,
+                "failed": self.failed,
+            }
+
+    # ---------- производитель ----------
+
+    def _drop_expired(self, now: float):
+        # самые старые записи — слева
+        while self._items and now - self._items[0][0] > self.ttl:
+            self._items.popleft()
+            self.expired += 1
+
+    def _run(self):
+        last_stats = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now - last_stats >= self.stats_interval:
+                logger.info("Резерв прокси: %s", self.stats())
+                last_stats = now
+
+            with self._cond:
+                self._drop_expired(now)
+                if len(self._items) >= self.size:
+                    # резерв полон — ждём pop() или истечения старейшей записи
+                    timeout = self.ttl - (now - self._items[0][0])
+                    self._cond.wait(timeout=max(0.1, min(timeout, self.stats_interval)))
+                    continue
+
+            try:
+                proxy_auth, info, attempts = self.acquire_fn()
+            except Exception:
+                # ProxyAcquireError или сетевой сбой — пробуем позже
+                with self._cond:
+                    self.failed += 1
+            else:
+                checked_at = time.monotonic()
+                with self._cond:
+                    self._items.append((checked_at, proxy_auth, info, attempts))
+                    self.produced += 1
+                    self._produced_at.append(checked_at)
+
+            self._stop.wait(self.refill_interval)
+
+    def start(self):
+        """Запускает фоновое пополнение (если резерв включён, size > 0)."""
+        if self.size <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="proxy-reservoir", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
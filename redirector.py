@@ -2,23 +2,37 @@
 
 import time
 import uuid
-import requests
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import unquote
 
-from seleniumwire import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 
 from config import (
     PROXY_USERNAME,
     PROXY_PASSWORD,
     PROXY_DNS,
-    IP_API_URL,
     CHECK_INTERVAL,
     REDIRECT_TIMEOUT,
+    REDIRECT_QUIET_WINDOW,
     MAX_PROXY_ATTEMPTS,
+    PROXY_RACE_WIDTH,
+    PROXY_RESERVOIR_SIZE,
+    PROXY_RESERVOIR_TTL,
+    PROXY_RESERVOIR_REFILL_INTERVAL,
+    HTTP_TIER_ENABLED,
+    BROWSER_ENGINE,
 )
+from driver_pool import driver_pool
+from cdp_engine import cdp_engine
+from proxy_reservoir import ProxyReservoir
+from http_resolver import resolve_http
+from tracer import trace_navigation
+from geoip import geo_resolver
+from metrics import timed, PROXY_ACQUIRE_SECONDS, PROXY_ATTEMPTS, REDIRECT_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
 
 
 class ProxyAcquireError(Exception):
@@ -35,40 +49,41 @@ class ProxyAcquireError(Exception):
         self.attempts = attempts
 
 
-def _acquire_moscow_proxy():
+def _proxy_auth_for_new_session() -> str:
+    """Формирует credentials с новым session id (ротация выходного IP)."""
+    session_id = uuid.uuid4().hex
+    user = f"{PROXY_USERNAME}-session-{session_id}"
+    return f"http://{user}:{PROXY_PASSWORD}@{PROXY_DNS}"
+
+
+def _check_proxy(proxy_auth: str):
     """
-    Пытаемся получить прокси с IP из Москвы, не более MAX_PROXY_ATTEMPTS раз.
-    Возвращает кортеж (proxy_auth: str, info: dict, attempts: list).
-    Если не удаётся — бросает ProxyAcquireError(attempts).
+    Определяет выходной IP/город прокси через geo_resolver
+    (ip-api.com или локальная база, см. GEO_RESOLVER).
+    Возвращает кортеж (info: dict, ip: str|None, city: str|None).
+    """
+    return geo_resolver.check(proxy_auth)
+
+
+def _is_moscow(city) -> bool:
+    return city in ("Moscow", "Moscow Oblast")
+
+
+def _acquire_moscow_proxy_sequential():
+    """
+    Последовательный режим: по одной сессии за раз с паузой CHECK_INTERVAL.
     """
     attempts = []
 
     for attempt in range(1, MAX_PROXY_ATTEMPTS + 1):
-        # Формируем credentials для ротации сессии
-        session_id = uuid.uuid4().hex
-        user = f"{PROXY_USERNAME}-session-{session_id}"
-        proxy_auth = f"http://{user}:{PROXY_PASSWORD}@{PROXY_DNS}"
-
-        ip = city = None
-        info = {}
-        try:
-            resp = requests.get(
-                IP_API_URL,
-                proxies={"http": proxy_auth, "https": proxy_auth},
-                timeout=5
-            )
-            info = resp.json()
-            ip = info.get("query")
-            city = info.get("city")
-        except Exception:
-            # в случае ошибки оставляем ip, city = None
-            pass
+        proxy_auth = _proxy_auth_for_new_session()
+        info, ip, city = _check_proxy(proxy_auth)
 
         # Собираем данные попытки
         attempts.append({"attempt": attempt, "ip": ip, "city": city})
 
         # Если IP в Москве — возвращаем результат
-        if city in ("Moscow", "Moscow Oblast"):
+        if _is_moscow(city):
             return proxy_auth, info, attempts
 
         # Иначе ждём перед следующей попыткой
@@ -78,7 +93,121 @@ def _acquire_moscow_proxy():
     raise ProxyAcquireError(attempts)
 
 
-def fetch_redirect(raw_url: str, device: dict):
+def _acquire_moscow_proxy_racing(width: int):
+    """
+    Режим гонки: держим до width проверок сессий в полёте одновременно,
+    берём первую московскую, остальные отменяем. Всего запускается
+    не больше MAX_PROXY_ATTEMPTS сессий.
+
+    Номер попытки присваивается в порядке запуска. Проверки, которые
+    были в полёте в момент победы, тоже попадают в attempts (с ip/city
+    None) — так список совпадает с числом реально открытых сессий.
+    """
+    attempts = {}
+    pool = ThreadPoolExecutor(max_workers=width, thread_name_prefix="proxy-race")
+    in_flight = {}
+    launched = 0
+
+    def launch():
+        nonlocal launched
+        launched += 1
+        proxy_auth = _proxy_auth_for_new_session()
+        fut = pool.submit(_check_proxy, proxy_auth)
+        in_flight[fut] = (launched, proxy_auth)
+        attempts[launched] = {"attempt": launched, "ip": None, "city": None}
+
+    try:
+        while launched < min(width, MAX_PROXY_ATTEMPTS):
+            launch()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                attempt, proxy_auth = in_flight.pop(fut)
+                info, ip, city = fut.result()
+                attempts[attempt].update(ip=ip, city=city)
+                if _is_moscow(city):
+                    return proxy_auth, info, [attempts[k] for k in sorted(attempts)]
+                if launched < MAX_PROXY_ATTEMPTS:
+                    launch()
+    finally:
+        # Не ждём «проигравших»: незапущенные отменяются, запущенные
+        # доработают в фоне и будут проигнорированы
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    raise ProxyAcquireError([attempts[k] for k in sorted(attempts)])
+
+
+def _acquire_moscow_proxy():
+    """
+    Пытаемся получить прокси с IP из Москвы, не более MAX_PROXY_ATTEMPTS раз.
+    При PROXY_RACE_WIDTH > 1 сессии проверяются параллельно.
+    Возвращает кортеж (proxy_auth: str, info: dict, attempts: list).
+    Если не удаётся — бросает ProxyAcquireError(attempts).
+    """
+    try:
+        if PROXY_RACE_WIDTH > 1:
+            result = _acquire_moscow_proxy_racing(PROXY_RACE_WIDTH)
+        else:
+            result = _acquire_moscow_proxy_sequential()
+    except ProxyAcquireError as e:
+        PROXY_ATTEMPTS.observe(len(e.attempts))
+        raise
+    PROXY_ATTEMPTS.observe(len(result[2]))
+    return result
+
+
+# Резерв заранее проверенных сессий; пополняется в фоне после start()
+proxy_reservoir = ProxyReservoir(
+    _acquire_moscow_proxy,
+    size=PROXY_RESERVOIR_SIZE,
+    ttl=PROXY_RESERVOIR_TTL,
+    refill_interval=PROXY_RESERVOIR_REFILL_INTERVAL,
+)
+
+
+def _prepare(raw_url: str, device: dict, timings: dict = None):
+    """
+    Общая часть обоих браузерных движков: нормализует URL, берёт
+    московскую сессию и пробует HTTP-уровень. Возвращает
+    (url, proxy_auth, ip_info, proxy_attempts, details, final_url),
+    где final_url не None, если браузер уже не нужен.
+    """
+    # 1) Нормализуем URL
+    url = raw_url if raw_url.startswith(("http://", "https://")) else f"https://{raw_url}"
+
+    # 2) Берём готовую сессию из резерва, иначе подбираем московский
+    #    прокси на месте (или получаем ошибку)
+    reserved = proxy_reservoir.pop()
+    with timed(timings, "proxy", PROXY_ACQUIRE_SECONDS,
+               source="live" if reserved is None else "reservoir"):
+        if reserved is None:
+            reserved = _acquire_moscow_proxy()
+    proxy_auth, ip_info, proxy_attempts = reserved
+
+    # 3) Пробуем пройти цепочку без браузера
+    details = {"proxy_bytes": 0}
+    final_url = None
+    if HTTP_TIER_ENABLED:
+        with timed(timings, "http_tier", REDIRECT_WAIT_SECONDS, tier="http"):
+            final_url = resolve_http(url, proxy_auth, device, stats=details)
+    details["tier"] = "http" if final_url is not None else "browser"
+    return url, proxy_auth, ip_info, proxy_attempts, details, final_url
+
+
+def _result(url, final_url, ip_info, device, proxy_attempts, details):
+    return (
+        unquote(url),
+        unquote(final_url),
+        ip_info.get("query"),
+        ip_info.get("isp"),
+        device,
+        proxy_attempts,
+        details,
+    )
+
+
+def fetch_redirect(raw_url: str, device: dict, timings: dict = None):
     """
     Синхронно обходит ссылку через «московский» прокси+эмуляцию устройства.
 
@@ -93,6 +222,8 @@ def fetch_redirect(raw_url: str, device: dict):
           "mobile": bool,
           "model": str|None
         }
+      timings — dict, куда добавляются длительности стадий в мс
+        (proxy, http_tier, browser_start, page); заполняется и при ошибке
 
     Возвращает кортеж:
       (
@@ -101,102 +232,97 @@ def fetch_redirect(raw_url: str, device: dict):
         ip:          str|None,
         isp:         str|None,
         device:      dict,       # тот же, что передан
-        proxy_attempts: list     # список всех попыток из _acquire_moscow_proxy
+        proxy_attempts: list,    # список всех попыток из _acquire_moscow_proxy
+        details:     dict        # подробности перехода:
+                                 #   "tier" — "http" | "browser"
+                                 #   "proxy_bytes" — примерный трафик через прокси
+                                 #   "hops" — цепочка переходов с таймингами
       )
 
+    Сначала пробует дешёвый HTTP-уровень (http_resolver.resolve_http),
+    браузер запускается, только если тот не дошёл до конечного URL.
+
     Если не удалось получить московский прокси — бросает ProxyAcquireError.
     """
-    # 1) Нормализуем URL
-    url = raw_url if raw_url.startswith(("http://", "https://")) else f"https://{raw_url}"
-    initial_url = unquote(url)
-
-    # 2) Подбираем московский прокси (или получаем ошибку)
-    proxy_auth, ip_info, proxy_attempts = _acquire_moscow_proxy()
-
-    # 3) Собираем опции для Selenium
-    ua = device["ua"]
-    css_w, css_h = device["css_size"]
-    platform = device["platform"]
-    dpr = device["dpr"]
-    mobile = device["mobile"]
-
-    chrome_opts = webdriver.ChromeOptions()
-    chrome_opts.add_argument("--headless=new")
-    chrome_opts.add_argument("--disable-gpu")
-    chrome_opts.add_argument("--no-sandbox")
-    chrome_opts.add_argument("--disable-dev-shm-usage")
-    chrome_opts.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_opts.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_opts.add_experimental_option("useAutomationExtension", False)
-    chrome_opts.add_argument(f"--user-agent={ua}")
-    chrome_opts.add_argument(f"--window-size={css_w},{css_h}")
-    chrome_opts.set_capability("pageLoadStrategy", "none")
-
-    seleniumwire_opts = {
-        "proxy": {
-            "http": proxy_auth,
-            "https": proxy_auth,
-            "no_proxy": "localhost,127.0.0.1"
-        },
-        "request_storage": "memory",
-        "connection_timeout": 10,
-        "request_timeout": 30,
-    }
-
-    driver = webdriver.Chrome(
-        seleniumwire_options=seleniumwire_opts,
-        options=chrome_opts,
+    url, proxy_auth, ip_info, proxy_attempts, details, final_url = _prepare(
+        raw_url, device, timings
     )
+    if final_url is not None:
+        return _result(url, final_url, ip_info, device, proxy_attempts, details)
 
-    # stealth: прячем webdriver и эмулируем параметры устройства
-    driver.execute_cdp_cmd(
-        "Page.addScriptToEvaluateOnNewDocument",
-        {"source": "Object.defineProperty(navigator,'webdriver',{get:()=>undefined})"}
-    )
-    driver.execute_cdp_cmd(
-        "Emulation.setDeviceMetricsOverride",
-        {"width": css_w, "height": css_h, "deviceScaleFactor": dpr, "mobile": mobile}
-    )
-    driver.execute_cdp_cmd(
-        "Page.addScriptToEvaluateOnNewDocument",
-        {"source": f"""
-            Object.defineProperty(navigator, 'platform', {{ get: () => '{platform}' }});
-            Object.defineProperty(navigator, 'languages', {{ get: () => ['ru-RU','ru'] }});
-            Object.defineProperty(navigator, 'language', {{ get: () => 'ru-RU' }});
-            Object.defineProperty(navigator, 'plugins', {{ get: () => [1,2,3,4,5] }});
-            Object.defineProperty(navigator, 'deviceMemory', {{ get: () => 8 }});
-            Object.defineProperty(navigator, 'hardwareConcurrency', {{ get: () => 8 }});
-            Object.defineProperty(navigator, 'connection', {{
-                get: () => {{ rtt:50, downlink:10, effectiveType:'4g' }}
-            }});
-        """}
-    )
-
-    # 4) Переходим по URL и ждём первого редиректа
+    # 4) Берём прогретый драйвер из пула и настраиваем под устройство
+    with timed(timings, "browser_start"):
+        pd = driver_pool.acquire()
+    broken = False
     try:
-        driver.get(url)
-    except (TimeoutException, WebDriverException):
-        # можно залогировать, но продолжаем
-        pass
+        with timed(timings, "browser_start"):
+            driver_pool.prepare(pd, proxy_auth, device)
+        driver = pd.driver
 
-    try:
-        WebDriverWait(driver, REDIRECT_TIMEOUT).until(EC.url_changes(url))
-        final_url = driver.current_url
-    except TimeoutException:
-        final_url = driver.current_url
+        # 5) Переходим по URL и следим за цепочкой, пока она не затихнет
+        with timed(timings, "page", REDIRECT_WAIT_SECONDS, tier="browser"):
+            try:
+                driver.get(url)
+            except (TimeoutException, WebDriverException):
+                # можно залогировать, но продолжаем
+                pass
 
-    # 5) Останавливаем загрузку и закрываем драйвер
-    try:
-        driver.execute_script("window.stop();")
+            final_url, hops = trace_navigation(
+                pd, quiet_window=REDIRECT_QUIET_WINDOW, timeout=REDIRECT_TIMEOUT
+            )
+        final_url = final_url or url
+        # хопы HTTP-уровня (если он пробовал) заменяем браузерными
+        details["hops"] = hops
     except Exception:
-        pass
-    driver.quit()
+        broken = True
+        raise
+    finally:
+        details["proxy_bytes"] += pd.proxy_bytes
+        # 6) Возвращаем драйвер в пул (там он будет остановлен и очищен)
+        driver_pool.release(pd, broken=broken)
 
-    return (
-        initial_url,
-        unquote(final_url),
-        ip_info.get("query"),
-        ip_info.get("isp"),
-        device,
-        proxy_attempts
+    return _result(url, final_url, ip_info, device, proxy_attempts, details)
+
+
+async def fetch_redirect_async(raw_url: str, device: dict, timings: dict = None):
+    """
+    fetch_redirect для вызова из event loop; результат и ошибки те же.
+
+    С BROWSER_ENGINE=cdp браузерная часть идёт через cdp_engine прямо
+    в цикле, без потока на переход; в поток уходят только подбор прокси
+    и HTTP-уровень (короткие блокирующие requests). С selenium весь
+    fetch_redirect выполняется в потоке, как раньше.
+    """
+    if BROWSER_ENGINE != "cdp":
+        return await asyncio.to_thread(fetch_redirect, raw_url, device, timings)
+
+    url, proxy_auth, ip_info, proxy_attempts, details, final_url = await asyncio.to_thread(
+        _prepare, raw_url, device, timings
     )
+    if final_url is None:
+        final_url, hops, proxy_bytes = await cdp_engine.visit(
+            url, proxy_auth, device,
+            quiet_window=REDIRECT_QUIET_WINDOW, timeout=REDIRECT_TIMEOUT, timings=timings,
+        )
+        final_url = final_url or url
+        details["hops"] = hops
+        details["proxy_bytes"] += proxy_bytes
+    return _result(url, final_url, ip_info, device, proxy_attempts, details)
+
+
+async def start_browser():
+    """Прогрев браузерного движка при старте процесса."""
+    if BROWSER_ENGINE == "cdp":
+        try:
+            await cdp_engine.start()
+        except Exception:
+            logger.exception("Не удалось запустить Chrome для CDP-движка")
+    else:
+        await asyncio.to_thread(driver_pool.warm)
+
+
+async def close_browser():
+    if BROWSER_ENGINE == "cdp":
+        await cdp_engine.close()
+    else:
+        await asyncio.to_thread(driver_pool.close)
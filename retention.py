@@ -0,0 +1,228 @@
+# retention.py
+#
+# Срок хранения events и proxy_logs. Строки старше RETENTION_DAYS (а события
+# no_link/many_links — старше RETENTION_NOISE_DAYS) переносятся в помесячные
+# архивы ARCHIVE_DIR/<таблица>-YYYY-MM.jsonl.gz и удаляются пачками по
+# RETENTION_BATCH_SIZE: каждая пачка — своя короткая транзакция, между
+# пачками пауза, чтобы воркеры и write_behind успевали писать.
+#
+# user_daily_stats не трогается — show_stats продолжает считать архивные
+# дни, а rollups.rebuild пересобирает только дни, события которых остались.
+# Освободившиеся страницы SQLite возвращаются PRAGMA incremental_vacuum.
+#
+#   python retention.py          — один проход вручную
+#   python retention.py vacuum   — разово перевести существующую SQLite-БД
+#                                  на auto_vacuum=INCREMENTAL (полный VACUUM,
+#                                  бот на это время лучше остановить)
+import os
+import sys
+import gzip
+import json
+import asyncio
+import logging
+from datetime import datetime, timedelta, time as dtime
+
+from sqlalchemy import select, delete, func, text
+
+from db import engine, AsyncSessionLocal
+from models import Event, ProxyLog, db_now
+from metrics import RETENTION_ARCHIVED_ROWS
+from config import (
+    RETENTION_DAYS,
+    RETENTION_NOISE_DAYS,
+    ARCHIVE_DIR,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE,
+    RETENTION_VACUUM_PAGES,
+)
+
+logger = logging.getLogger(__name__)
+
+NOISE_STATES = ("no_link", "many_links")
+
+
+def _cutoff(days: int) -> datetime:
+    """
+    Полночь (UTC) days дней назад: timestamp в БД хранится в UTC, и дни
+    в архив уходят целиком, как в user_daily_stats.
+    """
+    return datetime.combine(db_now().date() - timedelta(days=days), dtime.min)
+
+
+def _row_dict(row) -> dict:
+    return {c.name: getattr(row, c.key) for c in row.__table__.columns}
+
+
+def _write_archive(table: str, rows):
+    """
+    Дописывает строки в архивы по месяцу timestamp. gzip-файл из нескольких
+    членов читается как один поток, так что дописывать можно в любой момент.
+    Файл сбрасывается на диск до удаления строк из БД; если процесс упадёт
+    между записью и удалением, пачка попадёт в архив ещё раз при следующем
+    проходе; такие дубли в архиве отличимы по первичному ключу.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    by_month = {}
+    for row in rows:
+        month = row["timestamp"].strftime("%Y-%m") if row["timestamp"] else "unknown"
+        by_month.setdefault(month, []).append(row)
+    for month, month_rows in by_month.items():
+        path = os.path.join(ARCHIVE_DIR, f"{table}-{month}.jsonl.gz")
+        with open(path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+                for row in month_rows:
+                    gz.write((json.dumps(row, ensure_ascii=False, default=str) + "\n").encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+async def _archive_batch(table: str, model, rows, condition) -> int:
+    if not rows:
+        return 0
+    await asyncio.to_thread(_write_archive, table, [_row_dict(r) for r in rows])
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(model).where(condition))
+        await session.commit()
+    RETENTION_ARCHIVED_ROWS.inc(len(rows), table=table)
+    await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return len(rows)
+
+
+async def archive_old_events(cutoff: datetime) -> int:
+    """Все события старше cutoff; выборка идёт по индексу events.timestamp."""
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Event).where(Event.timestamp < cutoff)
+                .order_by(Event.timestamp, Event.id)
+                .limit(RETENTION_BATCH_SIZE)
+            )).scalars().all()
+        archived = await _archive_batch("events", Event, rows, Event.id.in_([r.id for r in rows]))
+        if not archived:
+            return total
+        total += archived
+
+
+async def archive_noise_events(cutoff: datetime) -> int:
+    """
+    no_link/many_links старше cutoff. Они вперемешку с остальными событиями,
+    поэтому идём по id до последнего события старше cutoff — каждая строка
+    просматривается один раз за проход.
+    """
+    async with AsyncSessionLocal() as session:
+        upto = await session.scalar(select(func.max(Event.id)).where(Event.timestamp < cutoff))
+    total, last_id = 0, 0
+    while upto is not None:
+        async with AsyncSessionLocal() as session:
+            ids = (await session.execute(
+                select(Event.id)
+                .where(Event.id > last_id, Event.id <= upto)
+                .order_by(Event.id)
+                .limit(RETENTION_BATCH_SIZE)
+            )).scalars().all()
+            if not ids:
+                break
+            last_id = ids[-1]
+            rows = (await session.execute(
+                select(Event).where(
+                    Event.id.in_(ids),
+                    Event.state.in_(NOISE_STATES),
+                    Event.timestamp < cutoff,
+                ).order_by(Event.id)
+            )).scalars().all()
+        total += await _archive_batch("events", Event, rows, Event.id.in_([r.id for r in rows]))
+    return total
+
+
+async def archive_old_proxy_logs(cutoff: datetime) -> int:
+    """Группы попыток подбора прокси старше cutoff — целиком, все attempt группы."""
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            group_ids = (await session.execute(
+                select(ProxyLog.id).where(ProxyLog.timestamp < cutoff)
+                .distinct().limit(RETENTION_BATCH_SIZE)
+            )).scalars().all()
+            rows = (await session.execute(
+                select(ProxyLog).where(ProxyLog.id.in_(group_ids))
+                .order_by(ProxyLog.id, ProxyLog.attempt)
+            )).scalars().all() if group_ids else []
+        archived = await _archive_batch(
+            "proxy_logs", ProxyLog, rows, ProxyLog.id.in_(group_ids)
+        )
+        if not archived:
+            return total
+        total += archived
+
+
+async def incremental_vacuum():
+    """Возвращает ОС свободные страницы SQLite порциями по RETENTION_VACUUM_PAGES."""
+    if engine.dialect.name != "sqlite":
+        return
+    async with engine.connect() as conn:
+        mode = await conn.scalar(text("PRAGMA auto_vacuum"))
+        if mode != 2:
+            free = await conn.scalar(text("PRAGMA freelist_count"))
+            logger.info(
+                "Хранение: auto_vacuum не INCREMENTAL, %d свободных страниц остаются в файле "
+                "(разово: python retention.py vacuum)", free
+            )
+            return
+    while True:
+        async with engine.connect() as conn:
+            free = await conn.scalar(text("PRAGMA freelist_count"))
+            if not free:
+                return
+            await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES})")
+            await conn.commit()
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+
+
+async def run_retention() -> dict:
+    """Один проход: архив и удаление старых строк, затем incremental vacuum."""
+    if RETENTION_DAYS <= 0:
+        return {}
+    cutoff = _cutoff(RETENTION_DAYS)
+    result = {
+        "events": await archive_old_events(cutoff),
+        "proxy_logs": await archive_old_proxy_logs(cutoff),
+    }
+    if 0 < RETENTION_NOISE_DAYS < RETENTION_DAYS:
+        result["noise_events"] = await archive_noise_events(_cutoff(RETENTION_NOISE_DAYS))
+    await incremental_vacuum()
+    logger.info("Хранение: в %s перенесено %s", ARCHIVE_DIR, result)
+    return result
+
+
+async def retention_job(context):
+    """Задача JobQueue (tasks.setup_scheduler)."""
+    try:
+        await run_retention()
+    except Exception:
+        logger.exception("Хранение: проход прерван")
+
+
+async def enable_incremental_vacuum():
+    """auto_vacuum=INCREMENTAL вступает в силу для готовой БД только после VACUUM."""
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        await conn.commit()
+        await conn.exec_driver_sql("VACUUM")
+        mode = await conn.scalar(text("PRAGMA auto_vacuum"))
+    print(f"auto_vacuum = {mode} (2 — INCREMENTAL)")
+
+
+async def main(args):
+    from db import init_db
+
+    await init_db()
+    if args[:1] == ["vacuum"]:
+        await enable_incremental_vacuum()
+    else:
+        print(await run_retention())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1:]))
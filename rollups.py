@@ -0,0 +1,84 @@
+# rollups.py
+#
+# Агрегаты user_daily_stats: число успешных переходов пользователя по дням.
+# Обновляются в той же транзакции, что и вставка Event (process_queue_item).
+#
+# Пересобрать агрегаты из events:
+#   python rollups.py
+import asyncio
+
+from sqlalchemy import select, delete, update, insert, func
+from sqlalchemy.dialects import sqlite, postgresql
+
+from models import Event, UserDailyStat, db_now
+
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+async def bump_daily_success(session, user_id: int):
+    """
+    +1 успешный переход пользователю за сегодня. День — по db_now(), в той
+    же шкале, что и events.timestamp (UTC), и show_stats считает границы
+    недели и месяца от неё же.
+    Вызывать до commit() той же сессии, что добавляет Event.
+    """
+    today = db_now().date()
+    dialect = session.bind.dialect.name
+    if dialect in _UPSERT_INSERTS:
+        stmt = _UPSERT_INSERTS[dialect](UserDailyStat).values(
+            user_id=user_id, day=today, success=1
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserDailyStat.user_id, UserDailyStat.day],
+            set_={"success": UserDailyStat.success + 1},
+        )
+        await session.execute(stmt)
+        return
+
+    res = await session.execute(
+        update(UserDailyStat)
+        .where(UserDailyStat.user_id == user_id, UserDailyStat.day == today)
+        .values(success=UserDailyStat.success + 1)
+    )
+    if not res.rowcount:
+        await session.execute(
+            insert(UserDailyStat).values(user_id=user_id, day=today, success=1)
+        )
+
+
+def backfill_statement():
+    """INSERT ... SELECT, собирающий агрегаты из всех успешных events."""
+    day = func.date(Event.timestamp)
+    return insert(UserDailyStat).from_select(
+        ["user_id", "day", "success"],
+        select(Event.user_id, day, func.count())
+        .where(Event.state == "success")
+        .group_by(Event.user_id, day),
+    )
+
+
+def rebuild(conn):
+    """
+    Пересобирает user_daily_stats по оставшимся events (синхронное соединение,
+    run_sync). Дни раньше самого старого события не трогаются: их события
+    перенёс в архив retention.py, и агрегаты — единственное, что от них осталось.
+    """
+    first_day = conn.execute(select(func.min(func.date(Event.timestamp)))).scalar()
+    if first_day is None:
+        return
+    conn.execute(delete(UserDailyStat).where(UserDailyStat.day >= first_day))
+    conn.execute(backfill_statement())
+
+
+async def main():
+    from db import engine, init_db
+
+    await init_db()
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild)
+        days = await conn.scalar(select(func.count()).select_from(UserDailyStat))
+    print(f"user_daily_stats пересобрана: {days} строк")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+# scheduler.py
+#
+# Выбор transition_time для daily-режима. Раньше время бралось равномерно
+# по остатку дня, и при многих daily-пользователях задачи сбивались в
+# случайные кучки, которые пул не успевал разобрать. Теперь окно делится
+# на слоты фиксированной ширины; слот выбирается случайно с весом, равным
+# его свободной ёмкости (с учётом уже запланированных задач), а время —
+# равномерно внутри слота.
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from models import Queue
+from config import (
+    WORKER_CONCURRENCY,
+    SCHEDULE_SLOT_SECONDS,
+    SCHEDULE_SLOT_CAPACITY,
+    SCHEDULE_WORKER_PROCESSES,
+    SCHEDULE_TRANSITION_SECONDS,
+    SCHEDULE_TARGET_LOAD,
+)
+
+# Во сколько раз реже выбирать слот, где у пользователя уже есть задача:
+# его переходы расходятся по дню, а не идут подряд
+_SAME_USER_PENALTY = 4
+
+
+def daily_window(now: datetime):
+    """Остаток сегодняшнего дня, а если до полуночи меньше двух часов — весь завтрашний."""
+    end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=0)
+    if (end_of_day - now) < timedelta(hours=2):
+        tomorrow = now + timedelta(days=1)
+        return (
+            tomorrow.replace(hour=0, minute=0, second=0, microsecond=0),
+            tomorrow.replace(hour=23, minute=59, second=59, microsecond=0),
+        )
+    return now, end_of_day
+
+
+def slot_capacity() -> int:
+    """Сколько переходов можно планировать в один слот."""
+    if SCHEDULE_SLOT_CAPACITY > 0:
+        return SCHEDULE_SLOT_CAPACITY
+    per_slot = (
+        WORKER_CONCURRENCY * SCHEDULE_WORKER_PROCESSES
+        * SCHEDULE_SLOT_SECONDS / max(SCHEDULE_TRANSITION_SECONDS, 0.1)
+        * SCHEDULE_TARGET_LOAD
+    )
+    return max(1, int(per_slot))
+
+
+class SlotScheduler:
+    """
+    Раскладывает daily-задачи по слотам окна с учётом занятости.
+    Вызовы pick() и вставка задач должны идти под self.lock — иначе два
+    одновременных сообщения увидят одну и ту же занятость и выберут
+    один слот (в пределах процесса бота этого достаточно: задачи в
+    очередь ставит только он).
+    """
+    def __init__(self, slot_seconds: int = SCHEDULE_SLOT_SECONDS, capacity: int = None):
+        self.slot = timedelta(seconds=slot_seconds)
+        self.capacity = capacity or slot_capacity()
+        self.lock = asyncio.Lock()
+
+    async def _bookings(self, session, start: datetime, end: datetime):
+        """Незавершённые задачи окна: (transition_time, user_id)."""
+        rows = await session.execute(
+            select(Queue.transition_time, Queue.user_id).where(
+                Queue.status != "done",
+                Queue.transition_time >= start,
+                Queue.transition_time <= end,
+            )
+        )
+        return rows.all()
+
+    async def pick(self, session, user_id: int, count: int = 1, now: datetime = None) -> list:
+        """
+        count моментов для задач пользователя в его daily-окне, по возрастанию.
+        Свои же выборы учитываются сразу — пачка ссылок расходится по слотам.
+        """
+        start, end = daily_window(now or datetime.now())
+        n_slots = max(1, -(-int((end - start).total_seconds()) // int(self.slot.total_seconds())))
+        load = [0] * n_slots
+        own = [0] * n_slots
+        for transition_time, owner in await self._bookings(session, start, end):
+            i = min(n_slots - 1, int((transition_time - start) / self.slot))
+            load[i] += 1
+            if owner == user_id:
+                own[i] += 1
+
+        picks = []
+        for _ in range(count):
+            weights = [
+                max(self.capacity - load[i], 0) / (_SAME_USER_PENALTY if own[i] else 1)
+                for i in range(n_slots)
+            ]
+            if not any(weights):
+                # окно забито целиком — в наименее загруженный слот
+                least = min(load)
+                weights = [1 if load[i] == least else 0 for i in range(n_slots)]
+            i = random.choices(range(n_slots), weights=weights)[0]
+            load[i] += 1
+            own[i] += 1
+
+            slot_start = start + self.slot * i
+            slot_end = min(slot_start + self.slot, end)
+            picks.append(slot_start + (slot_end - slot_start) * random.random())
+        return sorted(picks)
+
+
+slot_scheduler = SlotScheduler()
@@ -1,20 +1,92 @@
 # tasks.py
 
+import time
 import asyncio
-import random
+import heapq
+import logging
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
 from telegram.ext import CallbackContext
-from sqlalchemy import select
+from sqlalchemy import select, update, or_, func
 
 from db import AsyncSessionLocal
-from models import Queue, Event, DeviceOption, User, ProxyLog
-from redirector import fetch_redirect, ProxyAcquireError
+from models import Queue, Event, User, ProxyLog, Notification
+from redirector import fetch_redirect_async, ProxyAcquireError
+from worker_pool import WorkerPool
+from devices import device_catalog
+from writer import write_behind
+from notifier import notification_sender
+from retention import retention_job
+from metrics import (
+    registry,
+    EVENTS_TOTAL,
+    QUEUE_LAG_SECONDS,
+    QUEUE_DEPTH,
+    WORKER_POOL_ACTIVE,
+    WORKER_POOL_CAPACITY,
+    WORKER_POOL_WAITING,
+    WORKER_POOL_UTILIZATION,
+)
+from config import (
+    WORKER_CONCURRENCY,
+    WORKER_PER_DOMAIN_LIMIT,
+    WORKER_PER_USER_LIMIT,
+    TICK_INTERVAL,
+    RETENTION_DAYS,
+    RETENTION_INTERVAL,
+    WORKER_ID,
+    LEASE_TTL,
+    LEASE_HEARTBEAT,
+    RUN_WORKERS,
+)
 
-# Ограничивает одновременное выполнение fetch_redirect
-semaphore = asyncio.Semaphore(1)
+logger = logging.getLogger(__name__)
+
+# Ограничивает одновременное выполнение fetch_redirect_async
+worker_pool = WorkerPool(
+    WORKER_CONCURRENCY,
+    per_domain=WORKER_PER_DOMAIN_LIMIT,
+    per_user=WORKER_PER_USER_LIMIT,
+)
+# Queue.id задач, захваченных этим процессом и ещё не завершённых
+# (ждут слот пула или выполняются)
+_in_flight = set()
+# Queue.id -> heartbeat аренды (renew_lease), запущенный со слотом пула
+_heartbeats = {}
+
+def free_slots() -> int:
+    """
+    Сколько задач процесс может захватить сейчас: размер пула минус уже
+    захваченные. Остальные наступившие задачи остаются pending — их
+    возьмут другие процессы-воркеры или этот, когда освободится слот.
+    """
+    return max(worker_pool.size - len(_in_flight), 0)
+
+@registry.collector
+async def collect_queue_metrics():
+    """Глубина очереди и загрузка пула — снимком на момент отдачи метрик."""
+    async with AsyncSessionLocal() as session:
+        depth = dict((await session.execute(
+            select(Queue.status, func.count())
+            .where(Queue.status.in_(("pending", "in_progress")))
+            .group_by(Queue.status)
+        )).all())
+    for status in ("pending", "in_progress"):
+        QUEUE_DEPTH.set(depth.get(status, 0), status=status)
+
+    stats = worker_pool.stats()
+    WORKER_POOL_ACTIVE.set(stats["active"])
+    WORKER_POOL_CAPACITY.set(stats["capacity"])
+    WORKER_POOL_WAITING.set(stats["waiting"])
+    WORKER_POOL_UTILIZATION.set(stats["utilization"])
+
+def target_domain(url: str) -> str:
+    """Домен ссылки (в очереди URL может быть без протокола)."""
+    if not url.startswith(("http://", "https://")):
+        url = f"https://{url}"
+    return urlparse(url).netloc.lower()
 
 def shorten_url(full_url: str, max_len: int = 30) -> str:
     """
@@ -36,123 +108,370 @@ async def fetch_db_user(session, telegram_id: int):
     )
     return result.scalar_one_or_none()
 
+async def extend_lease(queue_id: int) -> bool:
+    """Продлевает lease_until на LEASE_TTL; False — аренда уже не наша."""
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(Queue)
+            .where(
+                Queue.id == queue_id,
+                Queue.worker_id == WORKER_ID,
+                Queue.status == "in_progress",
+            )
+            .values(lease_until=datetime.now() + timedelta(seconds=LEASE_TTL))
+        )
+        await session.commit()
+    return bool(res.rowcount)
+
+async def renew_lease(queue_id: int):
+    """
+    Heartbeat: пока задача у нас, раз в LEASE_HEARTBEAT секунд
+    продлевает lease_until. Если аренду перехватили — выходит.
+    """
+    while True:
+        await asyncio.sleep(LEASE_HEARTBEAT)
+        if not await extend_lease(queue_id):
+            logger.warning("Аренда задачи %s потеряна", queue_id)
+            return
+
+async def reclaim_expired_leases():
+    """
+    Возвращает в pending задачи, чья аренда истекла (упавший или
+    зависший воркер). Строки in_progress без аренды — наследие версий
+    до аренд — тоже считаются брошенными.
+    """
+    async with AsyncSessionLocal() as session:
+        res = await session.execute(
+            update(Queue)
+            .where(
+                Queue.status == "in_progress",
+                or_(Queue.lease_until.is_(None), Queue.lease_until < datetime.now()),
+            )
+            .values(status="pending", worker_id=None, lease_until=None)
+        )
+        await session.commit()
+    if res.rowcount:
+        logger.warning("Возвращено в очередь задач с истёкшей арендой: %d", res.rowcount)
+    return res.rowcount
+
 async def process_queue_item(item, bot):
-    async with semaphore:
-        async with AsyncSessionLocal() as session:
-            # Выбираем случайное устройство
-            result = await session.execute(select(DeviceOption.id))
-            ids = result.scalars().all()
-            chosen_id = random.choice(ids)
-            device_obj = await session.get(DeviceOption, chosen_id)
-            device = {
-                "ua": device_obj.ua,
-                "css_size": device_obj.css_size,
-                "platform": device_obj.platform,
-                "dpr": device_obj.dpr,
-                "mobile": device_obj.mobile,
-                "model": device_obj.model,
-            }
-
-            proxy_id = str(uuid.uuid4())
-            initial_url = final_url = ip = isp = None
-            attempts = []
+    try:
+        await _run_queue_item(item, bot)
+    finally:
+        heartbeat = _heartbeats.pop(item.id, None)
+        if heartbeat is not None:
+            heartbeat.cancel()
+        _in_flight.discard(item.id)
+        # освободилось место — диспетчер может захватить следующую задачу
+        dispatcher.wake()
+
+async def _run_queue_item(item, bot):
+    # Длительности стадий в мс — сохраняются в Event.timings
+    timings = {}
+    started = time.monotonic()
+    # Слот пула держим только на время самого перехода
+    async with worker_pool.slot(item.user_id, target_domain(item.url)):
+        timings["slot_wait"] = int((time.monotonic() - started) * 1000)
+        # Аренда продлевается только со слотом: пока задача ждала его
+        # (лимиты домена/пользователя), её мог перехватить другой воркер
+        if not await extend_lease(item.id):
+            logger.warning("Аренда задачи %s истекла до начала перехода", item.id)
+            return
+        _heartbeats[item.id] = asyncio.create_task(renew_lease(item.id))
+
+        # Выбираем случайное устройство (из каталога в памяти)
+        device_id, device = await device_catalog.sample()
+
+        proxy_id = str(uuid.uuid4())
+        initial_url = final_url = ip = isp = None
+        attempts = []
+        details = {}
+        state = "redirector_error"
+
+        try:
+            (initial_url,
+             final_url,
+             ip,
+             isp,
+             _,
+             attempts,
+             details) = await fetch_redirect_async(item.url, device, timings)
+            state = "success"
+        except ProxyAcquireError as e:
+            state = "proxy_error"
+            attempts = e.attempts
+        except Exception:
             state = "redirector_error"
 
-            try:
-                (initial_url,
-                 final_url,
-                 ip,
-                 isp,
-                 _,
-                 attempts) = await asyncio.to_thread(fetch_redirect, item.url, device)
-                state = "success"
-            except ProxyAcquireError as e:
-                state = "proxy_error"
-                attempts = e.attempts
-            except Exception:
-                state = "redirector_error"
-
-            # Логируем proxy_attempts
-            for a in attempts:
-                session.add(ProxyLog(
-                    id=proxy_id,
-                    attempt=a["attempt"],
-                    ip=a.get("ip"),
-                    city=a.get("city"),
-                ))
-
-            # Сохраняем событие
-            session.add(Event(
-                user_id=item.user_id,
-                device_option_id=(device_obj.id if state == "success" else None),
-                state=state,
-                proxy_id=proxy_id,
-                initial_url=initial_url,
-                final_url=final_url,
-                ip=ip,
-                isp=isp,
-            ))
-
-            # Помечаем задачу как выполненную
-            db_item = await session.get(Queue, item.id)
-            db_item.status = "done"
-
-            # Фиксируем все изменения
-            await session.commit()
-
-            # Отправляем уведомление
-            db_user = await fetch_db_user(session, item.user_id)
-            if db_user:
-                init_short = shorten_url(initial_url)
-                init_link  = f'<a href="{initial_url}">{init_short}</a>'
-
-                if state == "success":
-                    final_short = shorten_url(final_url)
-                    final_link  = f'<a href="{final_url}">{final_short}</a>'
-                    text = (
-                        "Успешный переход ✅\n"
-                        f"{init_link}\n"
-                        f"⬇️ ip {ip or '—'}\n"
-                        f"{final_link}"
-                    )
-                else:
-                    text = (
-                        "Ошибка перехода ❌\n"
-                        f"{init_link}"
-                    )
+    # Прокси-ошибки к устройству отношения не имеют
+    if state != "proxy_error":
+        device_catalog.record(device_id, state == "success")
 
-                await bot.send_message(
-                    chat_id=item.user_id,
-                    text=text,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True,
-                    reply_to_message_id=item.message_id
-                )
+    timings["total"] = int((time.monotonic() - started) * 1000)
+
+    # Логируем proxy_attempts
+    rows = [
+        ProxyLog(
+            id=proxy_id,
+            attempt=a["attempt"],
+            ip=a.get("ip"),
+            city=a.get("city"),
+        )
+        for a in attempts
+    ]
+
+    # Сохраняем событие
+    rows.append(Event(
+        user_id=item.user_id,
+        device_option_id=(device_id if state == "success" else None),
+        state=state,
+        proxy_id=proxy_id,
+        initial_url=initial_url,
+        final_url=final_url,
+        ip=ip,
+        isp=isp,
+        tier=details.get("tier"),
+        proxy_bytes=details.get("proxy_bytes"),
+        hops=details.get("hops"),
+        timings=timings,
+    ))
 
-async def tick(context: CallbackContext):
-    bot = context.bot
     async with AsyncSessionLocal() as session:
-        now = datetime.now()
+        db_user = await fetch_db_user(session, item.user_id)
+
+    if db_user:
+        init_short = shorten_url(initial_url)
+        init_link  = f'<a href="{initial_url}">{init_short}</a>'
+
+        if state == "success":
+            final_short = shorten_url(final_url)
+            final_link  = f'<a href="{final_url}">{final_short}</a>'
+            text = (
+                "Успешный переход ✅\n"
+                f"{init_link}\n"
+                f"⬇️ ip {ip or '—'}\n"
+                f"{final_link}"
+            )
+        else:
+            text = (
+                "Ошибка перехода ❌\n"
+                f"{init_link}"
+            )
+
+        # Результат — в outbox; отправит NotificationSender бота
+        # с учётом лимитов Telegram
+        rows.append(Notification(
+            chat_id=item.user_id,
+            reply_to_message_id=item.message_id,
+            text=text,
+            # время процесса, а не БД: по нему считается notify_delay_seconds
+            created=datetime.now(),
+        ))
 
-        # В одной транзакции переводим pending → in_progress
+    # Пишем всё пачкой вместе с другими переходами; задача помечается done
+    # в той же транзакции — только если аренда всё ещё наша
+    owned = await write_behind.submit(
+        rows,
+        queue_id=item.id,
+        success_user_id=(item.user_id if state == "success" else None),
+    )
+    if not owned:
+        # задачу перехватил другой воркер — результат не сохраняем
+        logger.warning("Задача %s перехвачена другим воркером", item.id)
+        return
+
+    EVENTS_TOTAL.inc(state=state)
+    if item.transition_time is not None:
+        lag = (datetime.now() - item.transition_time).total_seconds()
+        QUEUE_LAG_SECONDS.observe(max(lag, 0.0))
+
+    # Будим отправителя (если он работает в этом же процессе)
+    notification_sender.wake()
+
+async def claim_due_items(ids=None, limit: int = None):
+    """
+    Атомарно переводит наступившие pending-задачи в in_progress.
+    ids — ограничить выборку этими Queue.id (None — все наступившие).
+    limit — захватить не больше стольких, самые ранние по transition_time
+    (None — без ограничения); остальные остаются pending.
+    Возвращает список захваченных Queue.
+
+    Каждая строка захватывается условным UPDATE ... WHERE status='pending'
+    с записью worker_id и lease_until, поэтому ни dispatcher и tick,
+    ни несколько процессов-воркеров не возьмут одну задачу дважды.
+    """
+    if limit is not None and limit <= 0:
+        return []
+    now = datetime.now()
+    lease_until = now + timedelta(seconds=LEASE_TTL)
+    async with AsyncSessionLocal() as session:
         async with session.begin():
-            result = await session.execute(
-                select(Queue)
-                .where(Queue.status == "pending", Queue.transition_time <= now)
+            stmt = select(Queue.id).where(
+                Queue.status == "pending", Queue.transition_time <= now
             )
-            items = result.scalars().all()
+            if ids is not None:
+                stmt = stmt.where(Queue.id.in_(ids))
+            stmt = stmt.order_by(Queue.transition_time, Queue.id)
+            candidates = (await session.execute(stmt)).scalars().all()
+
+            claimed = []
+            for qid in candidates:
+                if limit is not None and len(claimed) >= limit:
+                    break
+                res = await session.execute(
+                    update(Queue)
+                    .where(Queue.id == qid, Queue.status == "pending")
+                    .values(
+                        status="in_progress",
+                        worker_id=WORKER_ID,
+                        lease_until=lease_until,
+                    )
+                )
+                if res.rowcount:
+                    claimed.append(qid)
 
-            for item in items:
-                item.status = "in_progress"
+            if not claimed:
+                return []
+            items = (await session.execute(
+                select(Queue).where(Queue.id.in_(claimed))
+            )).scalars().all()
         # session.begin() автоматически коммитит изменения
+    return items
 
-    # Запускаем обработку вне транзакции
+def start_items(items, bot):
+    """Запускает обработку захваченных задач в фоне."""
     for item in items:
+        _in_flight.add(item.id)
         asyncio.create_task(process_queue_item(item, bot))
 
+    if items:
+        logger.info("Пул переходов: %s", worker_pool.stats())
+
+class Dispatcher:
+    """
+    Событийный диспетчер очереди.
+
+    Держит в памяти heap (transition_time, queue_id) ожидающих задач.
+    Немедленные задачи будят его сразу через schedule(), отложенные
+    (daily) запускаются ровно в transition_time без опроса БД.
+    При старте heap восстанавливается из таблицы queue.
+    """
+    def __init__(self):
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._last_id = 0
+        self.running = False
+
+    def schedule(self, queue_id: int, transition_time: datetime):
+        """
+        Добавляет задачу в heap и будит диспетчер. Если переходы в этом
+        процессе не выполняются (их берут отдельные воркеры) — ничего не делает.
+        """
+        if not self.running:
+            return
+        heapq.heappush(self._heap, (transition_time, queue_id))
+        self._last_id = max(self._last_id, queue_id)
+        self._wake.set()
+
+    def wake(self):
+        """Будит цикл: освободился слот — можно захватить следующие задачи."""
+        self._wake.set()
+
+    async def load(self):
+        """Восстанавливает heap из pending-задач в БД."""
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Queue.transition_time, Queue.id)
+                .where(Queue.status == "pending", Queue.transition_time.isnot(None))
+            )).all()
+        self._heap = [(t, qid) for t, qid in rows]
+        heapq.heapify(self._heap)
+        self._last_id = max((qid for _, qid in rows), default=self._last_id)
+        self._wake.set()
+        logger.info("Диспетчер: загружено %d отложенных задач", len(self._heap))
+
+    async def load_new(self):
+        """
+        Догружает в heap задачи, добавленные в БД другим процессом
+        (ботом) после последней загрузки: только id > последнего виденного.
+        """
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Queue.transition_time, Queue.id)
+                .where(
+                    Queue.id > self._last_id,
+                    Queue.status == "pending",
+                    Queue.transition_time.isnot(None),
+                )
+            )).all()
+        for t, qid in rows:
+            heapq.heappush(self._heap, (t, qid))
+            self._last_id = max(self._last_id, qid)
+        if rows:
+            self._wake.set()
+
+    async def run(self, bot):
+        """
+        Основной цикл. Результаты всегда уходят в outbox (notifications),
+        поэтому bot может быть None — режим отдельного воркера.
+        """
+        self.running = True
+        while True:
+            self._wake.clear()
+            now = datetime.now()
+
+            # Берём из heap не больше, чем есть свободных слотов: остальные
+            # наступившие задачи ждут здесь (или их захватит другой воркер)
+            free = free_slots()
+            due = []
+            while len(due) < free and self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+
+            if due:
+                try:
+                    start_items(await claim_due_items(due, limit=free), bot)
+                except Exception:
+                    # задачи останутся pending — их подберёт страховочный tick
+                    logger.exception("Диспетчер: не удалось захватить задачи")
+                continue
+
+            if self._heap and self._heap[0][0] <= now:
+                # есть наступившие задачи, но все слоты заняты — ждём wake()
+                timeout = None
+            else:
+                timeout = (
+                    (self._heap[0][0] - now).total_seconds() if self._heap else None
+                )
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+# Общий диспетчер процесса
+dispatcher = Dispatcher()
+
+async def sweep_queue(bot):
+    """
+    Страховочный проход по БД: возвращает в очередь задачи с истёкшей
+    арендой и подбирает наступившие задачи, которые диспетчер пропустил.
+    """
+    await reclaim_expired_leases()
+    start_items(await claim_due_items(limit=free_slots()), bot)
+
+async def tick(context: CallbackContext):
+    await sweep_queue(context.bot)
+
 def setup_scheduler(app):
     """
     Настраивает JobQueue PTB:
-      - tick каждую минуту, первый запуск сразу.
+      - страховочный tick раз в TICK_INTERVAL секунд (если переходы
+        выполняет этот же процесс, RUN_WORKERS=1).
+      - перенос старых events/proxy_logs в архив раз в RETENTION_INTERVAL
+        секунд (retention.py; 0 дней хранения — выключено).
+    Основной запуск задач — Dispatcher.run, доставка результатов —
+    NotificationSender (оба стартуют в main.on_startup).
     """
-    app.job_queue.run_repeating(tick, interval=20, first=0)
+    if RUN_WORKERS:
+        app.job_queue.run_repeating(tick, interval=TICK_INTERVAL, first=TICK_INTERVAL)
+    if RETENTION_DAYS > 0:
+        app.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=60)
@@ -0,0 +1,10 @@
+# tests/conftest.py
+#
+# Модули проекта лежат в корне репозитория — делаем их импортируемыми
+# при запуске pytest из любого каталога.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
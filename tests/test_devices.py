@@ -0,0 +1,72 @@
+# tests/test_devices.py
+
+import random
+from collections import Counter
+
+import pytest
+
+from devices import build_alias
+
+
+def _sample(prob, alias, rnd):
+    # та же выборка, что в DeviceCatalog.sample
+    i = rnd.randrange(len(prob))
+    if rnd.random() >= prob[i]:
+        i = alias[i]
+    return i
+
+
+def _exact(prob, alias):
+    """Точные вероятности исходов по таблицам: каждый столбец — 1/n."""
+    n = len(prob)
+    p = [0.0] * n
+    for i in range(n):
+        p[i] += prob[i] / n
+        p[alias[i]] += (1.0 - prob[i]) / n
+    return p
+
+
+@pytest.mark.parametrize("weights", [
+    [1],
+    [1, 1, 1, 1],
+    [1, 2, 3, 4],
+    [0.5, 10, 0.01, 3],
+    [0, 2, 0, 2, 1],
+    [100] + [1] * 99,
+])
+def test_tables_match_weights(weights):
+    prob, alias = build_alias(weights)
+    assert len(prob) == len(alias) == len(weights)
+    assert all(0.0 <= p <= 1.0 for p in prob)
+    assert all(0 <= a < len(weights) for a in alias)
+    total = sum(weights)
+    assert _exact(prob, alias) == pytest.approx([w / total for w in weights], abs=1e-9)
+
+
+def test_zero_weight_never_sampled():
+    prob, alias = build_alias([0, 3, 0, 1])
+    rnd = random.Random(1)
+    counts = Counter(_sample(prob, alias, rnd) for _ in range(20000))
+    assert set(counts) == {1, 3}
+    assert counts[1] / counts[3] == pytest.approx(3, rel=0.1)
+
+
+def test_empty():
+    assert build_alias([]) == ([], [])
+
+
+@pytest.mark.parametrize("weights", [[0], [0, 0, 0], [0.0, 0.0]])
+def test_all_zero_is_uniform(weights):
+    prob, alias = build_alias(weights)
+    n = len(weights)
+    assert _exact(prob, alias) == pytest.approx([1 / n] * n)
+
+
+def test_negative_weight_treated_as_zero():
+    prob, alias = build_alias([-5, 1, 1])
+    assert _exact(prob, alias) == pytest.approx([0, 0.5, 0.5])
+
+
+def test_only_negative_is_uniform():
+    prob, alias = build_alias([-1, -2])
+    assert _exact(prob, alias) == pytest.approx([0.5, 0.5])
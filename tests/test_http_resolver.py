@@ -0,0 +1,96 @@
+# tests/test_http_resolver.py
+
+import pytest
+
+import http_resolver
+from http_resolver import _next_from_html, _is_top_level
+
+
+@pytest.fixture(autouse=True)
+def redirect_timeout(monkeypatch):
+    monkeypatch.setattr(http_resolver, "REDIRECT_TIMEOUT", 20)
+
+
+def _page(head="", body=""):
+    return f"<html><head>{head}</head><body>{body}</body></html>"
+
+
+@pytest.mark.parametrize("html, expected", [
+    # ---------- meta refresh ----------
+    (_page('<meta http-equiv="refresh" content="0; url=https://b.test/">'), ("https://b.test/", False)),
+    (_page("<meta http-equiv=refresh content='5;URL=/next?a=1&amp;b=2'>"), ("/next?a=1&b=2", False)),
+    (_page('<META HTTP-EQUIV="Refresh" CONTENT="0.5, url=\'https://b.test/\'">'), ("https://b.test/", False)),
+    (_page('<meta http-equiv="refresh" content="20; url=https://b.test/">'), ("https://b.test/", False)),
+    # дольше REDIRECT_TIMEOUT браузер ждать не стал бы — страница конечная
+    (_page('<meta http-equiv="refresh" content="300; url=https://b.test/">'), (None, False)),
+    # refresh без адреса — перезагрузка той же страницы
+    (_page('<meta http-equiv="refresh" content="30">'), (None, False)),
+
+    # ---------- JS location верхнего уровня ----------
+    (_page(body='<script>location.href = "https://b.test/";</script>'), ("https://b.test/", False)),
+    (_page(body="<script>window.location.replace('/go')</script>"), ("/go", False)),
+    (_page(body='<script type="text/javascript">\n// редирект\ntop.location = "https://b.test/"</script>'),
+     ("https://b.test/", False)),
+    (_page(body='<script>var a = 1; document.location.assign("https://b.test/");</script>'),
+     ("https://b.test/", False)),
+    (_page(body='<script>/* x */ self.location.href="https://b.test/"</script>'), ("https://b.test/", False)),
+    # якорь и javascript: не переходы, а скрипт остаётся — решает браузер
+    (_page(body='<script>location.href = "#top";</script>'), (None, True)),
+
+    # ---------- условные и отложенные переходы — браузеру ----------
+    (_page(body='<script>if (ok) { location.href = "https://b.test/"; }</script>'), (None, True)),
+    (_page(body='<script>ok && location.replace("https://b.test/")</script>'), (None, True)),
+    (_page(body='<script>function go() { location.href = "https://b.test/"; }</script>'), (None, True)),
+    (_page(body='<script>setTimeout(function () { location.href = "https://b.test/"; }, 100)</script>'),
+     (None, True)),
+    (_page(body='<script>var s = "location.href = \'https://evil.test/\'";</script>'), (None, True)),
+
+    # ---------- внешний скрипт и обработчики ----------
+    (_page(body='<script src="/redirect.js"></script>'), (None, True)),
+    (_page(head='<script async src="https://cdn.test/r.js"></script>'), (None, True)),
+    (_page(body='<script>var x = 1;</script>'), (None, True)),
+    ('<html><body onload="location.href=\'https://b.test/\'"></body></html>', (None, True)),
+    ('<html><body><img src="x.png" onerror="go()"></body></html>', (None, True)),
+    ('<html><body><a href="javascript:void(0)">x</a></body></html>', (None, True)),
+
+    # ---------- страницы без скриптов — конечные ----------
+    (_page(body="<p>Hello, location!</p>"), (None, False)),
+    (_page(body='<a href="/store-location">online store</a>'), (None, False)),
+    (_page(head='<script type="application/ld+json">{"url": "location"}</script>'), (None, False)),
+    ("", (None, False)),
+])
+def test_next_from_html(html, expected):
+    assert _next_from_html(html) == expected
+
+
+def test_meta_refresh_wins_over_script():
+    html = _page(
+        head='<meta http-equiv="refresh" content="0; url=/meta">',
+        body='<script>location.href = "/js"</script>',
+    )
+    assert _next_from_html(html) == ("/meta", False)
+
+
+def test_first_top_level_navigation_of_several():
+    html = _page(body=(
+        '<script>function f() { location.href = "/inner"; }</script>'
+        '<script>location.href = "/outer";</script>'
+    ))
+    assert _next_from_html(html) == ("/outer", False)
+
+
+@pytest.mark.parametrize("script, expected", [
+    ('location.href = "/x"', True),
+    ('var a = 1;\nlocation.href = "/x"', True),
+    ('if (a) {}\nlocation.href = "/x"', True),
+    ('// if (a)\nlocation.href = "/x"', True),
+    ('/* { */ location.href = "/x"', True),
+    ('var s = "{"; location.href = "/x"', True),
+    ('if (a) location.href = "/x"', False),
+    ('a ? location.href = "/x" : 0', False),
+    ('(function () { location.href = "/x" })()', False),
+    ('x = [location.href = "/x"]', False),
+    ('else location.href = "/x"', False),
+])
+def test_is_top_level(script, expected):
+    assert _is_top_level(script, script.index("location")) is expected
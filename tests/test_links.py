@@ -0,0 +1,93 @@
+# tests/test_links.py
+
+import io
+
+from links import LinkCollector
+
+
+def test_text_links_in_order_without_duplicates():
+    c = LinkCollector(limit=10)
+    assert c.add_text("see https://a.ru/x and t.me/chan, then https://a.ru/x again @user")
+    assert c.links == ["https://a.ru/x", "t.me/chan,", "@user"]
+    assert c.duplicates == 1
+    assert not c.truncated
+
+
+def test_no_links():
+    c = LinkCollector(limit=10)
+    assert c.add_text("просто текст без ссылок")
+    assert c.links == [] and c.duplicates == 0
+
+
+def test_limit_stops_parsing():
+    c = LinkCollector(limit=2)
+    c.add_lines(["https://a.ru", "https://b.ru https://c.ru", "https://d.ru"])
+    assert c.links == ["https://a.ru", "https://b.ru"]
+    assert c.truncated
+
+
+def test_exact_limit_is_not_truncated():
+    c = LinkCollector(limit=2)
+    c.add_lines(["https://a.ru", "https://b.ru", "https://a.ru"])
+    assert c.links == ["https://a.ru", "https://b.ru"]
+    assert c.duplicates == 1
+    assert not c.truncated
+
+
+def test_limit_across_calls():
+    c = LinkCollector(limit=1)
+    assert c.add_text("https://a.ru")
+    assert not c.add_text("https://b.ru")
+    assert c.truncated
+
+
+def test_add_lines_stops_reading_after_limit():
+    read = []
+
+    def lines():
+        for i in range(100):
+            read.append(i)
+            yield f"https://site{i}.ru"
+
+    c = LinkCollector(limit=3)
+    c.add_lines(lines())
+    assert len(c.links) == 3
+    # после первой лишней ссылки генератор дальше не читается
+    assert read == [0, 1, 2, 3]
+
+
+def test_txt_file_with_bom():
+    data = "﻿https://a.ru/1\r\nhttps://b.ru/2\n\nhttps://a.ru/1\n".encode("utf-8")
+    c = LinkCollector(limit=10)
+    c.add_file(io.BytesIO(data), csv_format=False)
+    assert c.links == ["https://a.ru/1", "https://b.ru/2"]
+    assert c.duplicates == 1
+
+
+def test_csv_file_cells_do_not_glue_delimiter():
+    data = "name;url;chat\nfirst;https://a.ru/1;\nsecond;https://b.ru/2;t.me/chan\n".encode("utf-8")
+    c = LinkCollector(limit=10)
+    c.add_file(io.BytesIO(data), csv_format=True)
+    assert c.links == ["https://a.ru/1", "https://b.ru/2", "t.me/chan"]
+
+
+def test_csv_comma_and_quoted_cells():
+    data = b'id,link\n1,"https://a.ru/?q=1"\n2,https://b.ru\n'
+    c = LinkCollector(limit=10)
+    c.add_file(io.BytesIO(data), csv_format=True)
+    assert c.links == ["https://a.ru/?q=1", "https://b.ru"]
+
+
+def test_csv_unsniffable_falls_back_to_excel():
+    data = b"https://a.ru/1\n"
+    c = LinkCollector(limit=10)
+    c.add_file(io.BytesIO(data), csv_format=True)
+    assert c.links == ["https://a.ru/1"]
+
+
+def test_invalid_utf8_is_replaced():
+    data = b"https://a.ru/\xff\xfe ok\nhttps://b.ru\n"
+    c = LinkCollector(limit=10)
+    c.add_file(io.BytesIO(data), csv_format=False)
+    assert c.links[1] == "https://b.ru"
+    assert c.links[0].startswith("https://a.ru/")
@@ -0,0 +1,52 @@
+# tests/test_queue_cursor.py
+
+from datetime import datetime
+
+import pytest
+
+from handlers import format_cursor, parse_cursor
+
+# лимит Telegram на callback_data, байт
+CALLBACK_DATA_LIMIT = 64
+
+
+@pytest.mark.parametrize("when, queue_id", [
+    (datetime(2026, 3, 10, 12, 0, 0), 1),
+    (datetime(2026, 3, 10, 12, 0, 0, 123456), 42),
+    (datetime(2026, 12, 31, 23, 59, 59, 999999), 2**31 - 1),
+    (datetime(1999, 1, 1), 0),
+])
+def test_roundtrip(when, queue_id):
+    assert parse_cursor(format_cursor(when, queue_id)) == (when, queue_id)
+
+
+def test_microseconds_keep_ties_apart():
+    # задачи одной пачки отличаются долями секунды — курсор их различает
+    a = format_cursor(datetime(2026, 3, 10, 12, 0, 0, 1), 7)
+    b = format_cursor(datetime(2026, 3, 10, 12, 0, 0, 2), 7)
+    assert a != b
+    assert parse_cursor(a) < parse_cursor(b)
+
+
+def test_fits_callback_data():
+    big_id = 2**31 - 1
+    cursor = format_cursor(datetime(2026, 12, 31, 23, 59, 59, 999999), big_id)
+    for data in (f"queue:f:{cursor}", f"queue:b:{cursor}", f"del_queue:{big_id}:{cursor}"):
+        assert len(data.encode()) <= CALLBACK_DATA_LIMIT
+
+
+def test_survives_callback_split():
+    # show_queue и on_delete_queue режут callback_data по ":"
+    when = datetime(2026, 3, 10, 9, 5, 1, 500)
+    cursor = format_cursor(when, 15)
+    assert ":" not in cursor
+    _, direction, raw = f"queue:b:{cursor}".split(":", 2)
+    assert direction == "b" and parse_cursor(raw) == (when, 15)
+    _, sid, *page = f"del_queue:3:{cursor}".split(":", 2)
+    assert sid == "3" and parse_cursor(page[0]) == (when, 15)
+
+
+@pytest.mark.parametrize("raw", ["", "garbage", "20260310.5", "20260310120000000000.x"])
+def test_malformed(raw):
+    with pytest.raises(ValueError):
+        parse_cursor(raw)
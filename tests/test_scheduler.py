@@ -0,0 +1,140 @@
+# tests/test_scheduler.py
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import scheduler
+from scheduler import SlotScheduler, daily_window, slot_capacity
+
+NOW = datetime(2026, 3, 10, 12, 0, 0)
+
+
+class _Rows:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def all(self):
+        return self._rows
+
+
+class FakeSession:
+    """Вместо БД: execute() отдаёт заранее заданные (transition_time, user_id)."""
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    async def execute(self, stmt):
+        return _Rows(self.rows)
+
+
+def _pick(sched, session, user_id=1, count=1, now=NOW):
+    return asyncio.run(sched.pick(session, user_id, count, now=now))
+
+
+def _slot(sched, when, start=NOW):
+    return int((when - start) / sched.slot)
+
+
+# ---------- daily_window ----------
+
+def test_window_rest_of_today():
+    assert daily_window(NOW) == (NOW, datetime(2026, 3, 10, 23, 59, 59))
+
+
+def test_window_tomorrow_near_midnight():
+    late = datetime(2026, 3, 10, 22, 30)
+    assert daily_window(late) == (
+        datetime(2026, 3, 11, 0, 0, 0), datetime(2026, 3, 11, 23, 59, 59)
+    )
+
+
+def test_window_two_hours_before_midnight_stays_today():
+    edge = datetime(2026, 3, 10, 21, 59, 59)
+    assert daily_window(edge) == (edge, datetime(2026, 3, 10, 23, 59, 59))
+
+
+# ---------- slot_capacity ----------
+
+def test_capacity_from_config(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_SLOT_CAPACITY", 7)
+    assert slot_capacity() == 7
+
+
+def test_capacity_from_workers(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_SLOT_CAPACITY", 0)
+    monkeypatch.setattr(scheduler, "WORKER_CONCURRENCY", 2)
+    monkeypatch.setattr(scheduler, "SCHEDULE_WORKER_PROCESSES", 3)
+    monkeypatch.setattr(scheduler, "SCHEDULE_SLOT_SECONDS", 300)
+    monkeypatch.setattr(scheduler, "SCHEDULE_TRANSITION_SECONDS", 30)
+    monkeypatch.setattr(scheduler, "SCHEDULE_TARGET_LOAD", 0.5)
+    # 2 * 3 * 300 / 30 * 0.5
+    assert slot_capacity() == 30
+
+
+def test_capacity_at_least_one(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULE_SLOT_CAPACITY", 0)
+    monkeypatch.setattr(scheduler, "SCHEDULE_TARGET_LOAD", 0.0)
+    assert slot_capacity() == 1
+
+
+# ---------- SlotScheduler.pick ----------
+
+def test_picks_inside_window_sorted():
+    random.seed(1)
+    sched = SlotScheduler(slot_seconds=300, capacity=5)
+    picks = _pick(sched, FakeSession(), count=50)
+    start, end = daily_window(NOW)
+    assert len(picks) == 50
+    assert picks == sorted(picks)
+    assert all(start <= p <= end for p in picks)
+
+
+def test_batch_respects_capacity():
+    random.seed(2)
+    sched = SlotScheduler(slot_seconds=3600, capacity=2)
+    # окно 12:00–23:59:59 — 12 часовых слотов по 2 места
+    picks = _pick(sched, FakeSession(), count=24)
+    per_slot = [_slot(sched, p) for p in picks]
+    assert sorted(per_slot) == sorted(list(range(12)) * 2)
+
+
+def test_full_slots_are_skipped():
+    random.seed(3)
+    sched = SlotScheduler(slot_seconds=3600, capacity=2)
+    booked = [(NOW + timedelta(hours=h, minutes=10), 99) for h in range(11) for _ in range(2)]
+    for _ in range(20):
+        (pick,) = _pick(sched, FakeSession(booked), user_id=1)
+        # свободен только последний слот
+        assert _slot(sched, pick) == 11
+
+
+def test_overbooked_window_goes_to_least_loaded_slot():
+    random.seed(4)
+    sched = SlotScheduler(slot_seconds=3600, capacity=1)
+    booked = [(NOW + timedelta(hours=h, minutes=5), 99) for h in range(12) for _ in range(2)]
+    booked.append((NOW + timedelta(hours=3, minutes=5), 99))
+    picks = _pick(sched, FakeSession(booked), count=11)
+    # все слоты заняты сверх ёмкости — в каждый, кроме перегруженного, по одной
+    assert sorted(_slot(sched, p) for p in picks) == [h for h in range(12) if h != 3]
+
+
+def test_same_user_spread_across_slots():
+    random.seed(5)
+    sched = SlotScheduler(slot_seconds=3600, capacity=100)
+    picks = _pick(sched, FakeSession(), count=12)
+    # штраф за свой слот разводит пачку: повторов заметно меньше случайных
+    assert len({_slot(sched, p) for p in picks}) >= 8
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_own_booking_penalised(seed):
+    random.seed(seed)
+    sched = SlotScheduler(slot_seconds=3600, capacity=100)
+    own = FakeSession([(NOW + timedelta(hours=h, minutes=1), 1) for h in range(6)])
+    picks = [_pick(sched, own, user_id=1)[0] for _ in range(200)]
+    in_own = sum(1 for p in picks if _slot(sched, p) < 6)
+    # без штрафа в первые 6 слотов из 12 попадала бы половина выборов,
+    # со штрафом — около пятой части
+    assert in_own < 70
@@ -0,0 +1,101 @@
+# tests/test_tracer.py
+
+import time
+import threading
+
+from seleniumwire.request import Request, Response
+
+from driver_pool import PooledDriver
+from tracer import trace_navigation
+
+# Заголовки навигации Chrome на http:// — без Sec-Fetch-*
+HTTP_NAV = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,*/*;q=0.8",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+
+class FakeDriver:
+    current_url = "about:blank"
+
+
+def _request(url, headers):
+    return Request(method="GET", url=url, headers=list(headers.items()), body=b"")
+
+
+def _response(status, headers=()):
+    return Response(status_code=status, reason="", headers=list(headers), body=b"")
+
+
+def _navigate(pd, url, status, location=None, headers=HTTP_NAV):
+    """Как selenium-wire: интерсептор запроса, затем ответа (копия запроса)."""
+    pd.request_interceptor(_request(url, headers))
+    extra = [("Location", location)] if location else []
+    pd.response_interceptor(_request(url, headers), _response(status, extra))
+    pd.driver.current_url = url
+
+
+def test_plain_http_redirect_and_js_chain():
+    pd = PooledDriver(FakeDriver())
+    _navigate(pd, "http://a.test/", 302, "http://b.test/js")
+    # страница b.test/js уводит скриптом на c.test
+    _navigate(pd, "http://b.test/js", 200)
+    pd.request_interceptor(_request("http://b.test/x.png", {"Accept": "image/avif,*/*"}))
+    _navigate(pd, "http://c.test/final", 200)
+
+    started = time.monotonic()
+    final_url, hops = trace_navigation(pd, quiet_window=0.2, timeout=5, poll=0.02)
+    elapsed = time.monotonic() - started
+
+    assert final_url == "http://c.test/final"
+    assert [(h["url"], h["status"], h["location"]) for h in hops] == [
+        ("http://a.test/", 302, "http://b.test/js"),
+        ("http://b.test/js", 200, None),
+        ("http://c.test/final", 200, None),
+    ]
+    assert all(h["dur"] is not None for h in hops)
+    # цепочка затихла — ждём quiet_window, а не весь timeout
+    assert elapsed < 1
+
+
+def test_waits_for_pending_hop():
+    pd = PooledDriver(FakeDriver())
+    pd.request_interceptor(_request("http://slow.test/", HTTP_NAV))
+    pd.driver.current_url = "http://slow.test/"
+
+    def answer():
+        time.sleep(0.3)
+        pd.response_interceptor(_request("http://slow.test/", HTTP_NAV), _response(200))
+
+    threading.Thread(target=answer).start()
+    started = time.monotonic()
+    final_url, hops = trace_navigation(pd, quiet_window=0.1, timeout=5, poll=0.02)
+    assert time.monotonic() - started >= 0.3
+    assert hops[0]["status"] == 200
+
+
+def test_url_change_without_captured_navigation_ends_wait():
+    # навигации не перехвачены (например, из кэша) — хватает смены current_url
+    pd = PooledDriver(FakeDriver())
+    pd.driver.current_url = "http://cached.test/"
+    started = time.monotonic()
+    final_url, hops = trace_navigation(pd, quiet_window=0.2, timeout=5, poll=0.02)
+    assert final_url == "http://cached.test/"
+    assert hops == []
+    assert time.monotonic() - started < 1
+
+
+def test_nothing_happens_until_timeout():
+    pd = PooledDriver(FakeDriver())
+    started = time.monotonic()
+    final_url, hops = trace_navigation(pd, quiet_window=0.05, timeout=0.3, poll=0.02)
+    assert final_url == "about:blank" and hops == []
+    assert time.monotonic() - started >= 0.3
+
+
+def test_https_frames_are_not_hops():
+    pd = PooledDriver(FakeDriver())
+    _navigate(pd, "https://a.test/", 200, headers={"Sec-Fetch-Dest": "document"})
+    pd.request_interceptor(_request("https://ads.test/frame", {"Sec-Fetch-Dest": "iframe"}))
+    final_url, hops = trace_navigation(pd, quiet_window=0.1, timeout=5, poll=0.02)
+    assert [h["url"] for h in hops] == ["https://a.test/"]
@@ -0,0 +1,106 @@
+# tests/test_worker_pool.py
+
+import asyncio
+from collections import Counter
+
+from worker_pool import WorkerPool
+
+
+async def _run(pool, jobs):
+    """
+    Запускает jobs — список (user_id, domain) — через pool и возвращает
+    пиковую занятость слотов: (всего, {домен: n}, {пользователь: n}).
+    """
+    active = {"all": Counter(), "domain": Counter(), "user": Counter()}
+    peak = {"all": Counter(), "domain": Counter(), "user": Counter()}
+
+    async def job(user_id, domain):
+        async with pool.slot(user_id, domain):
+            keys = {"all": "all", "domain": domain, "user": user_id}
+            for kind, key in keys.items():
+                active[kind][key] += 1
+                peak[kind][key] = max(peak[kind][key], active[kind][key])
+            await asyncio.sleep(0.01)
+            for kind, key in keys.items():
+                active[kind][key] -= 1
+
+    await asyncio.wait_for(asyncio.gather(*(job(u, d) for u, d in jobs)), timeout=5)
+    return peak["all"]["all"], dict(peak["domain"]), dict(peak["user"])
+
+
+def test_global_cap():
+    pool = WorkerPool(size=3)
+    peak, _, _ = asyncio.run(_run(pool, [(i, f"d{i}") for i in range(10)]))
+    assert peak == 3
+    stats = pool.stats()
+    assert stats["completed"] == 10
+    assert stats["active"] == 0 and stats["waiting"] == 0
+    assert stats["wait_max"] > 0
+
+
+def test_per_domain_cap():
+    pool = WorkerPool(size=10, per_domain=2)
+    jobs = [(i, "a.com") for i in range(6)] + [(100 + i, "b.com") for i in range(3)]
+    peak, by_domain, _ = asyncio.run(_run(pool, jobs))
+    assert by_domain == {"a.com": 2, "b.com": 2}
+    assert peak == 4
+
+
+def test_per_user_cap():
+    pool = WorkerPool(size=10, per_user=1)
+    jobs = [(1, f"d{i}") for i in range(4)] + [(2, "x.com")]
+    _, _, by_user = asyncio.run(_run(pool, jobs))
+    assert by_user == {1: 1, 2: 1}
+
+
+def test_all_caps_together():
+    pool = WorkerPool(size=4, per_domain=2, per_user=2)
+    jobs = [(u, d) for u in range(3) for d in ("a.com", "b.com", "c.com")]
+    peak, by_domain, by_user = asyncio.run(_run(pool, jobs))
+    assert peak == 4
+    assert max(by_domain.values()) == 2
+    assert max(by_user.values()) == 2
+    assert pool.stats()["completed"] == len(jobs)
+
+
+def test_busy_domain_does_not_block_others():
+    async def scenario():
+        pool = WorkerPool(size=3, per_domain=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with pool.slot(1, "busy.com"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        # второй переход на busy.com ждёт, а другой домен проходит сразу
+        async with pool.slot(2, "other.com"):
+            stats = pool.stats()
+        release.set()
+        await asyncio.wait_for(asyncio.gather(holder, queued), timeout=1)
+        return stats, pool
+
+    stats, pool = asyncio.run(scenario())
+    assert stats["active"] == 2 and stats["waiting"] == 1
+    assert pool.stats()["completed"] == 3
+
+
+def test_slot_released_on_error():
+    async def scenario():
+        pool = WorkerPool(size=1, per_domain=1, per_user=1)
+        try:
+            async with pool.slot(1, "a.com"):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        # счётчики освобождены — слот можно взять снова
+        async with pool.slot(1, "a.com"):
+            pass
+        return pool
+
+    pool = asyncio.run(asyncio.wait_for(scenario(), timeout=1))
+    assert pool.stats()["completed"] == 2
+    assert not pool._by_domain and not pool._by_user
@@ -0,0 +1,86 @@
+# tracer.py
+
+import time
+
+from driver_pool import is_navigation
+
+# Больше хопов не храним: дальше это уже зацикливание
+MAX_HOPS = 30
+
+
+def _ms(delta) -> int:
+    return int(delta.total_seconds() * 1000)
+
+
+def trace_navigation(pd, quiet_window: float, timeout: float, poll: float = 0.1):
+    """
+    Следит за навигациями основного фрейма после pd.driver.get():
+    3xx (Location), JS-переходы и meta refresh — каждая из них
+    проходит через selenium-wire отдельным document-запросом и
+    запоминается в pd.navigations (driver_pool.PooledDriver).
+
+    Цепочка считается завершённой, когда все навигации получили ответ
+    и ни новых навигаций, ни смены current_url не было quiet_window
+    секунд. Хватает и одной смены current_url на http(s)-адрес без
+    перехваченных навигаций. Не дольше timeout секунд в сумме.
+
+    Возвращает (final_url, hops), где hops — список
+      {"url": str, "status": int|None, "location": str|None,
+       "ms": int,       # от начала отслеживания до запроса
+       "dur": int|None} # время до ответа
+    """
+    driver = pd.driver
+    started = time.monotonic()
+    started_at = None
+    seen = {}
+    last_activity = started
+    last_url = None
+    # браузер уже на http(s)-странице — есть что считать концом цепочки
+    landed = False
+
+    while True:
+        now = time.monotonic()
+        pending = False
+        for req in pd.snapshot_navigations():
+            if not is_navigation(req):
+                continue
+            if started_at is None:
+                started_at = req.date
+            # id запроса selenium-wire присваивает уже после интерсептора
+            hop = seen.get(id(req))
+            if hop is None:
+                if len(seen) >= MAX_HOPS:
+                    continue
+                hop = seen[id(req)] = {
+                    "url": req.url,
+                    "status": None,
+                    "location": None,
+                    "ms": _ms(req.date - started_at),
+                    "dur": None,
+                }
+                last_activity = now
+            if req.response is None:
+                pending = True
+            elif hop["status"] is None:
+                hop["status"] = req.response.status_code
+                hop["location"] = req.response.headers.get("Location")
+                hop["dur"] = _ms(req.response.date - req.date)
+                last_activity = now
+
+        try:
+            current = driver.current_url
+        except Exception:
+            current = last_url
+        if current != last_url:
+            # смена URL без запроса (history API) — тоже активность
+            last_url = current
+            last_activity = now
+            landed = landed or str(current).startswith(("http://", "https://"))
+
+        if (seen or landed) and not pending and now - last_activity >= quiet_window:
+            break
+        if now - started >= timeout:
+            break
+        time.sleep(poll)
+
+    return last_url, list(seen.values())
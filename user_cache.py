@@ -0,0 +1,90 @@
+# user_cache.py
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from config import USER_CACHE_TTL
+
+# Маркер «в кэше ничего нет» (в отличие от None — «пользователя нет»)
+MISS = object()
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Снимок полей User, нужных хэндлерам (без привязки к сессии)."""
+    id: int
+    user_id: Optional[int]
+    username: str
+    role: str
+    status: str
+    transition_mode: str
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(
+            id=user.id,
+            user_id=user.user_id,
+            username=user.username,
+            role=user.role,
+            status=user.status,
+            transition_mode=user.transition_mode,
+        )
+
+
+class UserCache:
+    """
+    Кэш пользователей процесса по Telegram ID и username с TTL.
+
+    Хранит и отрицательные ответы («такого пользователя нет») по
+    Telegram ID, чтобы посторонние не нагружали БД. Все изменения
+    пользователей в хэндлерах явно вызывают invalidate()/put().
+    """
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._by_id = {}
+        self._by_username = {}
+
+    def get(self, telegram_id: int):
+        """
+        Возвращает CachedUser, None (известно, что пользователя нет)
+        или MISS, если в кэше ничего нет либо запись устарела.
+        """
+        entry = self._by_id.get(telegram_id)
+        if entry is None:
+            return MISS
+        expires, user = entry
+        if expires < time.monotonic():
+            del self._by_id[telegram_id]
+            return MISS
+        return user
+
+    def put(self, telegram_id: int, user: Optional[CachedUser]):
+        expires = time.monotonic() + self.ttl
+        self._by_id[telegram_id] = (expires, user)
+        if user is not None:
+            self._by_username[user.username] = (expires, user)
+
+    def invalidate(self, telegram_id: int = None, username: str = None):
+        """Сбрасывает запись по любому из ключей (вместе со вторым ключом)."""
+        if telegram_id is not None:
+            _, user = self._by_id.pop(telegram_id, (None, None))
+            if user is not None:
+                self._by_username.pop(user.username, None)
+        if username is not None:
+            _, user = self._by_username.pop(username, (None, None))
+            if user is not None and user.user_id is not None:
+                self._by_id.pop(user.user_id, None)
+
+    def forget_missing(self):
+        """
+        Сбрасывает отрицательные записи: после приглашения нового
+        пользователя кто-то из «неизвестных» мог стать известным.
+        """
+        self._by_id = {
+            tid: entry for tid, entry in self._by_id.items() if entry[1] is not None
+        }
+
+
+# Общий кэш процесса бота
+user_cache = UserCache(USER_CACHE_TTL)
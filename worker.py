@@ -0,0 +1,76 @@
+# worker.py
+#
+# Отдельный процесс-воркер: только разбирает очередь и выполняет переходы.
+# Бот (main.py с RUN_WORKERS=0) принимает ссылки и доставляет результаты;
+# обмен идёт через таблицы queue и notifications, так что можно запускать
+# один бот и N воркеров на одну БД.
+import asyncio
+import logging
+
+from config import (
+    WORKER_POLL_INTERVAL,
+    TICK_INTERVAL,
+    WORKER_ID,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+from db import init_db
+from redirector import proxy_reservoir, start_browser, close_browser
+from tasks import dispatcher, reclaim_expired_leases, sweep_queue
+from writer import write_behind
+from metrics import start_metrics_server
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger("worker")
+
+async def poll_new_items():
+    """Подхватывает задачи, которые бот добавил после старта воркера."""
+    while True:
+        await asyncio.sleep(WORKER_POLL_INTERVAL)
+        try:
+            await dispatcher.load_new()
+        except Exception:
+            logger.exception("Не удалось загрузить новые задачи")
+
+async def sweep_periodically():
+    """Страховочный проход: истёкшие аренды и пропущенные задачи."""
+    while True:
+        await asyncio.sleep(TICK_INTERVAL)
+        try:
+            await sweep_queue(None)
+        except Exception:
+            logger.exception("Страховочный проход не удался")
+
+async def run():
+    await init_db()
+    await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    await reclaim_expired_leases()
+    await dispatcher.load()
+    write_behind.start()
+
+    await start_browser()
+    proxy_reservoir.start()
+    logger.info("Воркер %s запущен", WORKER_ID)
+
+    try:
+        await asyncio.gather(
+            dispatcher.run(None),
+            poll_new_items(),
+            sweep_periodically(),
+        )
+    finally:
+        await write_behind.close()
+        proxy_reservoir.stop()
+        await close_browser()
+
+def main():
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# worker_pool.py
+
+import time
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+
+
+class WorkerPool:
+    """
+    Ограничитель параллельных переходов.
+
+    Слот выдаётся, только когда свободны сразу все три лимита:
+      - глобальный (size),
+      - на целевой домен (per_domain, 0 — без ограничения),
+      - на пользователя (per_user, 0 — без ограничения).
+    Так популярный домен или один «тяжёлый» пользователь не займут
+    все слоты. stats() — загрузка пула и время ожидания слота.
+    """
+    def __init__(self, size: int, per_domain: int = 0, per_user: int = 0):
+        self.size = size
+        self.per_domain = per_domain
+        self.per_user = per_user
+
+        self._cond = asyncio.Condition()
+        self._active = 0
+        self._by_domain = Counter()
+        self._by_user = Counter()
+        self._waiting = 0
+
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _fits(self, user_id, domain) -> bool:
+        if self._active >= self.size:
+            return False
+        if self.per_domain and self._by_domain[domain] >= self.per_domain:
+            return False
+        if self.per_user and self._by_user[user_id] >= self.per_user:
+            return False
+        return True
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, domain: str):
+        started = time.monotonic()
+        async with self._cond:
+            self._waiting += 1
+            try:
+                await self._cond.wait_for(lambda: self._fits(user_id, domain))
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self._by_domain[domain] += 1
+            self._by_user[user_id] += 1
+
+        waited = time.monotonic() - started
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._active -= 1
+                self._by_domain[domain] -= 1
+                if not self._by_domain[domain]:
+                    del self._by_domain[domain]
+                self._by_user[user_id] -= 1
+                if not self._by_user[user_id]:
+                    del self._by_user[user_id]
+                self.completed += 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "capacity": self.size,
+            "utilization": self._active / self.size if self.size else 0.0,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+            "wait_max": self.wait_max,
+        }
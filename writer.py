@@ -0,0 +1,195 @@
+# writer.py
+
+import time
+import asyncio
+import logging
+
+from sqlalchemy import update
+
+from db import AsyncSessionLocal
+from models import Queue
+from rollups import bump_daily_success
+from config import WORKER_ID, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, WRITE_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+
+class WriteGroup:
+    """
+    Записи одного перехода (или одного сообщения), которые должны попасть
+    в БД вместе:
+      rows            — новые ORM-объекты (Event, ProxyLog, Notification…);
+      queue_id        — если задан, группа пишется только при условии, что
+                        задача всё ещё арендована этим воркером; заодно
+                        она помечается done;
+      success_user_id — кому добавить +1 в user_daily_stats.
+    """
+    __slots__ = ("rows", "queue_id", "success_user_id", "future", "attempts")
+
+    def __init__(self, rows, queue_id=None, success_user_id=None, future=None):
+        self.rows = rows
+        self.queue_id = queue_id
+        self.success_user_id = success_user_id
+        self.future = future
+        # неудачные попытки записи в одиночку (для групп без future)
+        self.attempts = 0
+
+
+class WriteBehind:
+    """
+    Отложенная запись: копит вставки Event/ProxyLog и сбрасывает их
+    одной транзакцией, когда набралось WRITE_BATCH_SIZE групп или прошло
+    WRITE_FLUSH_INTERVAL секунд с первой из них. На SQLite это вместо
+    commit (и fsync) на каждый переход — один на пачку. Если пачка не
+    записалась, группы пишутся по одной: ошибка достаётся только своей.
+
+    close() досбрасывает всё накопленное — вызывать при остановке.
+    """
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._groups = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self._lock = asyncio.Lock()
+
+        self.flushes = 0
+        self.groups_written = 0
+
+    def add(self, *rows):
+        """Вставка без ожидания результата (например, события no_link)."""
+        self._enqueue(WriteGroup(list(rows)))
+
+    async def submit(self, rows, queue_id=None, success_user_id=None) -> bool:
+        """
+        Ставит группу в очередь и ждёт её фиксации в БД.
+        Возвращает False, если задачу queue_id перехватил другой воркер
+        (тогда группа не записана).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(WriteGroup(rows, queue_id, success_user_id, future))
+        return await future
+
+    def _enqueue(self, group: WriteGroup):
+        self._groups.append(group)
+        if self._task is None:
+            # писатель не запущен (скрипт, тест) — пишем сразу
+            asyncio.get_running_loop().create_task(self.flush())
+            return
+        self._has_items.set()
+        if len(self._groups) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        async with self._lock:
+            groups, self._groups = self._groups, []
+            self._has_items.clear()
+            self._full.clear()
+            if not groups:
+                return
+
+            started = time.monotonic()
+            try:
+                async with AsyncSessionLocal() as session:
+                    async with session.begin():
+                        results = [await self._write_group(session, group) for group in groups]
+            except Exception:
+                # Одна плохая группа не должна топить всю пачку: пишем
+                # каждую группу отдельной транзакцией
+                logger.exception(
+                    "Пачка из %d групп не записалась, пишем группы по одной", len(groups)
+                )
+                results = [await self._write_alone(group) for group in groups]
+
+            written = []
+            for group, result in zip(groups, results):
+                if result is None:
+                    continue
+                if group.future and not group.future.done():
+                    group.future.set_result(result)
+                if result:
+                    written.append(group)
+            self.flushes += 1
+            self.groups_written += len(written)
+            logger.debug(
+                "Записано групп: %d за %.3f с", len(written), time.monotonic() - started
+            )
+
+    @staticmethod
+    async def _write_group(session, group: WriteGroup) -> bool:
+        """Пишет группу в открытую транзакцию; False — аренда задачи не наша."""
+        if group.queue_id is not None:
+            res = await session.execute(
+                update(Queue)
+                .where(
+                    Queue.id == group.queue_id,
+                    Queue.worker_id == WORKER_ID,
+                )
+                .values(status="done", lease_until=None)
+            )
+            if not res.rowcount:
+                return False
+        session.add_all(group.rows)
+        if group.success_user_id is not None:
+            await bump_daily_success(session, group.success_user_id)
+        return True
+
+    async def _write_alone(self, group: WriteGroup):
+        """
+        Пишет группу своей транзакцией. При ошибке исключение получает
+        только её future; группу из add() (без future) возвращаем в буфер
+        до WRITE_MAX_ATTEMPTS попыток. None — группа не записана.
+        """
+        try:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    return await self._write_group(session, group)
+        except Exception as e:
+            group.attempts += 1
+            if group.future:
+                logger.exception("Не удалось записать группу (задача %s)", group.queue_id)
+                group.future.set_exception(e)
+            elif group.attempts < WRITE_MAX_ATTEMPTS:
+                logger.warning(
+                    "Не удалось записать группу, попытка %d из %d: %s",
+                    group.attempts, WRITE_MAX_ATTEMPTS, e,
+                )
+                self._enqueue(group)
+            else:
+                logger.exception(
+                    "Группа из %d строк отброшена после %d попыток", len(group.rows), group.attempts
+                )
+            return None
+
+    async def _run(self):
+        while not self._closing:
+            await self._has_items.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Останавливает фоновый цикл, не прерывая текущую запись,
+        и сбрасывает накопленное на диск.
+        """
+        if self._task is not None:
+            self._closing = True
+            self._has_items.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+# Общий писатель процесса
+write_behind = WriteBehind(WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL)